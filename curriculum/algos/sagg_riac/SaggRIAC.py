@@ -1,6 +1,5 @@
 import collections
 import random
-import operator
 import numpy as np
 
 from matplotlib import pyplot as plt
@@ -12,14 +11,20 @@ from curriculum.logging.visualization import save_image
 from rllab.misc import logger
 
 
+def _slice_bounds(index, length):
+    # bounds of python slices [index:] of sequences of the given lengths, with negative indices from the end
+    return np.where(index < 0, np.maximum(index + length, 0), np.minimum(index, length))
+
+
 class Region(object):
 
     def __init__(self, min_border, max_border, max_history=500, max_goals=500, num_random_splits=50, mode3_noise=0.1):
         # self.states = collections.deque(maxlen=max_history)
         # self.competences = collections.deque(maxlen=max_history)
 
-        self.states = []
-        self.competences = []
+        # the states and competences are stored in arrays grown by doubling their size
+        self._states = np.zeros((0, len(min_border)))
+        self._competences = np.zeros(0)
 
         self.min_border = min_border
         self.max_border = max_border
@@ -28,13 +33,41 @@ class Region(object):
         self.max_history = max_history
         self.num_random_splits = num_random_splits
         self.mode3_noise = mode3_noise
+        # set by optimal_split
+        self.split_dim = None
+        self.split_val = None
+
+    @property
+    def states(self):
+        return self._states[:self.num_goals]
+
+    @property
+    def competences(self):
+        return self._competences[:self.num_goals]
+
+    def _reserve(self, num_goals):
+        if num_goals > len(self._competences):
+            size = max(num_goals, 2 * len(self._competences), 16)
+            states = np.zeros((size, self._states.shape[1]))
+            states[:self.num_goals] = self.states
+            competences = np.zeros(size)
+            competences[:self.num_goals] = self.competences
+            self._states, self._competences = states, competences
 
     # Add this state and competence to the region.
     def add_state(self, state, competence):
-        self.states.append(state)
-        self.competences.append(competence)
+        self._reserve(self.num_goals + 1)
+        self._states[self.num_goals] = state
+        self._competences[self.num_goals] = competence
         self.num_goals += 1
 
+    # Add these states and competences to the region, in order.
+    def add_states(self, states, competences):
+        self._reserve(self.num_goals + len(competences))
+        self._states[self.num_goals:self.num_goals + len(competences)] = states
+        self._competences[self.num_goals:self.num_goals + len(competences)] = competences
+        self.num_goals += len(competences)
+
     def is_too_big(self):
         # Split this region if it has too many goals, and if some of the goals have a positive competence!
         # Otherwise, if the competences are all 0, then there is no point in splitting.
@@ -56,57 +89,91 @@ class Region(object):
 
         return [region1, region2, success]
 
+    def contains_all(self, states):
+        return np.logical_and(np.less_equal(self.min_border, states).all(axis=1),
+                              np.less_equal(states, self.max_border).all(axis=1))
+
     def assign_states_to_regions(self, region1, region2):
         # Reassign all goals to one of these regions.
-        for state, competence in zip(self.states, self.competences):
-            if region1.contains(state):
-                region1.add_state(state, competence)
-            elif region2.contains(state):
-                region2.add_state(state, competence)
-            else:
-                logger.log("Region 1: " + str(region1.min_border) + " " + str(region1.max_border))
-                logger.log("Region 2: " + str(region2.min_border) + " " + str(region2.max_border))
-                raise Exception("Split region; now cannot find region for state: " + str(state))
+        in_region1 = region1.contains_all(self.states)
+        in_region2 = np.logical_and(np.logical_not(in_region1), region2.contains_all(self.states))
+        if not np.all(np.logical_or(in_region1, in_region2)):
+            state = self.states[np.logical_not(np.logical_or(in_region1, in_region2))][0]
+            logger.log("Region 1: " + str(region1.min_border) + " " + str(region1.max_border))
+            logger.log("Region 2: " + str(region2.min_border) + " " + str(region2.max_border))
+            raise Exception("Split region; now cannot find region for state: " + str(state))
+        region1.add_states(self.states[in_region1], self.competences[in_region1])
+        region2.add_states(self.states[in_region2], self.competences[in_region2])
+
+    def compute_subset_interests(self, masks):
+        """
+        Interest that the regions holding the given subsets of the states of this region would have (see
+        compute_interest), for all subsets at once.
+        :param masks: boolean array of shape (num_subsets, num_goals)
+        """
+        num_states = np.sum(masks, axis=1)
+        # position of each state in its subset, as the order of the states is kept
+        ranks = np.cumsum(masks, axis=1) - 1
+        half_history = int(self.max_history / 2)
+
+        def local_measures(start_index, end_index):
+            start_index = _slice_bounds(start_index, num_states)[:, None]
+            end_index = _slice_bounds(end_index, num_states)[:, None]
+            in_range = np.logical_and(masks, np.logical_and(ranks >= start_index, ranks < end_index))
+            return in_range.dot(self.competences)
+
+        old_measures = local_measures(num_states - self.max_history, num_states - half_history)
+        new_measures = local_measures(num_states - half_history, num_states)
+        return np.abs(old_measures - new_measures) / np.maximum(num_states, 1)
 
     def optimal_split(self):
         # All split scores must be >= 0
-        max_split_score = -1
-        max_region1 = None
-        max_region2 = None
-
         num_dim = len(self.min_border)
+        split_dims = []
+        split_vals = []
         for i in range(self.num_random_splits):
             split_dim = random.randrange(num_dim)
-            split_val = random.uniform(self.min_border[split_dim], self.max_border[split_dim])
-            region1, region2 = self.make_regions(split_dim, split_val)
-            self.assign_states_to_regions(region1, region2)
-            split_score = len(region1.states) * len(region2.states) * abs(region1.compute_interest() - region2.compute_interest())
-
-            if split_score > max_split_score:
-                max_region1 = region1
-                max_region2 = region2
-                max_split_score = split_score
-
-        if max_split_score == -1 or max_region1 is None:
+            split_dims.append(split_dim)
+            split_vals.append(random.uniform(self.min_border[split_dim], self.max_border[split_dim]))
+
+        if len(split_dims) > 0:
+            # the states of the first region of each candidate split, which also gets the states on the border
+            in_region1 = self.states[:, split_dims].T <= np.array(split_vals)[:, None]
+            num_states1 = np.sum(in_region1, axis=1)
+            num_states2 = self.num_goals - num_states1
+            split_scores = num_states1 * num_states2 * np.abs(
+                self.compute_subset_interests(in_region1) - self.compute_subset_interests(np.logical_not(in_region1)))
+            split_scores[np.isnan(split_scores)] = -1
+
+        if len(split_dims) == 0 or np.max(split_scores) == -1:
             #TODO - what to do here?
             print("Problem - unable to find a good split!")
-            success = False
-        else:
-            success = True
+            return [None, None, False]
+
+        # the first of the best splits
+        best = np.argmax(split_scores)
+        self.split_dim = split_dims[best]
+        self.split_val = split_vals[best]
+        region1, region2 = self.make_regions(self.split_dim, self.split_val)
+        region1.add_states(self.states[in_region1[best]], self.competences[in_region1[best]])
+        region2.add_states(self.states[~in_region1[best]], self.competences[~in_region1[best]])
+        return [region1, region2, True]
 
-        return [max_region1, max_region2, success]
+    def _make_region(self, min_border, max_border):
+        return Region(min_border, max_border, max_history=self.max_history, max_goals=self.max_goals,
+                      num_random_splits=self.num_random_splits, mode3_noise=self.mode3_noise)
 
     def make_regions(self, split_dim, split_val):
         # For now, just perform a single split.
         region1_min = np.copy(self.min_border)
         region1_max = np.copy(self.max_border)
         region1_max[split_dim] = split_val
-        region1 = Region(region1_min, region1_max, max_history=self.max_history, max_goals=self.max_goals)
+        region1 = self._make_region(region1_min, region1_max)
 
         region2_min = np.copy(self.min_border)
         region2_min[split_dim] = split_val
         region2_max = np.copy(self.max_border)
-        region2 = Region(region2_min, region2_max, max_history=self.max_history, max_goals=self.max_goals)
+        region2 = self._make_region(region2_min, region2_max)
 
         return [region1, region2]
 
@@ -115,18 +182,18 @@ class Region(object):
         region1_min = np.copy(self.min_border)
         region1_max = np.copy(self.max_border)
         region1_max[0] = (self.min_border[0] + self.max_border[0])/2 # Cut the first dimension in half.
-        region1 = Region(region1_min, region1_max, max_history=self.max_history, max_goals=self.max_goals)
+        region1 = self._make_region(region1_min, region1_max)
 
         region2_min = np.copy(self.min_border)
         region2_min[0] = (self.min_border[0] + self.max_border[0])/2 # Cut the first dimension in half.
         region2_max = np.copy(self.max_border)
-        region2 = Region(region2_min, region2_max, max_history=self.max_history, max_goals=self.max_goals)
+        region2 = self._make_region(region2_min, region2_max)
 
         return [region1, region2]
 
     # Compute the sum of the competences in a given range.
     def compute_local_measure(self, start_index, end_index):
-        return np.sum(np.array(self.competences)[start_index:end_index])
+        return np.sum(self.competences[start_index:end_index])
 
     # Compute the derivative of competences.
     def compute_interest(self):
@@ -157,14 +224,39 @@ class Region(object):
 
     def sample_mode3(self):
         # Find the lowest competence goal in this region.
-        min_index, min_value = min(enumerate(self.competences), key=operator.itemgetter(1))
-        bad_goal = np.copy(self.states[min_index])
+        bad_goal = np.copy(self.states[np.argmin(self.competences)])
 
         # Add noise to this goal.
         bad_goal += np.random.normal(0, self.mode3_noise, len(bad_goal))
         return bad_goal.tolist()
 
 
+class RegionNode(object):
+    """
+    Node of the k-d tree of the regions: the leaves hold the current regions, and the inner nodes the splits of the
+    former ones.
+    """
+
+    def __init__(self, region):
+        self.region = region
+        self.split_dim = None
+        self.split_val = None
+        self.children = None
+
+    def split(self, region1, region2, split_dim, split_val):
+        self.region = None
+        self.split_dim = split_dim
+        self.split_val = split_val
+        self.children = (RegionNode(region1), RegionNode(region2))
+
+    def find_leaf(self, state):
+        node = self
+        while node.children is not None:
+            # the states on the border of a split belong to the first region, as when splitting
+            node = node.children[0] if state[node.split_dim] <= node.split_val else node.children[1]
+        return node
+
+
 class SaggRIAC(object):
 
     def __init__(self, state_size, state_range=None, state_center=None, state_bounds=None, max_history=100,
@@ -193,6 +285,7 @@ class SaggRIAC(object):
         # Create a region to represent the entire space.
         self.whole_region = Region(self.min_border, self.max_border, max_history=max_history, max_goals=self.max_goals)
         self.regions.append(self.whole_region)
+        self.region_tree = RegionNode(self.whole_region)
 
     # Limit this sample to the boundaries of the region.
     def limit_sample(self, sample):
@@ -201,12 +294,16 @@ class SaggRIAC(object):
         #sample = max(sample, self.min_border.tolist())
         return sample
 
+    # Find the leaf of the region tree that contains a given state.
+    def find_region_node(self, state):
+        if not self.whole_region.contains(state):
+            raise Exception("Cannot find state: " + str(state) + " in any region!")
+        return self.region_tree.find_leaf(state)
+
     # Find the region that contains a given state.
     def find_region(self, state):
-        for index, region in enumerate(self.regions):
-            if region.contains(state):
-                return [index, region]
-        raise Exception("Cannot find state: " + str(state) + " in any region!")
+        region = self.find_region_node(state).region
+        return [self.regions.index(region), region]
 
     def add_accidental_states(self, states, extend_dist_rew):
         # Treat these accidental states as if we reached them with the highest competence.
@@ -220,7 +317,8 @@ class SaggRIAC(object):
     def add_states(self, states, competences):
         for state, competence in zip(states, competences):
             # Find the appropriate region for this state.
-            index, region = self.find_region(state)
+            node = self.find_region_node(state)
+            region = node.region
             # Add this state to the region.
             region.add_state(state, competence)
 
@@ -229,9 +327,10 @@ class SaggRIAC(object):
                 [region1, region2, success] = region.split()
                 if success:
                     # Add the subregions and delete the original region.
+                    node.split(region1, region2, region.split_dim, region.split_val)
                     self.regions.append(region1)
                     self.regions.append(region2)
-                    del self.regions[index]
+                    del self.regions[self.regions.index(region)]
 
     # Sample states from the regions.
     def sample_states(self, num_samples):
@@ -119,6 +119,7 @@ class MazeEnv(ProxyEnv, Serializable):
 
         self._goal_range = self._find_goal_range()
         self._cached_segments = None
+        self._build_occupancy_grid()
 
         inner_env = model_cls(file_path=file_path, *args, **kwargs)  # file to the robot specifications
         ProxyEnv.__init__(self, inner_env)  # here is where the robot env will be initialized
@@ -197,39 +198,83 @@ class MazeEnv(ProxyEnv, Serializable):
                     maxy = i * size_scaling + size_scaling * 0.5 - self._init_torso_y
                     return minx, maxx, miny, maxy
 
-    def _is_in_collision(self, pos):
-        x, y = pos
+    def _build_occupancy_grid(self):
+        """
+        Precompute the wall and empty cells of the maze, and the coordinates of the cells, for the collision and
+        feasibility queries.
+        """
         structure = self.MAZE_STRUCTURE
         size_scaling = self.MAZE_SIZE_SCALING
-        for i in range(len(structure)):
-            for j in range(len(structure[0])):
-                if structure[i][j] == 1:
-                    minx = j * size_scaling - size_scaling * 0.5 - self._init_torso_x
-                    maxx = j * size_scaling + size_scaling * 0.5 - self._init_torso_x
-                    miny = i * size_scaling - size_scaling * 0.5 - self._init_torso_y
-                    maxy = i * size_scaling + size_scaling * 0.5 - self._init_torso_y
-                    if minx <= x <= maxx and miny <= y <= maxy:
-                        return True
-        return False
+        n_rows, n_cols = len(structure), len(structure[0])
+        self._wall_grid = np.array([[structure[i][j] == 1 for j in range(n_cols)] for i in range(n_rows)])
+        self._empty_grid = np.array([[structure[i][j] == 'r' or structure[i][j] == 'g' or structure[i][j] == 0
+                                      for j in range(n_cols)] for i in range(n_rows)])
+        # centers and borders of the cells, computed as the former per cell loops did
+        self._cell_x = np.array([j * size_scaling - self._init_torso_x for j in range(n_cols)], dtype=float)
+        self._cell_y = np.array([i * size_scaling - self._init_torso_y for i in range(n_rows)], dtype=float)
+        self._cell_min_x = np.array([j * size_scaling - size_scaling * 0.5 - self._init_torso_x
+                                     for j in range(n_cols)], dtype=float)
+        self._cell_max_x = np.array([j * size_scaling + size_scaling * 0.5 - self._init_torso_x
+                                     for j in range(n_cols)], dtype=float)
+        self._cell_min_y = np.array([i * size_scaling - size_scaling * 0.5 - self._init_torso_y
+                                     for i in range(n_rows)], dtype=float)
+        self._cell_max_y = np.array([i * size_scaling + size_scaling * 0.5 - self._init_torso_y
+                                     for i in range(n_rows)], dtype=float)
+        rows, cols = np.where(self._empty_grid)
+        self._empty_cells = np.stack([self._cell_x[cols], self._cell_y[rows]], axis=1)
+
+    def _candidate_cells(self, points):
+        """
+        :return: row and column indices of the (up to) 4 cells a point can be in, of shape (n_points, 4), and whether
+        they are in the maze
+        """
+        points = np.asarray(points, dtype=float).reshape((-1, 2))
+        size_scaling = self.MAZE_SIZE_SCALING
+        # the cells whose center is just below or just above the point, in each direction
+        col = np.floor((points[:, 0] + self._init_torso_x) / size_scaling).astype(int)
+        row = np.floor((points[:, 1] + self._init_torso_y) / size_scaling).astype(int)
+        cols = (col[:, None] + np.array([0, 1, 0, 1]))
+        rows = (row[:, None] + np.array([0, 0, 1, 1]))
+        inside = (cols >= 0) & (cols < self._wall_grid.shape[1]) & (rows >= 0) & (rows < self._wall_grid.shape[0])
+        return points, np.where(inside, rows, 0), np.where(inside, cols, 0), inside
+
+    def in_collision_n(self, points):
+        """
+        Whether each point is in a wall cell (borders included), for all points at once.
+        :param points: array of shape (n_points, 2)
+        """
+        points, rows, cols, inside = self._candidate_cells(points)
+        x, y = points[:, 0:1], points[:, 1:2]
+        in_cell = (self._cell_min_x[cols] <= x) & (x <= self._cell_max_x[cols]) & \
+                  (self._cell_min_y[rows] <= y) & (y <= self._cell_max_y[rows])
+        return np.any(inside & in_cell & self._wall_grid[rows, cols], axis=1)
+
+    def is_feasible_n(self, points):
+        """
+        Whether each point is strictly inside an empty cell, for all points at once.
+        :param points: array of shape (n_points, 2)
+        """
+        points, rows, cols, inside = self._candidate_cells(points)
+        half_size = self.MAZE_SIZE_SCALING / 2
+        in_cell = (np.abs(points[:, 0:1] - self._cell_x[cols]) < half_size) & \
+                  (np.abs(points[:, 1:2] - self._cell_y[rows]) < half_size)
+        return np.any(inside & in_cell & self._empty_grid[rows, cols], axis=1)
+
+    def _is_in_collision(self, pos):
+        return self.in_collision_n(np.reshape(pos, (1, 2)))[0]
+
+    @property
+    def empty_cells(self):
+        """
+        Centers of the empty cells, of shape (n_empty_cells, 2).
+        """
+        return self._empty_cells
 
     def find_empty_space(self):
-        structure = self.MAZE_STRUCTURE
-        size_scaling = self.MAZE_SIZE_SCALING
-        empty_space = []
-        for i in range(len(structure)):
-            for j in range(len(structure[0])):
-                if structure[i][j] == 'r' or structure[i][j] == 'g' or structure[i][j] == 0:
-                    empty_space.append((j * size_scaling - self._init_torso_x, i * size_scaling - self._init_torso_y))
-                    #return j * size_scaling, i * size_scaling
-        return empty_space
+        return [tuple(cell) for cell in self._empty_cells]
 
     def is_feasible(self, pos):  # the arg is the goal, not the full space!!!
-        empty_space = self.find_empty_space()
-        for space in empty_space:
-            if np.size(np.where(np.abs(np.array(np.array(pos).reshape(-1)[:2])-np.array(space)) < self.MAZE_SIZE_SCALING/2)[0]) == 2:
-                # print("Pos {} is in empty space: {}".format(pos, space))
-                return True
-        return False
+        return self.is_feasible_n(np.array(pos).reshape(-1)[:2])[0]
 
     @overrides
     def reset(self, *args, **kwargs):
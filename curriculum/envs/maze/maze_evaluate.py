@@ -58,17 +58,12 @@ def sample_unif_feas(train_env, samples_per_cell):
     :return:
     """
     maze_env = unwrap_maze(train_env)
-    empty_spaces = maze_env.find_empty_space()
+    empty_cells = maze_env.empty_cells
 
     size_scaling = maze_env.MAZE_SIZE_SCALING
 
-    states = []
-    for empty_space in empty_spaces:
-        for i in range(samples_per_cell):
-            state = np.array(empty_space) + np.random.uniform(-size_scaling/2, size_scaling/2, 2)
-            states.append(state)
-
-    return np.array(states)
+    return np.repeat(empty_cells, samples_per_cell, axis=0) + np.random.uniform(
+        -size_scaling/2, size_scaling/2, (len(empty_cells) * samples_per_cell, 2))
 
 
 def my_square_scatter(axes, x_array, y_array, z_array, min_z=None, max_z=None, size=0.5, **kwargs):
@@ -0,0 +1,51 @@
+from rllab.algos.batch_polopt import BatchSampler
+from rllab.sampler import parallel_sampler
+from curriculum.experiments.asym_selfplay.envs.alice_env import alice_reward, bob_rollout
+
+
+class AliceSampler(BatchSampler):
+    """
+    Sampler of an algo training Alice on an AliceEnv created with defer_bob_rollouts. Alice's paths are collected
+    without running Bob, then Bob's rollouts from the states Alice stopped at are mapped on the workers, on replicas
+    of Bob's env and policy, and Alice's final rewards are filled in before the samples are processed.
+    """
+
+    def __init__(self, algo, bob_scope=None, **kwargs):
+        """
+        :param bob_scope: scope of the replicas of Bob's env and policy on the workers
+        """
+        super(AliceSampler, self).__init__(algo, **kwargs)
+        assert algo.env.defer_bob_rollouts, "AliceSampler requires an AliceEnv with defer_bob_rollouts"
+        if bob_scope is None:
+            bob_scope = "alice_bob" if algo.scope is None else "%s_bob" % algo.scope
+        self.bob_scope = bob_scope
+
+    def start_worker(self):
+        super(AliceSampler, self).start_worker()
+        parallel_sampler.populate_task(self.algo.env.env_bob, self.algo.env.policy_bob, scope=self.bob_scope)
+
+    def shutdown_worker(self):
+        super(AliceSampler, self).shutdown_worker()
+        if not self.persistent_workers:
+            parallel_sampler.terminate_task(scope=self.bob_scope)
+
+    def obtain_samples_async(self, itr):
+        return super(AliceSampler, self).obtain_samples_async(itr).then(self.add_bob_rewards)
+
+    def add_bob_rewards(self, paths):
+        """
+        Run Bob from the end of each of Alice's paths where she stopped, and set her final rewards.
+        """
+        env = self.algo.env
+        ended_paths = [path for path in paths if path["env_infos"]["alice_done"][-1]]
+        parallel_sampler.set_policy_params(env.policy_bob.get_param_values(), scope=self.bob_scope)
+        paths_bob = parallel_sampler.map_task(
+            bob_rollout,
+            [(path["env_infos"]["bob_state"][-1], env.get_bob_max_path_length(len(path["rewards"])),
+              env.start_generation) for path in ended_paths],
+            scope=self.bob_scope,
+        )
+        for path, path_bob in zip(ended_paths, paths_bob):
+            path["rewards"][-1] = alice_reward(len(path["rewards"]), len(path_bob["rewards"]), env.alice_bonus,
+                                               env.alice_factor, env.gamma)
+        return paths
@@ -5,16 +5,23 @@ from rllab.baselines.linear_feature_baseline import LinearFeatureBaseline
 from rllab.envs.mujoco.maze.point_maze_env import PointMazeEnv
 from rllab.misc import logger
 from rllab.policies.gaussian_mlp_policy import GaussianMLPPolicy
+from rllab.sampler import parallel_sampler
 from rllab.sampler.utils import rollout
 from curriculum.envs.base import UniformListStateGenerator, FixedStateGenerator
-from curriculum.experiments.asym_selfplay.envs.alice_env import AliceEnv
+from curriculum.experiments.asym_selfplay.envs.alice_env import AliceEnv, alice_reward, bob_rollout
 from curriculum.logging import ExperimentLogger
 
 
 class AsymSelfplay(object):
 
     def __init__(self, algo_alice, algo_bob, env_alice, env_bob, policy_alice, policy_bob, start_states, log_dir,
-                 num_rollouts=10, gamma = 0.1, alice_factor = 0.5, alice_bonus=10):
+                 num_rollouts=10, gamma = 0.1, alice_factor = 0.5, alice_bonus=10, bob_batch_size=10):
+        """
+        :param env_alice: AliceEnv created with defer_bob_rollouts, as Bob's rollouts are run by optimize
+        :param bob_batch_size: number of Alice end states gathered before dispatching Bob's rollouts from them to the
+        workers, which run them while Alice goes on with her rollouts
+        """
+        assert env_alice.defer_bob_rollouts, "AsymSelfplay runs Bob's rollouts itself, env_alice must defer them"
         self.algo_alice = algo_alice
         self.algo_bob = algo_bob
         self.env_alice = env_alice
@@ -31,6 +38,10 @@ class AsymSelfplay(object):
         self.alice_factor = alice_factor
         self.log_dir = log_dir
         self.alice_bonus = alice_bonus
+        self.bob_batch_size = bob_batch_size
+        self.bob_scope = "asym_selfplay_bob"
+        self._workers_started = False
+        self._opt_initialized = set()
 
     def update_rewards(self, paths_alice, paths_bob, gamma):
         assert len(paths_alice) == len(paths_bob), 'Error, both agents need an equal number of paths.'
@@ -41,7 +52,7 @@ class AsymSelfplay(object):
             path_alice['rewards'] = np.zeros_like(path_alice['rewards'])
             path_bob['rewards'] = np.zeros_like(path_bob['rewards'])
             # path_alice['rewards'][-1] = gamma * np.max([0, t_bob + alice_bonus - t_alice])
-            path_alice['rewards'][-1] = gamma * max(0, self.alice_bonus + t_bob - self.alice_factor * t_alice)
+            path_alice['rewards'][-1] = alice_reward(t_alice, t_bob, self.alice_bonus, self.alice_factor, gamma)
             path_bob['rewards'][-1] = -gamma * t_bob
 
         return paths_alice, paths_bob
@@ -84,16 +95,36 @@ class AsymSelfplay(object):
 
         return (sampled_starts, t_alices)
 
+    def _start_workers(self):
+        if not self._workers_started:
+            # Bob's env and policy are shipped to the workers once, then only his policy parameters each iteration
+            parallel_sampler.populate_task(self.env_bob, self.policy_bob, scope=self.bob_scope)
+            self._workers_started = True
+
+    def _init_opt(self, algo):
+        # the optimization of each algo is compiled once, on its first use
+        if id(algo) not in self._opt_initialized:
+            algo.start_worker()
+            algo.init_opt()
+            self._opt_initialized.add(id(algo))
+
     def optimize(self, iter=0):
 
         # get paths
         n_starts = len(self.start_states)
+        self._start_workers()
 
         for itr in range(self.algo_alice.n_itr):
 
             paths_alice = []
-            paths_bob = []
             new_start_states = []
+            bob_results = []
+            parallel_sampler.set_policy_params(self.policy_bob.get_param_values(), scope=self.bob_scope)
+
+            def dispatch_bob_rollouts(start_states):
+                bob_results.append(parallel_sampler.map_task_async(
+                    bob_rollout, [(start_state, self.max_path_length) for start_state in start_states],
+                    scope=self.bob_scope))
 
             for i in range(self.num_rollouts):
                 self.env_alice.update_start_generator(FixedStateGenerator(self.start_states[i % n_starts]))
@@ -101,27 +132,27 @@ class AsymSelfplay(object):
                 paths_alice.append(rollout(self.env_alice, self.policy_alice, max_path_length=self.max_path_length,
                                            animated=False))
 
-                alice_end_obs = paths_alice[i]['observations'][-1]
-                new_start_state = self.env_alice._obs2start_transform(alice_end_obs)
-                new_start_states.append(new_start_state)
+                # state reached by Alice's last step, where Bob starts from
+                new_start_states.append(paths_alice[i]['env_infos']['bob_state'][-1])
 
-                self.env_bob.update_start_generator(FixedStateGenerator(new_start_state))
-                paths_bob.append(rollout(self.env_bob, self.policy_bob, max_path_length=self.max_path_length,
-                                         animated=False))
+                if len(new_start_states) % self.bob_batch_size == 0:
+                    dispatch_bob_rollouts(new_start_states[-self.bob_batch_size:])
+            if len(new_start_states) % self.bob_batch_size > 0:
+                dispatch_bob_rollouts(new_start_states[-(len(new_start_states) % self.bob_batch_size):])
+            # Alice's rewards are only known once Bob's rollouts come back
+            paths_bob = [path for result in bob_results for path in result.get()]
 
             # update rewards
             paths_alice, paths_bob = self.update_rewards(paths_alice=paths_alice, paths_bob=paths_bob, gamma=self.gamma)
 
             # optimize policies
             if self.optimize_alice:
-                self.algo_alice.start_worker()
-                self.algo_alice.init_opt()
+                self._init_opt(self.algo_alice)
                 training_samples_alice = self.algo_alice.sampler.process_samples(itr=iter, paths=paths_alice)
                 self.algo_alice.optimize_policy(itr=iter, samples_data=training_samples_alice)
 
             if self.optimize_bob:
-                self.algo_bob.start_worker()
-                self.algo_bob.init_opt()
+                self._init_opt(self.algo_bob)
                 training_samples_bob = self.algo_bob.sampler.process_samples(itr=iter, paths=paths_bob)
                 self.algo_bob.optimize_policy(itr=iter, samples_data=training_samples_bob)
 
@@ -139,14 +170,15 @@ if __name__ == '__main__':
 
     # todo setup the correct environments (correct wrappers for arbitrary reset)
     env_a1 = PointMazeEnv()
-    env_a2 = AliceEnv(PointMazeEnv())
-
     policy_a1 = GaussianMLPPolicy(
             env_spec=env_a1.spec,
             hidden_sizes=(64, 64),
             std_hidden_sizes=(16, 16)
     )
 
+    env_a2 = AliceEnv(env_alice=PointMazeEnv(), env_bob=env_a1, policy_bob=policy_a1, max_path_length=max_path_length,
+                      alice_bonus=10, alice_factor=0.5, gamma=gamma, defer_bob_rollouts=True)
+
     policy_a2 = GaussianMLPPolicy(
             env_spec=env_a2.spec,
             hidden_sizes=(64, 64),
@@ -185,7 +217,9 @@ if __name__ == '__main__':
         # plot=True,
     )
 
-    asym_selfplay = AsymSelfplay(algo_alice=algo_a1, algo_bob=algo_a2, num_rollouts=num_rollouts, gamma = gamma)
+    asym_selfplay = AsymSelfplay(algo_alice=algo_a2, algo_bob=algo_a1, env_alice=env_a2, env_bob=env_a1,
+                                 policy_alice=policy_a2, policy_bob=policy_a1, start_states=[np.zeros(2)],
+                                 log_dir=None, num_rollouts=num_rollouts, gamma=gamma)
 
     for i in range(iterations):
         asym_selfplay.optimize(i)
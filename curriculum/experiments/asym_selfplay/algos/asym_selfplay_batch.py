@@ -1,5 +1,6 @@
 import numpy as np
 
+from rllab.algos.batch_polopt import BatchSampler
 from rllab.algos.trpo import TRPO
 from rllab.baselines.linear_feature_baseline import LinearFeatureBaseline
 from rllab.envs.mujoco.maze.point_maze_env import PointMazeEnv
@@ -8,6 +9,7 @@ from rllab.policies.gaussian_mlp_policy import GaussianMLPPolicy
 from rllab.sampler.utils import rollout
 from curriculum.envs.base import UniformListStateGenerator, FixedStateGenerator
 from curriculum.experiments.asym_selfplay.envs.alice_env import AliceEnv
+from curriculum.experiments.asym_selfplay.algos.alice_sampler import AliceSampler
 from curriculum.logging import ExperimentLogger
 
 
@@ -23,6 +25,10 @@ class AsymSelfplayBatch(object):
         self.log_dir = log_dir
         self.start_generation = start_generation
         self.debug = debug
+        if getattr(env_alice, "defer_bob_rollouts", False) and type(algo_alice.sampler) is BatchSampler:
+            # Bob's rollouts are run by the sampler, in one batch on the workers, instead of within Alice's steps
+            algo_alice.sampler = AliceSampler(algo_alice, persistent_workers=algo_alice.sampler.persistent_workers,
+                                              shared_memory=algo_alice.sampler.shared_memory)
 
     def optimize_batch(self):
 
@@ -11,6 +11,22 @@ from rllab.envs.base import Step
 from curriculum.envs.base import FixedStateGenerator
 
 
+def alice_reward(t_alice, t_bob, alice_bonus, alice_factor, gamma):
+    return gamma * max(0, alice_bonus + t_bob - alice_factor * t_alice)
+
+
+def bob_rollout(env_bob, policy_bob, state, max_path_length, start_generation=True):
+    """
+    Rollout of Bob from the start (or to the goal) state reached by Alice. Its arguments are ordered so that it can be
+    mapped on the env and policy replicas of the workers by parallel_sampler.map_task.
+    """
+    if start_generation:
+        env_bob.update_start_generator(FixedStateGenerator(state))
+    else:
+        env_bob.update_goal_generator(FixedStateGenerator(state))
+    return rollout(env_bob, policy_bob, max_path_length=max_path_length, animated=False)
+
+
 class AliceEnv(ProxyEnv, Serializable):
     def __init__(
             self,
@@ -22,8 +38,14 @@ class AliceEnv(ProxyEnv, Serializable):
             alice_factor,
             gamma=0.1,
             stop_threshold=0.9,
-            start_generation=True
+            start_generation=True,
+            defer_bob_rollouts=False
     ):
+        """
+        :param defer_bob_rollouts: do not run Bob's rollout when Alice stops: her final reward is left to 0, and the
+        state Bob has to start from (or reach) is recorded in the env infos, as "bob_state", along with "alice_done".
+        The sampler then runs Bob's rollouts for all the paths at once and fills in the rewards (see AliceSampler).
+        """
         Serializable.quick_init(self, locals())
         ProxyEnv.__init__(self, env_alice)
 
@@ -37,7 +59,7 @@ class AliceEnv(ProxyEnv, Serializable):
         self.gamma = gamma
         self.stop_threshold = stop_threshold
         self.start_generation = start_generation
-
+        self.defer_bob_rollouts = defer_bob_rollouts
 
     def reset(self, **kwargs):
         ret = self._wrapped_env.reset(**kwargs)
@@ -54,19 +76,23 @@ class AliceEnv(ProxyEnv, Serializable):
         else:
             raise NotImplementedError
 
-    def compute_alice_reward(self, next_obs):
-        alice_end_obs = next_obs
+    def get_bob_state(self, alice_end_obs):
         if self.start_generation:
-            bob_start_state = self._obs2start_transform(alice_end_obs)
-            self.env_bob.update_start_generator(FixedStateGenerator(bob_start_state))
-        else:
-            bob_goal_state = self._obs2goal_transform(alice_end_obs)
-            self.env_bob.update_goal_generator(FixedStateGenerator(bob_goal_state))
-        path_bob = rollout(self.env_bob, self.policy_bob, max_path_length=max(5, self.max_path_length - self.time), #
-                           animated=False)
+            return self._obs2start_transform(alice_end_obs)
+        return self._obs2goal_transform(alice_end_obs)
+
+    def get_bob_max_path_length(self, t_alice):
+        # the horizon is shared between Alice and Bob
+        return max(5, self.max_path_length - t_alice)
+
+    def compute_alice_reward(self, next_obs):
+        bob_state = self.get_bob_state(next_obs)
+        path_bob = bob_rollout(self.env_bob, self.policy_bob, bob_state,
+                               max_path_length=self.get_bob_max_path_length(self.time),
+                               start_generation=self.start_generation)
         t_alice = self.time
         t_bob = path_bob['rewards'].shape[0]
-        reward = self.gamma * max(0, self.alice_bonus + t_bob - self.alice_factor * t_alice)
+        reward = alice_reward(t_alice, t_bob, self.alice_bonus, self.alice_factor, self.gamma)
 
         # print("t_bob: " + str(t_bob) + ", np.linalg.norm(bob_start_state): " + str(np.linalg.norm(bob_start_state)))
         # print("t_alice: " + str(t_alice), " speed: " + str(np.linalg.norm(bob_start_state) / t_alice))
@@ -91,11 +117,16 @@ class AliceEnv(ProxyEnv, Serializable):
         #     logger.log("No stop action sampled")
 
         # Compute the reward for Alice.
-        if done or self.time >= self.max_path_length:
+        alice_done = done or self.time >= self.max_path_length
+        if alice_done and not self.defer_bob_rollouts:
             # Alice is done here; we need to run Bob!
             reward = self.compute_alice_reward(next_obs)
         else:
-            reward = 0
+            # a float, so that the rewards of a path are floats even when the final one is filled in later
+            reward = 0.
+        if self.defer_bob_rollouts:
+            # recorded at every step, so that all the steps have the same env infos
+            info = dict(info, bob_state=self.get_bob_state(next_obs), alice_done=alice_done)
 
         return Step(next_obs, reward, done, **info)
 
@@ -210,6 +210,8 @@ def run_task(v):
                 step_size=0.01,
                 discount=v['discount'],
                 plot=False,
+                # keep the env and policy replicas on the workers across outer iterations
+                sampler_args=dict(persistent_workers=True),
             )
 
             trpo_paths = algo.train()
@@ -97,7 +97,8 @@ def run_task(v):
     # create Alice
 
     env_alice = AliceEnv(env_alice=env, env_bob=env, policy_bob=policy, max_path_length=v['alice_horizon'], alice_factor=v['alice_factor'],
-                                       alice_bonus=v['alice_bonus'], gamma=1, stop_threshold=v['stop_threshold'])
+                                       alice_bonus=v['alice_bonus'], gamma=1, stop_threshold=v['stop_threshold'],
+                                       defer_bob_rollouts=True)
 
     policy_alice = GaussianMLPPolicy(
         env_spec=env_alice.spec,
@@ -98,7 +98,8 @@ def run_task(v):
     # Use asymmetric self-play to run Alice to generate starts for Bob.
     # Use a double horizon because the horizon is shared between Alice and Bob.
     env_alice = AliceEnv(env_alice=env, env_bob=env, policy_bob=policy, max_path_length=v['alice_horizon'], alice_factor=v['alice_factor'],
-                                       alice_bonus=v['alice_bonus'], gamma=1, stop_threshold=v['stop_threshold'])
+                                       alice_bonus=v['alice_bonus'], gamma=1, stop_threshold=v['stop_threshold'],
+                                       defer_bob_rollouts=True)
 
     policy_alice = GaussianMLPPolicy(
             env_spec=env_alice.spec,
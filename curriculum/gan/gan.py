@@ -25,6 +25,7 @@ DEFAULT_GAN_CONFIGS = lambda: {
     'default_discriminator_iters': 1,
     'gan_type': 'lsgan',
     'wgan_gradient_penalty': 0.1,
+    'fused_train_steps': 0,  # if > 0, train runs this many outer iterations per session call, entirely in-graph
 }
 
 
@@ -65,14 +66,17 @@ class FCGAN(object):
         self.generator_is_training = tf.placeholder_with_default(False, [])
         self.discriminator_is_training = tf.placeholder_with_default(False, [])
 
+        # the fused training step reads the variables inside a while loop, which requires resource variables
+        use_resource = True if self.configs['fused_train_steps'] > 0 else None
+
         # with self.tf_graph.as_default():
-        with tf.variable_scope("generator"):
+        with tf.variable_scope("generator", use_resource=use_resource):
             self.generator = Generator(
                 generator_output_size, generator_layers, noise_size,
                 self.generator_is_training, self.configs,
             )
 
-        with tf.variable_scope("discriminator"):
+        with tf.variable_scope("discriminator", use_resource=use_resource):
             self.discriminator = Discriminator(
                 self.generator.output, generator_output_size,
                 discriminator_layers, discriminator_output_size,
@@ -135,6 +139,8 @@ class FCGAN(object):
             self.initialize_discriminator_optimizer_op
         )
 
+        self._fused_train_ops = dict()
+
     def initialize(self):
         self.tf_session.run(
             self.initialize_trainable_variable_op
@@ -170,6 +176,10 @@ class FCGAN(object):
             generator_iters = self.configs['default_generator_iters']
         if discriminator_iters is None:
             discriminator_iters = self.configs['default_discriminator_iters']
+
+        if (self.configs['fused_train_steps'] > 0 and not self.configs['reset_generator_optimizer']
+                and not self.configs['reset_discriminator_optimizer']):
+            return self.train_fused(X, Y, outer_iters, generator_iters, discriminator_iters)
         
         sample_size = X.shape[0]
         train_size = sample_size
@@ -215,6 +225,97 @@ class FCGAN(object):
 
         return dis_log_loss, gen_log_loss
 
+    def train_fused(self, X, Y, outer_iters, generator_iters, discriminator_iters):
+        """
+        Same training as train, but the noise sampling, the real/fake batch assembly and both optimizer updates are
+        done in-graph, running configs['fused_train_steps'] outer iterations per session call. X and Y are fed once
+        per call and the batches cycle through them as in batch_feed_array.
+        """
+        n_steps, dis_loss_op, gen_loss_op = self._get_fused_train_op(generator_iters, discriminator_iters)
+        steps_per_call = self.configs['fused_train_steps']
+        dis_log_loss = gen_log_loss = None
+        for i in range(0, outer_iters, steps_per_call):
+            dis_log_loss, gen_log_loss = self.tf_session.run(
+                [dis_loss_op, gen_loss_op],
+                {self._fused_X: X,
+                 self._fused_Y: Y,
+                 self._fused_first_step: i,
+                 n_steps: min(steps_per_call, outer_iters - i)}
+            )
+            if i // self.configs['print_iteration'] != (i + steps_per_call) // self.configs['print_iteration'] \
+                    and not self.configs['supress_all_logging']:
+                print('Iter: {}, generator loss: {}, discriminator loss: {}'.format(
+                    min(i + steps_per_call, outer_iters) - 1, gen_log_loss, dis_log_loss))
+
+        return dis_log_loss, gen_log_loss
+
+    def _get_fused_train_op(self, generator_iters, discriminator_iters):
+        """
+        Build (once per number of generator and discriminator iterations) the while loop running the outer iterations
+        of train_fused.
+        :return: the placeholder of the number of outer iterations to run, and the last discriminator and generator
+        losses
+        """
+        if (generator_iters, discriminator_iters) in self._fused_train_ops:
+            return self._fused_train_ops[(generator_iters, discriminator_iters)]
+        assert self.configs['fused_train_steps'] > 0, "the variables must be created with fused_train_steps > 0"
+        if not hasattr(self, '_fused_X'):
+            self._fused_X = tf.placeholder(tf.float32, shape=[None, self.generator_output_size])
+            self._fused_Y = tf.placeholder(tf.float32, shape=[None, self.discriminator_output_size])
+            self._fused_first_step = tf.placeholder(tf.int32, shape=[])
+        n_steps = tf.placeholder(tf.int32, shape=[])
+        batch_size = self.configs['batch_size']
+        data_size = tf.shape(self._fused_X)[0]
+        generated_Y = tf.zeros([batch_size, self.discriminator_output_size])
+
+        def feed_batch(batch_index):
+            # same batches as batch_feed_array
+            indices = tf.cond(
+                data_size > batch_size,
+                lambda: tf.mod(tf.mod(batch_index * batch_size, data_size) + tf.range(batch_size), data_size),
+                lambda: tf.range(data_size),
+            )
+            return tf.gather(self._fused_X, indices), tf.gather(self._fused_Y, indices)
+
+        def outer_iteration(step, dis_loss, gen_loss):
+            dependency = [dis_loss, gen_loss]
+            for j in range(discriminator_iters):
+                with tf.control_dependencies(dependency):
+                    sample_X, sample_Y = feed_batch((self._fused_first_step + step) * discriminator_iters + j)
+                    random_noise = tf.random_normal([batch_size, self.noise_size])
+                    generated_X = tf.stop_gradient(self.generator.apply(random_noise, False))
+                    train_X = tf.concat([sample_X, generated_X], 0)
+                    train_Y = tf.concat([sample_Y, generated_Y], 0)
+                    loss, _ = self.discriminator.apply_losses(train_X, train_Y, generated_X, True)
+                    train_op = self.configs['discriminator_optimizer'].minimize(
+                        loss, var_list=self.discriminator_variables)
+                with tf.control_dependencies([train_op]):
+                    dis_loss = tf.identity(loss)
+                dependency = [dis_loss]
+
+            for j in range(generator_iters):
+                with tf.control_dependencies(dependency):
+                    # as in train, the noise of the last discriminator batch is reused for the first iterations
+                    if j > 6:
+                        random_noise = tf.random_normal([batch_size, self.noise_size])
+                    generated_X = self.generator.apply(random_noise, True)
+                    _, loss = self.discriminator.apply_losses(generated_X, generated_Y, generated_X, False)
+                    train_op = self.configs['generator_optimizer'].minimize(loss, var_list=self.generator_variables)
+                with tf.control_dependencies([train_op]):
+                    gen_loss = tf.identity(loss)
+                dependency = [gen_loss]
+
+            return step + 1, dis_loss, gen_loss
+
+        _, dis_loss_op, gen_loss_op = tf.while_loop(
+            lambda step, dis_loss, gen_loss: step < n_steps,
+            outer_iteration,
+            [tf.constant(0), tf.constant(0.), tf.constant(0.)],
+            parallel_iterations=1,
+        )
+        self._fused_train_ops[(generator_iters, discriminator_iters)] = (n_steps, dis_loss_op, gen_loss_op)
+        return self._fused_train_ops[(generator_iters, discriminator_iters)]
+
     def train_discriminator(self, X, Y, iters, no_batch=False):
         """
         :param X: goal that we know lables of
@@ -284,40 +385,52 @@ class Generator(object):
     def __init__(self, output_size, hidden_layers, noise_size, is_training, configs):
         self.configs = configs
         self._input = tf.placeholder(tf.float32, shape=[None, noise_size])
-        out = self._input
 
+        # the layers are kept to apply the same network to other inputs
+        self._hidden_layers = []
         for size in hidden_layers:
-            out = tf.layers.dense(
-                out, size,
+            dense = tf.layers.Dense(
+                size,
                 kernel_initializer=configs['generator_weight_initializer'],
             )
-            
-            if configs['generator_hidden_activation'] == 'relu':
+            batch_norm = tf.layers.BatchNormalization() if configs['batch_normalize_generator'] else None
+            self._hidden_layers.append((dense, batch_norm))
+
+        self._output_layer = tf.layers.Dense(
+            output_size,
+            kernel_initializer=configs['generator_weight_initializer'],
+        )
+
+        self._output = self.apply(self._input, is_training)
+
+    def apply(self, noise, is_training):
+        """
+        Apply the generator network (with its variables) to a noise tensor.
+        """
+        out = noise
+        for dense, batch_norm in self._hidden_layers:
+            out = dense(out)
+
+            if self.configs['generator_hidden_activation'] == 'relu':
                 out = tf.nn.relu(out)
-            elif configs['generator_hidden_activation'] == 'leaky_relu':
+            elif self.configs['generator_hidden_activation'] == 'leaky_relu':
                 out = tf.maximum(0.2 * out, out)
             else:
                 raise ValueError('Unsupported activation type')
-                
-            if configs['batch_normalize_generator']:
-                out = tf.layers.batch_normalization(
-                    out, training=is_training
-                )
-            
-        out = tf.layers.dense(
-            out, output_size,
-            kernel_initializer=configs['generator_weight_initializer'],
-        )
-        
-        if configs['generator_output_activation'] == 'tanh':
-            self._output = tf.nn.tanh(out)
-        elif configs['generator_output_activation'] == 'sigmoid':
-            self._output = tf.nn.sigmoid(out)
-        elif configs['generator_output_activation'] == 'linear':
-            self._output = out
+
+            if batch_norm is not None:
+                out = batch_norm(out, training=is_training)
+
+        out = self._output_layer(out)
+
+        if self.configs['generator_output_activation'] == 'tanh':
+            return tf.nn.tanh(out)
+        elif self.configs['generator_output_activation'] == 'sigmoid':
+            return tf.nn.sigmoid(out)
+        elif self.configs['generator_output_activation'] == 'linear':
+            return out
         else:
             raise ValueError('Unsupported activation type!')
-        
 
     @property
     def input(self):
@@ -335,6 +448,9 @@ class Discriminator(object):
         self._sample_input = tf.placeholder(tf.float32, shape=[None, input_size])
         self._label = tf.placeholder(tf.float32, shape=[None, output_size])
         self.configs = configs
+        self._hidden_layers = hidden_layers
+        self._output_size = output_size
+        self._scope = tf.get_variable_scope()
         
         self.sample_discriminator = DiscriminatorNet(
             self._sample_input, hidden_layers, output_size, is_training,
@@ -345,62 +461,93 @@ class Discriminator(object):
             self._generator_input, hidden_layers, output_size, is_training,
             configs, reuse=True
         )
-        
-        
+
+        (self._sample_output, self._generator_output,
+         self._discriminator_loss, self._generator_loss) = self._build_losses(
+            self.sample_discriminator.output, self.generator_discriminator.output,
+            self._sample_input, self._label
+        )
+
+    def _build_losses(self, sample_logits, generator_logits, sample_input, label):
+        """
+        :return: sample output, generator output, discriminator loss and generator loss
+        """
+        configs = self.configs
         if configs['gan_type'] == 'wgan':
-            self._generator_output = self.generator_discriminator.output
-            self._sample_output = self.sample_discriminator.output
+            generator_output = generator_logits
+            sample_output = sample_logits
             
-            self._discriminator_loss_logits = tf.reduce_mean(
-                -2 * (self._label - 0.5) * self._sample_output
+            discriminator_loss_logits = tf.reduce_mean(
+                -2 * (label - 0.5) * sample_output
             )
             
             
-            self._discriminator_loss_gradient = tf.nn.relu(
+            discriminator_loss_gradient = tf.nn.relu(
                 tf.nn.l2_loss(
                     tf.gradients(
-                        self._discriminator_loss_logits, self._sample_input
+                        discriminator_loss_logits, sample_input
                     )[0]
                 ) - 1
             ) * configs['wgan_gradient_penalty']
             
-            self._discriminator_loss = self._discriminator_loss_logits + self._discriminator_loss_gradient
+            discriminator_loss = discriminator_loss_logits + discriminator_loss_gradient
     
-            self._generator_loss = tf.reduce_mean(
-                -self._generator_output
+            generator_loss = tf.reduce_mean(
+                -generator_output
             )
             
         elif configs['gan_type'] == 'lsgan':
-            self._generator_output = self.generator_discriminator.output
-            self._sample_output = self.sample_discriminator.output
+            generator_output = generator_logits
+            sample_output = sample_logits
             
-            self._discriminator_loss = tf.reduce_mean(
-                tf.square(2 * self._label - 1 - self._sample_output)
+            discriminator_loss = tf.reduce_mean(
+                tf.square(2 * label - 1 - sample_output)
             )
             
-            self._generator_loss = tf.reduce_mean(
-                tf.square(self._generator_output - 1)
+            generator_loss = tf.reduce_mean(
+                tf.square(generator_output - 1)
             )
         
         elif configs['gan_type'] == 'original':
-            self._generator_output = tf.sigmoid(self.generator_discriminator.output)
-            self._sample_output = tf.sigmoid(self.sample_discriminator.output)
+            generator_output = tf.sigmoid(generator_logits)
+            sample_output = tf.sigmoid(sample_logits)
     
-            self._discriminator_loss = tf.reduce_mean(
+            discriminator_loss = tf.reduce_mean(
                 tf.nn.sigmoid_cross_entropy_with_logits(
-                    labels=self._label, logits=self.sample_discriminator.output
+                    labels=label, logits=sample_logits
                 )
             )
     
-            self._generator_loss = tf.reduce_mean(
+            generator_loss = tf.reduce_mean(
                 tf.nn.sigmoid_cross_entropy_with_logits(
-                    labels=tf.ones_like(self.generator_discriminator.output),
-                    logits=self.generator_discriminator.output
+                    labels=tf.ones_like(generator_logits),
+                    logits=generator_logits
                 )
             )
         else:
             raise ValueError('Unsupported GAN type!')
 
+        return sample_output, generator_output, discriminator_loss, generator_loss
+
+    def apply_losses(self, sample_input, label, generator_output, is_training):
+        """
+        Apply the discriminator network (with its variables) to other sample and generator tensors.
+        :return: discriminator loss and generator loss
+        """
+        with tf.variable_scope(self._scope, reuse=True):
+            sample_discriminator = DiscriminatorNet(
+                sample_input, self._hidden_layers, self._output_size, is_training,
+                self.configs, reuse=True
+            )
+            generator_discriminator = DiscriminatorNet(
+                generator_output, self._hidden_layers, self._output_size, is_training,
+                self.configs, reuse=True
+            )
+        _, _, discriminator_loss, generator_loss = self._build_losses(
+            sample_discriminator.output, generator_discriminator.output, sample_input, label
+        )
+        return discriminator_loss, generator_loss
+
     @property
     def sample_input(self):
         return self._sample_input
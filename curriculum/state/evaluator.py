@@ -4,9 +4,12 @@ import tempfile
 import numpy as np
 from collections import OrderedDict
 import cloudpickle
+import hashlib
 import time
 
-from rllab.sampler.utils import rollout
+from rllab.sampler.utils import rollout, vec_rollout_step
+from rllab.sampler import parallel_sampler
+from rllab.sampler.stateful_pool import singleton_pool
 from rllab.misc import logger
 
 from curriculum.envs.base import FixedStateGenerator
@@ -64,16 +67,28 @@ def parallel_map(func, iterable_object, num_processes=-1):
     if num_processes == 1:
         return [func(x) for x in iterable_object]
     if num_processes == -1:
-        from rllab.sampler.stateful_pool import singleton_pool
         num_processes = singleton_pool.n_parallel
-    process_pool = multiprocessing.Pool(
-        num_processes,
-        initializer=disable_cuda_initializer
-    )
-    results = process_pool.map(func, iterable_object)
-    process_pool.close()
-    process_pool.join()
-    return results
+    return get_process_pool(num_processes).map(func, iterable_object)
+
+
+_process_pools = dict()
+
+
+def get_process_pool(num_processes):
+    """Process pool of the given size, created on first use and kept alive for the following calls."""
+    if num_processes not in _process_pools:
+        _process_pools[num_processes] = multiprocessing.Pool(
+            num_processes,
+            initializer=disable_cuda_initializer
+        )
+    return _process_pools[num_processes]
+
+
+def close_process_pools():
+    for process_pool in _process_pools.values():
+        process_pool.close()
+        process_pool.join()
+    _process_pools.clear()
 
 def compute_rewards_from_paths(all_paths, key='rewards', as_goal=True, env=None, terminal_eps=0.1):
     all_rewards = []
@@ -239,9 +254,68 @@ def convert_label(labels):
     return new_labels, classes
 
 
+EVALUATION_SCOPE = "evaluate_states"
+
+_evaluation_cache = dict(params_hash=None, results=dict())
+
+
 def evaluate_states(states, env, policy, horizon, n_traj=1, n_processes=-1, full_path=False, key='rewards',
                     as_goals=True,
-                    aggregator=(np.sum, np.mean)):
+                    aggregator=(np.sum, np.mean), n_envs=8, chunk_size=None, cache=False):
+    """
+    Evaluate the policy from each state (as goal or as start), rolling out n_traj trajectories per state.
+    :param n_envs: when running on the sampler workers, number of env copies stepped together on each worker
+    :param chunk_size: number of states sent per task to the workers (by default, about 4 tasks per worker)
+    :param cache: reuse the results of previous calls with the same policy parameters, env, state and evaluation
+    arguments. Only the results for the latest policy parameters are kept. Note that the env is only identified by
+    the object itself: changes to its other generators are not detected
+    :return: the aggregated value per state (and the list of all paths if full_path)
+    """
+    states = list(states)
+    evaluation_args = (horizon, n_traj, full_path, key, as_goals, aggregator)
+    if not cache:
+        result = _evaluate_states(states, env, policy, n_processes, n_envs, chunk_size, *evaluation_args)
+    else:
+        params_hash = hashlib.sha1(policy.get_param_values().tobytes()).hexdigest()
+        if _evaluation_cache["params_hash"] != params_hash:
+            _evaluation_cache["params_hash"] = params_hash
+            _evaluation_cache["results"] = dict()
+        cached_results = _evaluation_cache["results"]
+        cache_keys = [(id(env), tuple(np.asarray(state).ravel())) + evaluation_args for state in states]
+        missing = [idx for idx, cache_key in enumerate(cache_keys) if cache_key not in cached_results]
+        logger.log("Evaluating %d states (%d cached)" % (len(missing), len(states) - len(missing)))
+        missing_results = _evaluate_states(
+            [states[idx] for idx in missing], env, policy, n_processes, n_envs, chunk_size, *evaluation_args)
+        for idx, missing_result in zip(missing, missing_results):
+            cached_results[cache_keys[idx]] = missing_result
+        result = [cached_results[cache_key] for cache_key in cache_keys]
+
+    if full_path:
+        return np.array([state[0] for state in result]), [path for state in result for path in state[1]]
+    return np.array(result)
+
+
+def _evaluate_states(states, env, policy, n_processes, n_envs, chunk_size, horizon, n_traj, full_path, key,
+                     as_goals, aggregator):
+    if len(states) == 0:
+        return []
+    if n_processes == -1 and singleton_pool.n_parallel > 1 and not policy.recurrent:
+        # reuse the env and policy replicas kept on the sampler workers: only the policy parameters and the env
+        # generators are sent, unless env or policy are new objects
+        parallel_sampler.populate_task(env, policy, scope=EVALUATION_SCOPE)
+        parallel_sampler.populate_vec_env(n_envs, horizon, scope=EVALUATION_SCOPE)
+        # the replicas' generators were overwritten by the previous evaluation
+        parallel_sampler.sync_env_generators(scope=EVALUATION_SCOPE, force=True)
+        parallel_sampler.set_policy_params(policy.get_param_values(), scope=EVALUATION_SCOPE)
+        if chunk_size is None:
+            chunk_size = int(np.ceil(len(states) / (4. * singleton_pool.n_parallel)))
+        chunk_results = parallel_sampler.map_vec_task(
+            _evaluate_state_chunk_task,
+            [(states[i:i + chunk_size], n_traj, full_path, key, as_goals, aggregator)
+             for i in range(0, len(states), chunk_size)],
+            scope=EVALUATION_SCOPE,
+        )
+        return [result for chunk_result in chunk_results for result in chunk_result]
     evaluate_state_wrapper = FunctionWrapper(
         evaluate_state,
         env=env,
@@ -253,37 +327,27 @@ def evaluate_states(states, env, policy, horizon, n_traj=1, n_processes=-1, full
         as_goals=as_goals,
         aggregator=aggregator,
     )
-    result = parallel_map(  # if full_path this is a list of tuples
+    return parallel_map(  # if full_path this is a list of tuples
         evaluate_state_wrapper,
         states,
         n_processes,
     )
 
-    if full_path:
-        return np.array([state[0] for state in result]), [path for state in result for path in state[1]]
-    return np.array(result)
-
 
-def evaluate_state(state, env, policy, horizon, n_traj=1, full_path=False, key='rewards', as_goals=True,
-                   aggregator=(np.sum, np.mean)):
-    aggregated_data = []
-    paths = []
+def _update_state_generator(env, state, as_goals):
     if as_goals:
         env.update_goal_generator(FixedStateGenerator(state))
     else:
         env.update_start_generator(FixedStateGenerator(state))
 
-    for j in range(n_traj):
-        paths.append(rollout(env, policy, horizon))
 
-        if key in paths[-1]:
-            aggregated_data.append(
-                aggregator[0](paths[-1][key])
-            )
+def _aggregate_paths(paths, full_path, key, aggregator):
+    aggregated_data = []
+    for path in paths:
+        if key in path:
+            aggregated_data.append(aggregator[0](path[key]))
         else:
-            aggregated_data.append(
-                aggregator[0](paths[-1]['env_infos'][key])
-            )
+            aggregated_data.append(aggregator[0](path['env_infos'][key]))
 
     mean_reward = aggregator[1](aggregated_data)
 
@@ -293,6 +357,55 @@ def evaluate_state(state, env, policy, horizon, n_traj=1, full_path=False, key='
     return mean_reward
 
 
+def evaluate_state(state, env, policy, horizon, n_traj=1, full_path=False, key='rewards', as_goals=True,
+                   aggregator=(np.sum, np.mean)):
+    _update_state_generator(env, state, as_goals)
+    paths = [rollout(env, policy, horizon) for _ in range(n_traj)]
+    return _aggregate_paths(paths, full_path, key, aggregator)
+
+
+def evaluate_states_vectorized(states, vec_env, policy, n_traj=1, full_path=False, key='rewards', as_goals=True,
+                               aggregator=(np.sum, np.mean)):
+    """
+    Same as calling evaluate_state on each state, but the n_traj rollouts of all the states are spread over the env
+    copies of vec_env, which are stepped together with one batched policy query per time step. The horizon is the
+    max_path_length of vec_env.
+    :return: the list of evaluate_state results
+    """
+    # one job per trajectory; each env copy runs one job at a time and picks the next one when done
+    jobs = [state_idx for state_idx in range(len(states)) for _ in range(n_traj)]
+    paths = [[] for _ in states]
+    env_jobs = [None] * vec_env.num_envs
+    n_started = [0]
+
+    def start_next_job(env_idx):
+        if n_started[0] < len(jobs):
+            env_jobs[env_idx] = jobs[n_started[0]]
+            n_started[0] += 1
+            _update_state_generator(vec_env.envs[env_idx], states[env_jobs[env_idx]], as_goals)
+        else:
+            env_jobs[env_idx] = None
+
+    def on_done(env_idx, path):
+        if env_jobs[env_idx] is not None:
+            paths[env_jobs[env_idx]].append(path)
+        start_next_job(env_idx)
+
+    for env_idx in range(vec_env.num_envs):
+        start_next_job(env_idx)
+    obses = vec_env.reset()
+    running_paths = [None] * vec_env.num_envs
+    while any(job is not None for job in env_jobs):
+        obses, _ = vec_rollout_step(vec_env, policy, obses, running_paths, on_done=on_done)
+
+    return [_aggregate_paths(state_paths, full_path, key, aggregator) for state_paths in paths]
+
+
+def _evaluate_state_chunk_task(vec_env, policy, states, n_traj, full_path, key, as_goals, aggregator):
+    return evaluate_states_vectorized(states, vec_env, policy, n_traj=n_traj, full_path=full_path, key=key,
+                                      as_goals=as_goals, aggregator=aggregator)
+
+
 def evaluate_state_env(env, policy, horizon, n_states=10, n_traj=1, n_processes=-1, **kwargs):
     evaluate_env_wrapper = FunctionWrapper(
         rollout,
@@ -18,23 +18,118 @@ import scipy.misc
 from curriculum.state.evaluator import parallel_map, disable_cuda_initializer
 
 
+class GrowableArray(object):
+    """ 2-d array supporting amortized O(1) appends of rows. """
+
+    def __init__(self, initial_capacity=1024):
+        self.initial_capacity = initial_capacity
+        self._data = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def data(self):
+        """ View on the rows appended so far. """
+        if self._data is None:
+            return np.zeros((0, 0))
+        return self._data[:self._size]
+
+    def extend(self, rows):
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return
+        if self._data is None:
+            self._data = np.empty((max(self.initial_capacity, len(rows)),) + rows.shape[1:], dtype=rows.dtype)
+        elif self._size + len(rows) > len(self._data):
+            new_data = np.empty((max(2 * len(self._data), self._size + len(rows)),) + self._data.shape[1:],
+                                dtype=self._data.dtype)
+            new_data[:self._size] = self._data[:self._size]
+            self._data = new_data
+        self._data[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+
+class IncrementalKDTree(object):
+    """
+    Nearest neighbor index supporting appends. The points are split between a main cKDTree and a smaller tree over
+    the most recently appended ones; the main tree is only rebuilt once the recent points outnumber rebuild_ratio
+    times the indexed ones, which keeps appends cheap (amortized O(log n) per point).
+    """
+
+    def __init__(self, rebuild_ratio=0.1, min_rebuild_size=1000):
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild_size = min_rebuild_size
+        self._points = GrowableArray()
+        self._n_indexed = 0
+        self._tree = None
+        self._recent_tree = None
+
+    def __len__(self):
+        return len(self._points)
+
+    @property
+    def points(self):
+        return self._points.data
+
+    def append(self, points):
+        self._points.extend(points)
+        n_recent = len(self._points) - self._n_indexed
+        if n_recent > max(self.min_rebuild_size, self.rebuild_ratio * self._n_indexed):
+            self._tree = scipy.spatial.cKDTree(self.points)
+            self._n_indexed = len(self._points)
+            self._recent_tree = None
+        elif n_recent > 0:
+            self._recent_tree = scipy.spatial.cKDTree(self.points[self._n_indexed:])
+
+    def min_distance(self, queries):
+        """ Distance from each query point to its nearest indexed point (inf if there is none). """
+        dists = np.full(len(queries), np.inf)
+        for tree in (self._tree, self._recent_tree):
+            if tree is not None:
+                dists = np.minimum(dists, tree.query(queries, k=1)[0])
+        return dists
+
+
+def greedy_radius_filter(points, radius):
+    """
+    Indices of the points kept by greedily scanning them in order and keeping each point that is at more than radius
+    from all the points kept before it.
+    """
+    neighbors = scipy.spatial.cKDTree(points).query_ball_point(points, radius)
+    kept = np.zeros(len(points), dtype=bool)
+    for i in range(len(points)):
+        kept[i] = not np.any(kept[neighbors[i]])
+    return np.where(kept)[0]
+
+
 class StateCollection(object):
     """ A collection of states, with minimum distance threshold for new states. """
 
     def __init__(self, distance_threshold=None, states_transform = None, idx_lim=None):
         self.distance_threshold = distance_threshold
-        self.state_list = []
         self.states_transform = states_transform
         self.idx_lim = idx_lim
-        if self.states_transform:
-            self.transformed_state_list = []
+        self.empty()
 
     @property
     def size(self):
-        return len(self.state_list)
+        return len(self._states)
+
+    @property
+    def state_list(self):
+        return self._states.data
+
+    @property
+    def transformed_state_list(self):
+        return self._index.points
 
     def empty(self):
-        self.state_list = []
+        self._states = GrowableArray()
+        # the distance threshold is enforced on the transformed states if there is a transform, otherwise on the
+        # first idx_lim coordinates
+        self._index = IncrementalKDTree()
 
     def sample(self, size, replace=False, replay_noise=0):
         states = sample_matrix_row(np.array(self.state_list), size, replace)
@@ -43,6 +138,12 @@ class StateCollection(object):
         return states
 
     def append(self, states, n_process=None):
+        """
+        Add the states that are at more than distance_threshold from each other and from the states already in the
+        collection.
+        :param n_process: unused, kept for backwards compatibility (the KD-tree queries are fast enough in process)
+        :return: the added states
+        """
         if self.states_transform:
             return self.append_states_transform(states)
         if len(states) > 0:
@@ -51,60 +152,29 @@ class StateCollection(object):
             if self.distance_threshold is not None and self.distance_threshold > 0:
                 states = self._process_states(states)
             logger.log("after processing, we are left with : {}".format(states.shape))
-            if n_process is None:
-                n_process = singleton_pool.n_parallel
-            elif n_process in [-1, 0]:
-                n_process = 1
-            if states.shape[0] >= n_process > 1:
-                states_per_process = states.shape[0] // singleton_pool.n_parallel
-                list_of_states = [states[i * states_per_process: (i+1) * states_per_process, :] for i in range(n_process-1)]
-                list_of_states.append(states[states_per_process * (n_process - 1):, :])
-                states = parallel_map(self._select_states, list_of_states)
-                states = np.concatenate(states)
-            else:
-                states = self._select_states(states)
-            self.state_list.extend(states.tolist())
+            states = self._select_states(states)
+            self._states.extend(states)
+            self._index.append(states[:, :self.idx_lim])
             return states
 
     def _select_states(self, states):
-        # print('selecting states from shape: ', states.shape)
         selected_states = states
-        selected_states_idx_lim = np.array([state[:self.idx_lim] for state in states])
-        # print('selecting states from shape (after idx_lim of ', self.idx_lim, ': ', selected_states_idx_lim.shape)
-        state_list_idx_lim = np.array([state[:self.idx_lim] for state in self.state_list])
-        # print('the state_list_idx_lim shape: ', np.shape(self.state_list))
-        if self.distance_threshold is not None and self.distance_threshold > 0:
-            if len(self.state_list) > 0:
-                dists = scipy.spatial.distance.cdist(state_list_idx_lim, selected_states_idx_lim)
-                indices = np.amin(dists, axis=0) > self.distance_threshold
-                selected_states = selected_states[indices, :]
-        # print('the selected states are: {}'.format(selected_states.shape))
+        if self.distance_threshold is not None and self.distance_threshold > 0 and self.size > 0:
+            indices = self._index.min_distance(states[:, :self.idx_lim]) > self.distance_threshold
+            selected_states = selected_states[indices, :]
         return selected_states
 
     def _process_states(self, states):
         "keep only the states that are at more than dist_threshold from each other"
         # adding a states transform allows you to maintain full state information while possibly disregarding some dim
         states = np.array(states)
-        results = [states[0]]
-        results_idx_lim = [states[0][:self.idx_lim]]
-        for i, state in enumerate(states[1:]):
-            # print("analyzing state : ", i)
-            if np.amin(scipy.spatial.distance.cdist(results_idx_lim, state.reshape(1, -1)[:self.idx_lim])) > self.distance_threshold:
-                results.append(state)
-                results_idx_lim.append(state[:self.idx_lim])
-        return np.array(results)
+        return states[greedy_radius_filter(states[:, :self.idx_lim], self.distance_threshold)]
 
     def _process_states_transform(self, states, transformed_states):
         "keep only the states that are at more than dist_threshold from each other"
         # adding a states transform allows you to maintain full state information while possibly disregarding some dim
-        results = [states[0]]
-        transformed_results = [transformed_states[0]]
-        for i in range(1, len(states)):
-            # checks if valid in transformed space
-            if np.amin(scipy.spatial.distance.cdist(transformed_results, transformed_states[i].reshape(1, -1))) > self.distance_threshold:
-                results.append(states[i])
-                transformed_results.append(transformed_states[i])
-        return np.array(results), np.array(transformed_results)
+        indices = greedy_radius_filter(transformed_states, self.distance_threshold)
+        return states[indices], transformed_states[indices]
 
     def append_states_transform(self, states):
         assert self.idx_lim is None, "Can't use state transform and idx_lim with StateCollection!"
@@ -113,35 +183,58 @@ class StateCollection(object):
             transformed_states = self.states_transform(states)
             if self.distance_threshold is not None and self.distance_threshold > 0:
                 states, transformed_states = self._process_states_transform(states, transformed_states)
-                if len(self.state_list) > 0:
-                    print("hi")
-                    dists = scipy.spatial.distance.cdist(self.transformed_state_list, transformed_states)
-                    indices = np.amin(dists, axis=0) > self.distance_threshold
+                if self.size > 0:
+                    indices = self._index.min_distance(transformed_states) > self.distance_threshold
                     states = states[indices, :]
                     transformed_states = transformed_states[indices, :]
-            self.state_list.extend(states)
-            self.transformed_state_list.extend(transformed_states)
-            assert(len(self.state_list) == len(self.transformed_state_list))
+            self._states.extend(states)
+            self._index.append(transformed_states)
+            assert(len(self._states) == len(self._index))
         return states # modifed to return added states
 
-    # def append(self, states):
-    #     if self.states_transform:
-    #         return self.append_states_transform(states)
-    #     if len(states) > 0:
-    #         states = np.array(states)
-    #         if self.distance_threshold is not None and self.distance_threshold > 0:
-    #             states = self._process_states(states)
-    #             if len(self.state_list) > 0:
-    #                 dists = scipy.spatial.distance.cdist(self.state_list, states)
-    #                 indices = np.amin(dists, axis=0) > self.distance_threshold
-    #                 states = states[indices, :]
-    #         self.state_list.extend(states)
-    #     return states # modifed to return added states
-
     @property
     def states(self):
         return np.array(self.state_list)
 
+    def __setstate__(self, d):
+        state_list = d.pop("state_list", None)
+        transformed_state_list = d.pop("transformed_state_list", None)
+        self.__dict__.update(d)
+        if state_list is not None:
+            # pickled when the states were kept in python lists
+            self.empty()
+            if len(state_list) > 0:
+                states = np.array(state_list)
+                self._states.extend(states)
+                if transformed_state_list is not None:
+                    self._index.append(np.array(transformed_state_list))
+                else:
+                    self._index.append(states[:, :self.idx_lim])
+
+def state_key(state):
+    """ Hashable key of a state, equal for states with equal coordinates. """
+    # adding 0. turns -0. into 0., which compares equal to it but has other bytes
+    return (np.asarray(state, dtype=np.float64) + 0.).tobytes()
+
+
+def top_k_indices(values, k):
+    """
+    Indices of the k largest values, in decreasing order of value and, for equal values, in increasing order of index
+    (as a stable sort would give them). Only the k largest values are sorted.
+    """
+    values = -np.asarray(values)
+    if k >= len(values):
+        return np.argsort(values, kind='stable')
+    if k <= 0:
+        return np.zeros(0, dtype=int)
+    threshold = values[np.argpartition(values, k - 1)[:k]].max()
+    smaller = np.where(values < threshold)[0]
+    # the first of the values equal to the k-th largest one
+    equal = np.where(values == threshold)[0][:k - len(smaller)]
+    indices = np.sort(np.concatenate([smaller, equal]))
+    return indices[np.argsort(values[indices], kind='stable')]
+
+
 class SmartStateCollection(StateCollection):
     # should be used same as before, just need to update Q values
     #TODO: update alpha smartly
@@ -149,44 +242,65 @@ class SmartStateCollection(StateCollection):
         self.eps = eps # percentage of random
         self.alpha = alpha
         self.abs = abs
-        self.q_vals = {} #TODO: smarter way to keep list sorted, maybe priority queue?
-        # use heapq https://stackoverflow.com/questions/7197315/5-maximum-values-in-a-python-dictionary if slow
-        self.prev_vals = {}
         super(SmartStateCollection, self).__init__(*args, **kwargs)
 
+    def empty(self):
+        super(SmartStateCollection, self).empty()
+        # key: state_key of a state, value: its first row in state_list
+        self._rows = {}
+        # Q and previous values of the states, by row of state_list. Only the first row of each state has values.
+        self._q_vals = GrowableArray()
+        self._prev_vals = GrowableArray()
+        self._has_q = GrowableArray()
+
+    @property
+    def q_vals(self):
+        q_vals = self._q_vals.data
+        return {tuple(self.state_list[row]): q_vals[row] for row in self._rows.values()}
+
+    @property
+    def prev_vals(self):
+        prev_vals = self._prev_vals.data
+        return {tuple(self.state_list[row]): prev_vals[row] for row in self._rows.values()}
+
     def update_starts(self, states, rewards, only_good = True, logger = None):
-        old_states, old_rewards, new_states, new_rewards = [], [], [], []
-        for i in range(len(states)):
-            state = states[i]
-            reward = rewards[i]
-            if only_good:
-                # TODO: set option
-                # intuition is that we don't want states that we already master
-                if reward < 0.02 or reward > 0.98:
-                    continue
-            # check if state shows up
-            if len(self.state_list) > 0 and np.sum(np.all(state == self.state_list, axis = 1)) > 0:
-                old_states.append(state)
-                old_rewards.append(reward)
-            else:
-                new_states.append(state)
-                new_rewards.append(reward)
+        states = np.asarray(states)
+        rewards = np.asarray(rewards)
+        if only_good:
+            # TODO: set option
+            # intuition is that we don't want states that we already master
+            good = np.logical_not(np.logical_or(rewards < 0.02, rewards > 0.98))
+            states, rewards = states[good], rewards[good]
+        # check if state shows up
+        is_old = np.array([state_key(state) in self._rows for state in states], dtype=bool)
+        is_new = np.logical_not(is_old)
         if logger is not None:
-            logger.log("Total states: {}  New states: {}".format(len(states), len(new_states)))
-        self.append(new_states, new_rewards)
-        self.update_q(old_states, old_rewards)
+            logger.log("Total states: {}  New states: {}".format(len(states), np.sum(is_new)))
+        self.append(states[is_new], rewards[is_new])
+        self.update_q(states[is_old], rewards[is_old])
 
     def append(self, states, rewards):
-        zero_index = 0 # check on np.argmax
+        first_row = len(self.state_list)
+        input_indices = {}
+        for index, state in enumerate(states):
+            input_indices.setdefault(state_key(state), index)
         added_states = super(SmartStateCollection, self).append(states)
-        for state in added_states:
-            index = np.argmax(np.all(states == state, axis =1)) # should only get one index
-            if index == 0:
-                zero_index += 1
-            reward = rewards[index]
-            self.q_vals[tuple(state)] = self.alpha * reward # TODO: not sure what the initialization should be, is there alpha term?
-            self.prev_vals[tuple(state)] = reward
-        assert (zero_index < 2)
+        if added_states is None or len(added_states) == 0:
+            return
+        q_vals = np.zeros(len(added_states))
+        prev_vals = np.zeros(len(added_states))
+        has_q = np.zeros(len(added_states), dtype=bool)
+        for i, state in enumerate(added_states):
+            key = state_key(state)
+            reward = rewards[input_indices[key]]
+            q_vals[i] = self.alpha * reward # TODO: not sure what the initialization should be, is there alpha term?
+            prev_vals[i] = reward
+            if key not in self._rows:
+                self._rows[key] = first_row + i
+                has_q[i] = True
+        self._q_vals.extend(q_vals)
+        self._prev_vals.extend(prev_vals)
+        self._has_q.extend(has_q)
 
     def sample(self, size, replace=False, replay_noise=0):
         size_random_samples = int(size * self.eps)
@@ -195,11 +309,11 @@ class SmartStateCollection(StateCollection):
         states = sample_matrix_row(np.array(self.state_list), size_random_samples, replace)
         if size_good_samples == 0:
             return states # fully uniform states
+        rows = np.where(self._has_q.data)[0]
+        q_vals = self._q_vals.data[rows]
         if self.abs:
-            good_states = sorted(self.q_vals, key= lambda k: abs(self.q_vals[k]), reverse=True)[:size_good_samples]
-        else:
-            good_states = sorted(self.q_vals, key=self.q_vals.get, reverse=True)[:size_good_samples]
-        good_states = np.array(good_states)
+            q_vals = np.abs(q_vals)
+        good_states = self.state_list[rows[top_k_indices(q_vals, size_good_samples)]]
         return np.concatenate((states, good_states))
         # if replay_noise > 0:
         #     states += replay_noise * np.random.randn(*states.shape)
@@ -207,22 +321,35 @@ class SmartStateCollection(StateCollection):
 
     def update_q(self, states, rewards):
         # updated should be true if there are enough samples
-        previous_values = np.array([self.prev_vals[tuple(state)] for state in states])
-        curr_q_values =  np.array([self.q_vals[tuple(state)] for state in states])
-        improvement = rewards - previous_values
-        new_values = self.alpha * improvement + (1 - self.alpha) * curr_q_values
-
-        for i in range(len(states)):
-            # if updated[i]:
-            self.q_vals[tuple(states[i])] = new_values[i]
-            self.prev_vals[tuple(states[i])] = rewards[i]
-
-
-
-
-
-
-
+        if len(states) == 0:
+            return
+        rows = np.array([self._rows[state_key(state)] for state in states])
+        rewards = np.asarray(rewards)
+        q_vals, prev_vals = self._q_vals.data, self._prev_vals.data
+        improvement = rewards - prev_vals[rows]
+        new_values = self.alpha * improvement + (1 - self.alpha) * q_vals[rows]
+        # the last update of a state given several times wins
+        last = len(rows) - 1 - np.unique(rows[::-1], return_index=True)[1]
+        q_vals[rows[last]] = new_values[last]
+        prev_vals[rows[last]] = rewards[last]
+
+    def __setstate__(self, d):
+        q_vals = d.pop("q_vals", None)
+        prev_vals = d.pop("prev_vals", None)
+        super(SmartStateCollection, self).__setstate__(d)
+        if q_vals is not None:
+            # pickled when the values were kept in dictionaries keyed by the states
+            self._rows = {}
+            has_q = np.zeros(self.size, dtype=bool)
+            for row, state in enumerate(self.state_list):
+                key = state_key(state)
+                if key not in self._rows and tuple(state) in q_vals:
+                    self._rows[key] = row
+                    has_q[row] = True
+            self._q_vals, self._prev_vals, self._has_q = GrowableArray(), GrowableArray(), GrowableArray()
+            self._q_vals.extend([q_vals.get(tuple(state), 0.) for state in self.state_list])
+            self._prev_vals.extend([prev_vals.get(tuple(state), 0.) for state in self.state_list])
+            self._has_q.extend(has_q)
 
 
 def sample_matrix_row(M, size, replace=False):
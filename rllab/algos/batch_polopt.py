@@ -1,37 +1,54 @@
 from rllab.algos.base import RLAlgorithm
 from rllab.sampler import parallel_sampler
 from rllab.sampler.base import BaseSampler
+from rllab.sampler.stateful_pool import singleton_pool
 import rllab.misc.logger as logger
+from rllab.misc import ext
 import rllab.plotter as plotter
 from rllab.policies.base import Policy
 
 
 class BatchSampler(BaseSampler):
-    def __init__(self, algo):
+    def __init__(self, algo, persistent_workers=False, shared_memory=False):
         """
         :type algo: BatchPolopt
+        :param persistent_workers: keep the env and policy replicas alive on the workers when the algorithm shuts
+        down, so that a later algorithm using the same env, policy and scope (e.g. the next outer iteration of a
+        curriculum) only needs to send the policy parameters and the updated start / goal generators
+        :param shared_memory: transport the collected paths from the workers through shared memory instead of
+        pickling them
         """
         self.algo = algo
+        self.persistent_workers = persistent_workers
+        self.shared_memory = shared_memory
 
     def start_worker(self):
         parallel_sampler.populate_task(self.algo.env, self.algo.policy, scope=self.algo.scope)
 
     def shutdown_worker(self):
-        parallel_sampler.terminate_task(scope=self.algo.scope)
+        if not self.persistent_workers:
+            parallel_sampler.terminate_task(scope=self.algo.scope)
 
     def obtain_samples(self, itr):
+        return self.obtain_samples_async(itr).get()
+
+    def obtain_samples_async(self, itr):
+        """
+        Start collecting the samples of the given iteration with the current policy parameters.
+        :return: a handle whose get method returns the list of paths
+        """
         cur_params = self.algo.policy.get_param_values()
-        paths = parallel_sampler.sample_paths(
+        result = parallel_sampler.sample_paths_async(
             policy_params=cur_params,
             max_samples=self.algo.batch_size,
             max_path_length=self.algo.max_path_length,
             scope=self.algo.scope,
+            shared_memory=self.shared_memory,
         )
         if self.algo.whole_paths:
-            return paths
+            return result
         else:
-            paths_truncated = parallel_sampler.truncate_paths(paths, self.algo.batch_size)
-            return paths_truncated
+            return result.then(lambda paths: parallel_sampler.truncate_paths(paths, self.algo.batch_size))
 
 
 class BatchPolopt(RLAlgorithm):
@@ -60,6 +77,7 @@ class BatchPolopt(RLAlgorithm):
             whole_paths=True,
             sampler_cls=None,
             sampler_args=None,
+            pipelined_sampling=False,
             **kwargs
     ):
         """
@@ -81,6 +99,13 @@ class BatchPolopt(RLAlgorithm):
         :param positive_adv: Whether to shift the advantages so that they are always positive. When used in
         conjunction with center_adv the advantages will be standardized before shifting.
         :param store_paths: Whether to save all paths data to the snapshot.
+        :param pipelined_sampling: Whether to collect the samples of the next iteration while optimizing on the
+        current ones. With worker processes (n_parallel > 1), the next batch is then sampled with the pre-update
+        policy parameters, i.e. it lags one update behind; the old distribution infos stored with the samples are
+        those of the sampling policy. With a single process, nothing overlaps: the batch is only collected when it is
+        needed, after the update and with the updated parameters, as without pipelining. Requires a sampler
+        implementing obtain_samples_async. Incompatible with the data_parallel mode of the optimizers (also
+        that of the baseline's regressor), whose evaluations would wait for the workers to be done sampling.
         """
         self.env = env
         self.policy = policy
@@ -98,6 +123,11 @@ class BatchPolopt(RLAlgorithm):
         self.positive_adv = positive_adv
         self.store_paths = store_paths
         self.whole_paths = whole_paths
+        self.pipelined_sampling = pipelined_sampling
+        if pipelined_sampling and getattr(getattr(self, "optimizer", None), "_data_parallel", False):
+            # every data parallel evaluation is a barrier across the workers, which are all busy collecting the next
+            # batch: the optimization would wait for the sampling, and the overlap would be wrongly reported
+            raise ValueError("pipelined_sampling cannot be used with a data_parallel optimizer")
         if sampler_cls is None:
             sampler_cls = BatchSampler
         if sampler_args is None:
@@ -112,18 +142,36 @@ class BatchPolopt(RLAlgorithm):
 
     def shutdown_worker(self):
         self.sampler.shutdown_worker()
+        # free what the optimizer keeps on the workers, e.g. for its data parallel evaluation
+        optimizer = getattr(self, "optimizer", None)
+        if optimizer is not None and hasattr(optimizer, "terminate"):
+            optimizer.terminate()
 
     def train(self, already_init=False):
         self.start_worker()
         if not already_init:
             self.init_opt()
         all_paths = []
+        pending_samples = None
+        if self.pipelined_sampling and singleton_pool.n_parallel <= 1:
+            logger.log("WARNING: pipelined_sampling has no effect without worker processes (n_parallel > 1), "
+                       "the samples are collected after each update")
         for itr in range(self.current_itr, self.n_itr):
             with logger.prefix('itr #%d | ' % itr):
-                paths = self.sampler.obtain_samples(itr)
+                if self.pipelined_sampling:
+                    if pending_samples is None:
+                        pending_samples = self.sampler.obtain_samples_async(itr)
+                    paths = pending_samples.get()
+                    self.record_sampling_overlap(pending_samples)
+                    # start on the next batch with the pre-update parameters while this one is being optimized on
+                    if itr + 1 < self.n_itr:
+                        pending_samples = self.sampler.obtain_samples_async(itr + 1)
+                else:
+                    paths = self.sampler.obtain_samples(itr)
                 samples_data = self.sampler.process_samples(itr, paths)
                 self.log_diagnostics(paths)
                 self.optimize_policy(itr, samples_data)
+                ext.record_function_cache_stats()
                 logger.log("saving snapshot...")
                 params = self.get_itr_snapshot(itr, samples_data)
                 self.current_itr = itr + 1
@@ -143,6 +191,19 @@ class BatchPolopt(RLAlgorithm):
         self.shutdown_worker()
         return all_paths
 
+    def record_sampling_overlap(self, collect_result):
+        """
+        Log how much of the sampling time was hidden behind the master's work in pipelined mode.
+        """
+        sample_time = max(stats["time"] for stats in singleton_pool.collect_stats)
+        wait_time = collect_result.wait_time
+        logger.record_tabular('SampleTime', sample_time)
+        logger.record_tabular('SampleWaitTime', wait_time)
+        if sample_time > 0:
+            logger.record_tabular('SampleOverlap', max(sample_time - wait_time, 0.) / sample_time)
+        else:
+            logger.record_tabular('SampleOverlap', 0.)
+
     def log_diagnostics(self, paths):
         self.env.log_diagnostics(paths)
         self.policy.log_diagnostics(paths)
@@ -1,8 +1,10 @@
 from rllab.algos.base import RLAlgorithm
+from rllab.algos.util import SumTree
 from rllab.misc.overrides import overrides
 from rllab.misc import special
 from rllab.misc import ext
 from rllab.sampler import parallel_sampler
+from rllab.sampler.parallel_actors import ParallelActors
 from rllab.plotter import plotter
 from functools import partial
 import rllab.misc.logger as logger
@@ -10,6 +12,7 @@ import theano.tensor as TT
 import pickle as pickle
 import numpy as np
 import pyprind
+import time
 import lasagne
 
 
@@ -24,7 +27,11 @@ def parse_update_method(update_method, **kwargs):
 
 class SimpleReplayPool(object):
     def __init__(
-            self, max_pool_size, observation_dim, action_dim):
+            self, max_pool_size, observation_dim, action_dim, explicit_next_observations=False):
+        """
+        :param explicit_next_observations: store the next observation of each sample, passed to add_sample, instead
+        of using the observation of the following sample. Needed when the samples of several paths are interleaved.
+        """
         self._observation_dim = observation_dim
         self._action_dim = action_dim
         self._max_pool_size = max_pool_size
@@ -36,15 +43,22 @@ class SimpleReplayPool(object):
         )
         self._rewards = np.zeros(max_pool_size)
         self._terminals = np.zeros(max_pool_size, dtype='uint8')
+        self._explicit_next_observations = explicit_next_observations
+        if explicit_next_observations:
+            self._next_observations = np.zeros(
+                (max_pool_size, observation_dim),
+            )
         self._bottom = 0
         self._top = 0
         self._size = 0
 
-    def add_sample(self, observation, action, reward, terminal):
+    def add_sample(self, observation, action, reward, terminal, next_observation=None):
         self._observations[self._top] = observation
         self._actions[self._top] = action
         self._rewards[self._top] = reward
         self._terminals[self._top] = terminal
+        if self._explicit_next_observations:
+            self._next_observations[self._top] = next_observation
         self._top = (self._top + 1) % self._max_pool_size
         if self._size >= self._max_pool_size:
             self._bottom = (self._bottom + 1) % self._max_pool_size
@@ -52,35 +66,90 @@ class SimpleReplayPool(object):
             self._size += 1
 
     def random_batch(self, batch_size):
+        """
+        Draw batch_size transitions uniformly. The returned arrays are buffers reused by the next call with the same
+        batch_size.
+        """
         assert self._size > batch_size
-        indices = np.zeros(batch_size, dtype='uint64')
-        transition_indices = np.zeros(batch_size, dtype='uint64')
-        count = 0
-        while count < batch_size:
-            index = np.random.randint(self._bottom, self._bottom + self._size) % self._max_pool_size
-            # make sure that the transition is valid: if we are at the end of the pool, we need to discard
-            # this sample
-            if index == self._size - 1 and self._size <= self._max_pool_size:
-                continue
-            # if self._terminals[index]:
-            #     continue
-            transition_index = (index + 1) % self._max_pool_size
-            indices[count] = index
-            transition_indices[count] = transition_index
-            count += 1
-        return dict(
-            observations=self._observations[indices],
-            actions=self._actions[indices],
-            rewards=self._rewards[indices],
-            terminals=self._terminals[indices],
-            next_observations=self._observations[transition_indices]
-        )
+        # unless stored explicitly, the next observation of the most recent sample is not in the pool yet
+        n_valid = self._size if self._explicit_next_observations else self._size - 1
+        indices = (self._bottom + np.random.randint(0, n_valid, size=batch_size)) % self._max_pool_size
+        return self._gather_batch(indices)
+
+    def _gather_batch(self, indices):
+        batch_size = len(indices)
+        buffers = getattr(self, "_batch_buffers", None)
+        if buffers is None or len(buffers["rewards"]) != batch_size:
+            buffers = self._batch_buffers = dict(
+                observations=np.zeros((batch_size, self._observation_dim)),
+                actions=np.zeros((batch_size, self._action_dim)),
+                rewards=np.zeros(batch_size),
+                terminals=np.zeros(batch_size, dtype='uint8'),
+                next_observations=np.zeros((batch_size, self._observation_dim)),
+            )
+        self._observations.take(indices, axis=0, out=buffers["observations"])
+        self._actions.take(indices, axis=0, out=buffers["actions"])
+        self._rewards.take(indices, out=buffers["rewards"])
+        self._terminals.take(indices, out=buffers["terminals"])
+        if self._explicit_next_observations:
+            self._next_observations.take(indices, axis=0, out=buffers["next_observations"])
+        else:
+            self._observations.take((indices + 1) % self._max_pool_size, axis=0, out=buffers["next_observations"])
+        return dict(buffers)
 
     @property
     def size(self):
         return self._size
 
 
+class PrioritizedReplayPool(SimpleReplayPool):
+    """
+    Replay pool drawing transitions proportionally to priority ** alpha, the priority being the magnitude of their
+    last TD error (prioritized experience replay). New transitions get the maximum priority seen so far. The batches
+    also contain the drawn indices, to be passed back to update_priorities, and the normalized importance sampling
+    weights (N * P(i)) ** -beta correcting for the non-uniform sampling.
+    """
+
+    def __init__(self, max_pool_size, observation_dim, action_dim, alpha=0.6, beta=0.4, epsilon=1e-6,
+                 explicit_next_observations=False):
+        super(PrioritizedReplayPool, self).__init__(
+            max_pool_size, observation_dim, action_dim, explicit_next_observations)
+        self._alpha = alpha
+        self._beta = beta
+        self._epsilon = epsilon
+        self._max_priority = 1.
+        self._tree = SumTree(max_pool_size)
+
+    def add_sample(self, observation, action, reward, terminal, next_observation=None):
+        if self._explicit_next_observations:
+            self._tree.update([self._top], self._max_priority ** self._alpha)
+        else:
+            if self._size > 0:
+                # the previous sample now has its next observation
+                self._tree.update([(self._top - 1) % self._max_pool_size], self._max_priority ** self._alpha)
+            # the new sample cannot be drawn until the next one is added
+            self._tree.update([self._top], 0.)
+        super(PrioritizedReplayPool, self).add_sample(observation, action, reward, terminal, next_observation)
+
+    def random_batch(self, batch_size):
+        assert self._size > batch_size
+        # stratified sampling: one draw in each of batch_size equal slices of the total priority
+        segment = self._tree.total / batch_size
+        indices = self._tree.find((np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment)
+        batch = self._gather_batch(indices)
+        probabilities = self._tree.get(indices) / self._tree.total
+        n_valid = self._size if self._explicit_next_observations else self._size - 1
+        weights = (n_valid * probabilities) ** -self._beta
+        batch["indices"] = indices
+        batch["weights"] = weights / np.max(weights)
+        return batch
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self._epsilon
+        self._max_priority = max(self._max_priority, np.max(priorities))
+        self._tree.update(indices, priorities ** self._alpha)
+
+
 class DDPG(RLAlgorithm):
     """
     Deep Deterministic Policy Gradient.
@@ -111,6 +180,11 @@ class DDPG(RLAlgorithm):
             n_updates_per_sample=1,
             scale_reward=1.0,
             include_horizon_terminal_transitions=False,
+            prioritized_replay=False,
+            prioritized_replay_alpha=0.6,
+            prioritized_replay_beta=0.4,
+            n_actors=0,
+            actor_queue_size=1000,
             plot=False,
             pause_for_plot=False):
         """
@@ -137,6 +211,15 @@ class DDPG(RLAlgorithm):
         :param scale_reward: The scaling factor applied to the rewards when training
         :param include_horizon_terminal_transitions: whether to include transitions with terminal=True because the
         horizon was reached. This might make the Q value back up less stable for certain tasks.
+        :param prioritized_replay: whether to draw the transitions proportionally to their TD error (see
+        PrioritizedReplayPool), weighting the Q function loss by the importance sampling weights.
+        :param prioritized_replay_alpha: exponent of the priorities
+        :param prioritized_replay_beta: exponent of the importance sampling weights
+        :param n_actors: if > 0, number of actor processes stepping their own copy of the environment with the
+        exploration strategy, while this process only trains on the transitions they stream back (see
+        ParallelActors). The default (0) alternates between environment steps and updates in this process, which is
+        reproducible.
+        :param actor_queue_size: number of transitions an actor can collect ahead of the learner
         :param plot: Whether to visualize the policy performance after each eval_interval.
         :param pause_for_plot: Whether to pause before continuing when plotting.
         :return:
@@ -170,6 +253,11 @@ class DDPG(RLAlgorithm):
         self.soft_target_tau = soft_target_tau
         self.n_updates_per_sample = n_updates_per_sample
         self.include_horizon_terminal_transitions = include_horizon_terminal_transitions
+        self.prioritized_replay = prioritized_replay
+        self.prioritized_replay_alpha = prioritized_replay_alpha
+        self.prioritized_replay_beta = prioritized_replay_beta
+        self.n_actors = n_actors
+        self.actor_queue_size = actor_queue_size
         self.plot = plot
         self.pause_for_plot = pause_for_plot
 
@@ -190,17 +278,35 @@ class DDPG(RLAlgorithm):
         if self.plot:
             plotter.init_plot(self.env, self.policy)
 
-    @overrides
-    def train(self):
-        # This seems like a rather sequential method
-        pool = SimpleReplayPool(
+    def create_pool(self):
+        # the transitions of the actors are interleaved, so they come with their next observation
+        explicit_next_observations = self.n_actors > 0
+        if self.prioritized_replay:
+            return PrioritizedReplayPool(
+                max_pool_size=self.replay_pool_size,
+                observation_dim=self.env.observation_space.flat_dim,
+                action_dim=self.env.action_space.flat_dim,
+                alpha=self.prioritized_replay_alpha,
+                beta=self.prioritized_replay_beta,
+                explicit_next_observations=explicit_next_observations,
+            )
+        return SimpleReplayPool(
             max_pool_size=self.replay_pool_size,
             observation_dim=self.env.observation_space.flat_dim,
             action_dim=self.env.action_space.flat_dim,
+            explicit_next_observations=explicit_next_observations,
         )
+
+    @overrides
+    def train(self):
+        # This seems like a rather sequential method
+        pool = self.create_pool()
         self.start_worker()
 
         self.init_opt()
+        if self.n_actors > 0:
+            self.train_with_actors(pool)
+            return
         itr = 0
         path_length = 0
         path_return = 0
@@ -241,29 +347,76 @@ class DDPG(RLAlgorithm):
                 observation = next_observation
 
                 if pool.size >= self.min_pool_size:
-                    for update_itr in range(self.n_updates_per_sample):
-                        # Train policy
-                        batch = pool.random_batch(self.batch_size)
-                        self.do_training(itr, batch)
+                    self.train_on_sample(itr, pool)
                     sample_policy.set_param_values(self.policy.get_param_values())
 
                 itr += 1
 
             logger.log("Training finished")
-            if pool.size >= self.min_pool_size:
-                self.evaluate(epoch, pool)
-                params = self.get_epoch_snapshot(epoch)
-                logger.save_itr_params(epoch, params)
-            logger.dump_tabular(with_prefix=False)
-            logger.pop_prefix()
-            if self.plot:
-                self.update_plot()
-                if self.pause_for_plot:
-                    input("Plotting evaluation run: Press Enter to "
-                              "continue...")
+            self.end_epoch(epoch, pool)
+        self.env.terminate()
+        self.policy.terminate()
+
+    def train_with_actors(self, pool):
+        """
+        Training loop of the n_actors > 0 mode: the transitions are collected by ParallelActors, and the policy
+        parameters are sent back to them after each round of updates.
+        """
+        actors = ParallelActors(
+            self.env, self.policy, self.es, self.n_actors, self.max_path_length,
+            include_horizon_terminal_transitions=self.include_horizon_terminal_transitions,
+            scale_reward=self.scale_reward,
+            queue_size=self.actor_queue_size,
+        )
+        actors.start()
+        itr = 0
+        try:
+            for epoch in range(self.n_epochs):
+                logger.push_prefix('epoch #%d | ' % epoch)
+                logger.log("Training started")
+                n_epoch_samples = 0
+                while n_epoch_samples < self.epoch_length:
+                    n_new_samples = actors.add_transitions(pool)
+                    if n_new_samples == 0:
+                        time.sleep(0.001)
+                        continue
+                    n_epoch_samples += n_new_samples
+                    self.es_path_returns.extend(actors.get_path_returns())
+                    # keep the same number of updates per sample as in the sequential mode
+                    for _ in range(n_new_samples):
+                        if pool.size >= self.min_pool_size:
+                            self.train_on_sample(itr, pool)
+                        itr += 1
+                    actors.set_policy_params(self.policy.get_param_values())
+                logger.log("Training finished")
+                self.end_epoch(epoch, pool)
+        finally:
+            actors.stop()
         self.env.terminate()
         self.policy.terminate()
 
+    def train_on_sample(self, itr, pool):
+        for update_itr in range(self.n_updates_per_sample):
+            # Train policy
+            batch = pool.random_batch(self.batch_size)
+            self.do_training(itr, batch)
+            if self.prioritized_replay:
+                # TD errors of the batch, as recorded by do_training
+                pool.update_priorities(batch["indices"], self.y_averages[-1] - self.q_averages[-1])
+
+    def end_epoch(self, epoch, pool):
+        if pool.size >= self.min_pool_size:
+            self.evaluate(epoch, pool)
+            params = self.get_epoch_snapshot(epoch)
+            logger.save_itr_params(epoch, params)
+        logger.dump_tabular(with_prefix=False)
+        logger.pop_prefix()
+        if self.plot:
+            self.update_plot()
+            if self.pause_for_plot:
+                input("Plotting evaluation run: Press Enter to "
+                          "continue...")
+
     def init_opt(self):
 
         # First, create "target" policy and Q functions
@@ -290,7 +443,14 @@ class DDPG(RLAlgorithm):
 
         qval = self.qf.get_qval_sym(obs, action)
 
-        qf_loss = TT.mean(TT.square(yvar - qval))
+        if self.prioritized_replay:
+            # importance sampling weights of the prioritized replay
+            weights = TT.vector('weights')
+            qf_loss = TT.mean(weights * TT.square(yvar - qval))
+            qf_inputs = [yvar, obs, action, weights]
+        else:
+            qf_loss = TT.mean(TT.square(yvar - qval))
+            qf_inputs = [yvar, obs, action]
         qf_reg_loss = qf_loss + qf_weight_decay_term
 
         policy_weight_decay_term = 0.5 * self.policy_weight_decay * \
@@ -310,7 +470,7 @@ class DDPG(RLAlgorithm):
             policy_reg_surr, self.policy.get_params(trainable=True))
 
         f_train_qf = ext.compile_function(
-            inputs=[yvar, obs, action],
+            inputs=qf_inputs,
             outputs=[qf_loss, qval],
             updates=qf_updates
         )
@@ -348,7 +508,10 @@ class DDPG(RLAlgorithm):
         f_train_qf = self.opt_info["f_train_qf"]
         f_train_policy = self.opt_info["f_train_policy"]
 
-        qf_loss, qval = f_train_qf(ys, obs, actions)
+        if self.prioritized_replay:
+            qf_loss, qval = f_train_qf(ys, obs, actions, batch["weights"])
+        else:
+            qf_loss, qval = f_train_qf(ys, obs, actions)
 
         policy_surr = f_train_policy(obs)
 
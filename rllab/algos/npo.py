@@ -94,7 +94,9 @@ class NPO(BatchPolopt):
             target=self.policy,
             leq_constraint=(mean_kl, self.step_size),
             inputs=input_list,
-            constraint_name="mean_kl"
+            constraint_name="mean_kl",
+            dist_info_vars=[dist_info_vars[k] for k in dist.dist_info_keys],
+            policy_scope=self.scope,
         )
         return dict()
 
@@ -16,6 +16,53 @@ def sign(x):
     return 1. * (x >= 0) - 1. * (x < 0)
 
 
+class SumTree(object):
+    """
+    Binary tree over a fixed number of non-negative priorities, each node holding the sum of its children. Updating
+    priorities and drawing indices proportionally to them take O(log capacity) numpy operations for a whole batch.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # number of leaves, rounded up to a power of two; node i has children 2i and 2i+1, the root is node 1
+        self._n_leaves = 1 << max(int(np.ceil(np.log2(capacity))), 0)
+        self._depth = int(np.log2(self._n_leaves))
+        self._nodes = np.zeros(2 * self._n_leaves)
+
+    @property
+    def total(self):
+        return self._nodes[1]
+
+    def get(self, indices):
+        return self._nodes[self._n_leaves + np.asarray(indices)]
+
+    def update(self, indices, priorities):
+        """
+        Set the priorities of the given indices (the last value wins for repeated indices).
+        """
+        nodes = self._n_leaves + np.asarray(indices, dtype=int).ravel()
+        self._nodes[nodes] = priorities
+        for _ in range(self._depth):
+            # repeated parents get the same sum, no need to deduplicate them
+            nodes = nodes // 2
+            self._nodes[nodes] = self._nodes[2 * nodes] + self._nodes[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        :param values: array of values in [0, total)
+        :return: for each value, the index i such that the sum of the priorities before i is <= value, and the sum up
+        to and including i is > value
+        """
+        values = np.minimum(np.asarray(values, dtype=np.float64), np.nextafter(self.total, 0))
+        nodes = np.ones(len(values), dtype=int)
+        for _ in range(self._depth):
+            left = 2 * nodes
+            go_right = values >= self._nodes[left]
+            values = values - np.where(go_right, self._nodes[left], 0.)
+            nodes = left + go_right
+        return nodes - self._n_leaves
+
+
 class ReplayPool(Serializable):
     """
     A utility class for experience replay.
@@ -169,84 +216,48 @@ class ReplayPool(Serializable):
         """
         Return corresponding observations, actions, rewards, terminal status,
         and next_observations for batch_size randomly chosen state transitions.
+        The returned arrays are buffers reused by the next call with the same batch_size.
         """
-        # Allocate the response.
-
-        observations = np.zeros(
-            (batch_size, self.concat_length) + self.observation_shape,
-            dtype=self.observation_dtype
-        )
-        actions = np.zeros(
-            (batch_size, self.action_dim),
-            dtype=self.action_dtype
-        )
-        rewards = np.zeros((batch_size,), dtype=floatX)
-        terminals = np.zeros((batch_size,), dtype='bool')
+        buffers = self._get_batch_buffers(batch_size)
+        index_range = self.size - self.concat_length
+        if index_range < 1:
+            raise ValueError("Not enough samples in the pool")
+
+        # Randomly choose time steps from the replay memory. Check that the initial state corresponds entirely to a
+        # single episode, meaning none but the last frame may be terminal. If the last frame of the initial state is
+        # terminal, then the last frame of the transitioned state will actually be the first frame of a new episode,
+        # which the Q learner recognizes and handles correctly during training by zeroing the discounted future
+        # reward estimate. Invalid draws are rejected and drawn again.
+        indices = np.zeros(0, dtype=int)
+        while len(indices) < batch_size:
+            candidates = self.bottom + self.rng.randint(0, index_range, size=batch_size - len(indices))
+            if self.concat_length > 1:
+                initial_terminals = self.terminals.take(
+                    candidates[:, None] + np.arange(self.concat_length - 1), mode='wrap')
+                candidates = candidates[~np.any(initial_terminals, axis=1)]
+            indices = np.concatenate([indices, candidates])
+        # do not pick samples which terminated because of horizon
+        # if np.any(self.horizon_terminals.take(initial_indices[0:-1],
+        #    mode='wrap')) or self.horizon_terminals[end_index]:
+        #    continue
+
+        initial_indices = indices[:, None] + np.arange(self.concat_length)
+        transition_indices = initial_indices + 1
+        end_indices = indices + self.concat_length - 1
+
+        # Gather the state transitions into the response.
+        self.observations.take(initial_indices, axis=0, mode='wrap', out=buffers["observations"])
+        self.actions.take(end_indices, axis=0, mode='wrap', out=buffers["actions"])
+        self.rewards.take(end_indices, mode='wrap', out=buffers["rewards"])
+        self.terminals.take(end_indices, mode='wrap', out=buffers["terminals"])
         if self.extras is not None:
-            extras = np.zeros(
-                (batch_size,) + self.extras.shape[1:],
-                dtype=self.extras.dtype
-            )
-            next_extras = np.zeros(
-                (batch_size,) + self.extras.shape[1:],
-                dtype=self.extras.dtype
-            )
-        else:
-            extras = None
-            next_extras = None
-        next_observations = np.zeros(
-            (batch_size, self.concat_length) + self.observation_shape,
-            dtype=self.observation_dtype
-        )
-        next_actions = np.zeros(
-            (batch_size, self.action_dim),
-            dtype=self.action_dtype
-        )
-
-        count = 0
-        while count < batch_size:
-            # Randomly choose a time step from the replay memory.
-            index = self.rng.randint(
-                self.bottom,
-                self.bottom + self.size - self.concat_length
-            )
-
-            initial_indices = np.arange(index, index + self.concat_length)
-            transition_indices = initial_indices + 1
-            end_index = index + self.concat_length - 1
-
-            # Check that the initial state corresponds entirely to a
-            # single episode, meaning none but the last frame may be
-            # terminal. If the last frame of the initial state is
-            # terminal, then the last frame of the transitioned state
-            # will actually be the first frame of a new episode, which
-            # the Q learner recognizes and handles correctly during
-            # training by zeroing the discounted future reward estimate.
-            if np.any(self.terminals.take(initial_indices[0:-1], mode='wrap')):
-                continue
-            # do not pick samples which terminated because of horizon
-            # if np.any(self.horizon_terminals.take(initial_indices[0:-1],
-            #    mode='wrap')) or self.horizon_terminals[end_index]:
-            #    continue
-
-            # Add the state transition to the response.
-            observations[count] = self.observations.take(
-                initial_indices, axis=0, mode='wrap')
-            actions[count] = self.actions.take(end_index, mode='wrap')
-            rewards[count] = self.rewards.take(end_index, mode='wrap')
-            terminals[count] = self.terminals.take(end_index, mode='wrap')
-            if self.extras is not None:
-                extras[count] = self.extras.take(
-                    end_index, axis=0, mode='wrap')
-                next_extras[count] = self.extras.take(
-                    transition_indices, axis=0, mode='wrap')
-            next_observations[count] = self.observations.take(
-                transition_indices, axis=0, mode='wrap')
-            next_actions[count] = self.actions.take(
-                transition_indices, axis=0, mode='wrap')
-
-            count += 1
+            self.extras.take(end_indices, axis=0, mode='wrap', out=buffers["extras"])
+            self.extras.take(end_indices + 1, axis=0, mode='wrap', out=buffers["next_extras"])
+        self.observations.take(transition_indices, axis=0, mode='wrap', out=buffers["next_observations"])
+        self.actions.take(end_indices + 1, axis=0, mode='wrap', out=buffers["next_actions"])
 
+        observations = buffers["observations"]
+        next_observations = buffers["next_observations"]
         if not self.concat_observations:
             # If we're not concatenating observations, we should squeeze the
             # second dimension in observations and next_observations
@@ -255,15 +266,35 @@ class ReplayPool(Serializable):
 
         return dict(
             observations=observations,
-            actions=actions,
-            rewards=rewards,
+            actions=buffers["actions"],
+            rewards=buffers["rewards"],
             next_observations=next_observations,
-            next_actions=next_actions,
-            terminals=terminals,
-            extras=extras,
-            next_extras=next_extras,
+            next_actions=buffers["next_actions"],
+            terminals=buffers["terminals"],
+            extras=buffers["extras"],
+            next_extras=buffers["next_extras"],
         )
 
+    def _get_batch_buffers(self, batch_size):
+        buffers = getattr(self, "_batch_buffers", None)
+        if buffers is None or buffers["batch_size"] != batch_size or \
+                (buffers["extras"] is None) != (self.extras is None):
+            extras_shape = None if self.extras is None else (batch_size,) + self.extras.shape[1:]
+            buffers = self._batch_buffers = dict(
+                batch_size=batch_size,
+                observations=np.zeros(
+                    (batch_size, self.concat_length) + self.observation_shape, dtype=self.observation_dtype),
+                next_observations=np.zeros(
+                    (batch_size, self.concat_length) + self.observation_shape, dtype=self.observation_dtype),
+                actions=np.zeros((batch_size, self.action_dim), dtype=self.action_dtype),
+                next_actions=np.zeros((batch_size, self.action_dim), dtype=self.action_dtype),
+                rewards=np.zeros((batch_size,), dtype=self.rewards.dtype),
+                terminals=np.zeros((batch_size,), dtype='bool'),
+                extras=None if extras_shape is None else np.zeros(extras_shape, dtype=self.extras.dtype),
+                next_extras=None if extras_shape is None else np.zeros(extras_shape, dtype=self.extras.dtype),
+            )
+        return buffers
+
 
 # TESTING CODE BELOW THIS POINT...
 
@@ -1,12 +1,40 @@
 from rllab.baselines.base import Baseline
 from rllab.misc.overrides import overrides
 import numpy as np
+import scipy.linalg
 
 
 class LinearFeatureBaseline(Baseline):
-    def __init__(self, env_spec, reg_coeff=1e-5):
+    def __init__(self, env_spec, reg_coeff=1e-5, gram_decay=None):
+        """
+        :param gram_decay: if not None, the normal equations are accumulated across iterations, the previous ones being
+        weighted by gram_decay, so that the fit also uses the paths of the previous iterations
+        """
         self._coeffs = None
         self._reg_coeff = reg_coeff
+        self._gram_decay = gram_decay
+        self._gram = None
+        self._moment = None
+        self._init_feature_cache()
+
+    def _init_feature_cache(self):
+        self._feature_buffer = None
+        # observations of the paths whose features are in the buffer, and their features
+        self._cached_observations = None
+        self._cached_features = None
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        for key in ["_feature_buffer", "_cached_observations", "_cached_features"]:
+            d.pop(key, None)
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self.__dict__.setdefault("_gram_decay", None)
+        self.__dict__.setdefault("_gram", None)
+        self.__dict__.setdefault("_moment", None)
+        self._init_feature_cache()
 
     @overrides
     def get_param_values(self, **tags):
@@ -22,22 +50,76 @@ class LinearFeatureBaseline(Baseline):
         al = np.arange(l).reshape(-1, 1) / 100.0
         return np.concatenate([o, o ** 2, al, al ** 2, al ** 3, np.ones((l, 1))], axis=1)
 
+    def _features_n(self, paths):
+        """
+        Features of all the paths, concatenated, as _features would give them. They are built in a buffer reused
+        across iterations, and cached until the paths change, so that fit does not build again the features of the
+        paths given to predict_n.
+        """
+        observations = [path["observations"] for path in paths]
+        if self._cached_observations is not None and len(observations) == len(self._cached_observations) and \
+                all(o is cached_o for o, cached_o in zip(observations, self._cached_observations)):
+            return self._cached_features
+        lengths = np.array([len(path["rewards"]) for path in paths])
+        n_samples = np.sum(lengths)
+        obs_dim = observations[0].shape[1]
+        n_features = 2 * obs_dim + 4
+        if self._feature_buffer is None or self._feature_buffer.shape[0] < n_samples or \
+                self._feature_buffer.shape[1] != n_features:
+            self._feature_buffer = np.empty((n_samples, n_features))
+        featmat = self._feature_buffer[:n_samples]
+        o = featmat[:, :obs_dim]
+        np.clip(np.concatenate(observations), -10, 10, out=o)
+        np.square(o, out=featmat[:, obs_dim:2 * obs_dim])
+        # time step of each sample in its path
+        al = (np.arange(n_samples) - np.repeat(np.cumsum(lengths) - lengths, lengths)) / 100.0
+        featmat[:, 2 * obs_dim] = al
+        featmat[:, 2 * obs_dim + 1] = al ** 2
+        featmat[:, 2 * obs_dim + 2] = al ** 3
+        featmat[:, 2 * obs_dim + 3] = 1
+        self._cached_observations = observations
+        self._cached_features = featmat
+        return featmat
+
+    def _solve(self, gram, moment):
+        reg_coeff = self._reg_coeff
+        try:
+            coeffs = scipy.linalg.cho_solve(
+                scipy.linalg.cho_factor(gram + reg_coeff * np.identity(gram.shape[0])), moment)
+            if not np.any(np.isnan(coeffs)):
+                return coeffs
+        except np.linalg.LinAlgError:
+            pass
+        # the regularized matrix is not numerically positive definite: fall back to a least squares solution, with a
+        # stronger regularization
+        reg_coeff *= 1e4
+        return np.linalg.lstsq(gram + reg_coeff * np.identity(gram.shape[0]), moment, rcond=None)[0]
+
     @overrides
     def fit(self, paths):
-        featmat = np.concatenate([self._features(path) for path in paths])
+        featmat = self._features_n(paths)
         returns = np.concatenate([path["returns"] for path in paths])
-        reg_coeff = self._reg_coeff
-        for _ in range(5):
-            self._coeffs = np.linalg.lstsq(
-                featmat.T.dot(featmat) + reg_coeff * np.identity(featmat.shape[1]),
-                featmat.T.dot(returns)
-            )[0]
-            if not np.any(np.isnan(self._coeffs)):
-                break
-            reg_coeff *= 10
+        gram = featmat.T.dot(featmat)
+        moment = featmat.T.dot(returns)
+        if self._gram_decay is not None:
+            if self._gram is not None and self._gram.shape == gram.shape:
+                gram += self._gram_decay * self._gram
+                moment += self._gram_decay * self._moment
+            self._gram, self._moment = gram, moment
+        self._coeffs = self._solve(gram, moment)
 
     @overrides
     def predict(self, path):
         if self._coeffs is None:
             return np.zeros(len(path["rewards"]))
         return self._features(path).dot(self._coeffs)
+
+    def predict_n(self, paths):
+        """
+        Predict the baselines of all the paths at once.
+        :return: list of the baselines of each path
+        """
+        lengths = [len(path["rewards"]) for path in paths]
+        if self._coeffs is None:
+            return [np.zeros(l) for l in lengths]
+        return np.split(self._features_n(paths).dot(self._coeffs), np.cumsum(lengths)[:-1])
@@ -11,6 +11,7 @@ from rllab.core.serializable import Serializable
 from rllab.envs.proxy_env import ProxyEnv
 from rllab.envs.base import Step
 from rllab.envs.mujoco.gather.embedded_viewer import EmbeddedViewer
+from rllab.envs.mujoco.gather.gather_env_utils import OBJECT_DTYPE, objects_to_array, object_readings
 from rllab.envs.mujoco.mujoco_env import MODEL_DIR, BIG
 from rllab.misc import autoargs
 from rllab.misc.overrides import overrides
@@ -178,7 +179,9 @@ class GatherEnv(ProxyEnv, Serializable):
         self.sensor_span = sensor_span
         self.coef_inner_rew = coef_inner_rew
         self.dying_cost = dying_cost
-        self.objects = []
+        # all the objects of the episode, and which ones have not been caught yet
+        self._objects = np.zeros(0, dtype=OBJECT_DTYPE)
+        self._alive = np.zeros(0, dtype=bool)
         self.viewer = None
         # super(GatherEnv, self).__init__(*args, **kwargs)
         model_cls = self.__class__.MODEL_CLASS
@@ -222,10 +225,22 @@ class GatherEnv(ProxyEnv, Serializable):
         # pylint: enable=not-callable
         ProxyEnv.__init__(self, inner_env)  # to access the inner env, do self.wrapped_env
 
+    @property
+    def objects(self):
+        """
+        List of (x, y, type) of the objects not caught yet.
+        """
+        return self._objects[self._alive].tolist()
+
+    @objects.setter
+    def objects(self, objects):
+        self._objects = objects_to_array(objects)
+        self._alive = np.ones(len(self._objects), dtype=bool)
+
     def reset(self, also_wrapped=True):
-        self.objects = []
+        objects = []
         existing = set()
-        while len(self.objects) < self.n_apples:
+        while len(objects) < self.n_apples:
             x = np.random.randint(-self.activity_range / 2,
                                   self.activity_range / 2) * 2
             y = np.random.randint(-self.activity_range / 2,
@@ -236,9 +251,9 @@ class GatherEnv(ProxyEnv, Serializable):
             if (x, y) in existing:
                 continue
             typ = APPLE
-            self.objects.append((x, y, typ))
+            objects.append((x, y, typ))
             existing.add((x, y))
-        while len(self.objects) < self.n_apples + self.n_bombs:
+        while len(objects) < self.n_apples + self.n_bombs:
             x = np.random.randint(-self.activity_range / 2,
                                   self.activity_range / 2) * 2
             y = np.random.randint(-self.activity_range / 2,
@@ -249,8 +264,9 @@ class GatherEnv(ProxyEnv, Serializable):
             if (x, y) in existing:
                 continue
             typ = BOMB
-            self.objects.append((x, y, typ))
+            objects.append((x, y, typ))
             existing.add((x, y))
+        self.objects = objects
 
         if also_wrapped:
             self.wrapped_env.reset()
@@ -265,64 +281,25 @@ class GatherEnv(ProxyEnv, Serializable):
         com = self.wrapped_env.get_body_com("torso")
         x, y = com[:2]
         reward = self.coef_inner_rew * inner_rew
-        new_objs = []
-        for obj in self.objects:
-            ox, oy, typ = obj
-            # object within zone!
-            if (ox - x) ** 2 + (oy - y) ** 2 < self.catch_range ** 2:
-                if typ == APPLE:
-                    reward = reward + 1
-                    info['outer_rew'] = 1
-                else:
-                    reward = reward - 1
-                    info['outer_rew'] = -1
-            else:
-                new_objs.append(obj)
-        self.objects = new_objs
-        done = len(self.objects) == 0
+        # objects within zone!
+        caught = self._alive & (
+            (self._objects['x'] - x) ** 2 + (self._objects['y'] - y) ** 2 < self.catch_range ** 2)
+        if np.any(caught):
+            caught_apples = self._objects['type'][caught] == APPLE
+            reward = reward + np.sum(caught_apples) - np.sum(~caught_apples)
+            info['outer_rew'] = 1 if caught_apples[-1] else -1
+            self._alive &= ~caught
+        done = not np.any(self._alive)
         return Step(self.get_current_obs(), reward, done, **info)
 
     def get_readings(self):  # equivalent to get_current_maze_obs in maze_env.py
-        # compute sensor readings
-        # first, obtain current orientation
-        apple_readings = np.zeros(self.n_bins)
-        bomb_readings = np.zeros(self.n_bins)
+        # compute sensor readings of the objects not caught yet; farther objects' signals are occluded by the closer
+        # ones' in the same bin
         robot_x, robot_y = self.wrapped_env.get_body_com("torso")[:2]
-        # sort objects by distance to the robot, so that farther objects'
-        # signals will be occluded by the closer ones'
-        sorted_objects = sorted(
-            self.objects, key=lambda o:
-            (o[0] - robot_x) ** 2 + (o[1] - robot_y) ** 2)[::-1]
-        # fill the readings
-        bin_res = self.sensor_span / self.n_bins
-
         ori = self.get_ori()  # overwrite this for Ant!
-
-        for ox, oy, typ in sorted_objects:
-            # compute distance between object and robot
-            dist = ((oy - robot_y) ** 2 + (ox - robot_x) ** 2) ** 0.5
-            # only include readings for objects within range
-            if dist > self.sensor_range:
-                continue
-            angle = math.atan2(oy - robot_y, ox - robot_x) - ori
-            if math.isnan(angle):
-                import ipdb; ipdb.set_trace()
-            angle = angle % (2 * math.pi)
-            if angle > math.pi:
-                angle = angle - 2 * math.pi
-            if angle < -math.pi:
-                angle = angle + 2 * math.pi
-            # outside of sensor span - skip this
-            half_span = self.sensor_span * 0.5
-            if abs(angle) > half_span:
-                continue
-            bin_number = int((angle + half_span) / bin_res)
-            intensity = 1.0 - dist / self.sensor_range
-            if typ == APPLE:
-                apple_readings[bin_number] = intensity
-            else:
-                bomb_readings[bin_number] = intensity
-        return apple_readings, bomb_readings
+        readings = object_readings(
+            self._objects[self._alive], robot_x, robot_y, ori, self.n_bins, self.sensor_range, self.sensor_span)
+        return readings[APPLE], readings[BOMB]
 
     def get_current_robot_obs(self):
         return self.wrapped_env.get_current_obs()
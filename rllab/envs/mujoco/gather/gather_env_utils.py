@@ -0,0 +1,38 @@
+import numpy as np
+
+# objects of a gather env: position and type code (see APPLE and BOMB in gather_env.py)
+OBJECT_DTYPE = np.dtype([('x', np.float64), ('y', np.float64), ('type', np.int64)])
+
+
+def objects_to_array(objects):
+    """
+    :param objects: list of (x, y, type) tuples
+    :return: structured array of dtype OBJECT_DTYPE
+    """
+    return np.array([tuple(obj) for obj in objects], dtype=OBJECT_DTYPE)
+
+
+def object_readings(objects, robot_x, robot_y, ori, n_bins, sensor_range, sensor_span, n_types=2):
+    """
+    Sensor readings of the objects around the robot, computed for all objects at once. The span of the sensor is split
+    into n_bins angular bins; each bin of each object type reads the intensity 1 - dist / sensor_range of the nearest
+    object of that type in the bin (the farther ones are occluded), or 0 if there is none within range.
+    :param objects: structured array of dtype OBJECT_DTYPE
+    :return: array of shape (n_types, n_bins), indexed by type code
+    """
+    readings = np.zeros((n_types, n_bins))
+    dx = objects['x'] - robot_x
+    dy = objects['y'] - robot_y
+    dist = np.sqrt(dy ** 2 + dx ** 2)
+    angle = (np.arctan2(dy, dx) - ori) % (2 * np.pi)
+    angle[angle > np.pi] -= 2 * np.pi
+    half_span = sensor_span * 0.5
+    # only include readings for objects within range and span
+    visible = (dist <= sensor_range) & (np.abs(angle) <= half_span)
+    bin_res = sensor_span / n_bins
+    # an object exactly on the edge of the span goes to the last bin
+    bins = np.minimum(((angle[visible] + half_span) / bin_res).astype(int), n_bins - 1)
+    intensity = 1.0 - dist[visible] / sensor_range
+    # keeping the maximum intensity keeps the nearest object
+    np.maximum.at(readings, (objects['type'][visible], bins), intensity)
+    return readings
@@ -8,7 +8,7 @@ from rllab import spaces
 from rllab.envs.base import Step
 from rllab.envs.proxy_env import ProxyEnv
 from rllab.envs.mujoco.maze.maze_env_utils import construct_maze
-from rllab.envs.mujoco.maze.maze_env_utils import ray_segment_intersect, point_distance
+from rllab.envs.mujoco.maze.maze_env_utils import ray_segments_intersect_n, SegmentGrid
 from rllab.envs.mujoco.mujoco_env import MODEL_DIR, BIG
 from rllab.core.serializable import Serializable
 from rllab.misc.overrides import overrides
@@ -32,6 +32,8 @@ class MazeEnv(ProxyEnv, Serializable):
     ]
 
     MANUAL_COLLISION = False
+    # mazes with at least this many wall and goal segments index them in a uniform grid for the sensor readings
+    SENSOR_GRID_MIN_SEGMENTS = 400
 
     def __init__(
             self,
@@ -124,68 +126,68 @@ class MazeEnv(ProxyEnv, Serializable):
         inner_env = model_cls(*args, file_path=file_path, **kwargs)  # file to the robot specifications
         ProxyEnv.__init__(self, inner_env)  # here is where the robot env will be initialized
 
+    def _get_segments(self):
+        """
+        End points and types of the sides of all the wall and goal blocks, computed once per maze.
+        :return: segments array of shape (n_segments, 2, 2), boolean array flagging the goal segments, and a
+        SegmentGrid over the segments if the maze is large enough for it to pay off (None otherwise)
+        """
+        if self._cached_segments is None:
+            structure = self.MAZE_STRUCTURE
+            size_scaling = self.MAZE_SIZE_SCALING
+            segments = []
+            is_goal = []
+            for i in range(len(structure)):
+                for j in range(len(structure[0])):
+                    if structure[i][j] == 1 or structure[i][j] == 'g':
+                        cx = j * size_scaling - self._init_torso_x
+                        cy = i * size_scaling - self._init_torso_y
+                        x1 = cx - 0.5 * size_scaling
+                        x2 = cx + 0.5 * size_scaling
+                        y1 = cy - 0.5 * size_scaling
+                        y2 = cy + 0.5 * size_scaling
+                        segments.extend([
+                            ((x1, y1), (x2, y1)),
+                            ((x2, y1), (x2, y2)),
+                            ((x2, y2), (x1, y2)),
+                            ((x1, y2), (x1, y1)),
+                        ])
+                        is_goal.extend([structure[i][j] == 'g'] * 4)
+            segments = np.array(segments, dtype=float).reshape((-1, 2, 2))
+            grid = None
+            if len(segments) >= self.SENSOR_GRID_MIN_SEGMENTS:
+                grid = SegmentGrid(segments, max(self._sensor_range, size_scaling))
+            self._cached_segments = (segments, np.array(is_goal, dtype=bool), grid)
+        return self._cached_segments
+
     def get_current_maze_obs(self):
         # The observation would include both information about the robot itself as well as the sensors around its
         # environment
         robot_x, robot_y = self.wrapped_env.get_body_com("torso")[:2]
         ori = self.get_ori()
 
-        structure = self.MAZE_STRUCTURE
-        size_scaling = self.MAZE_SIZE_SCALING
-
-        segments = []
-        # compute the distance of all segments
-
-        # Get all line segments of the goal and the obstacles
-        for i in range(len(structure)):
-            for j in range(len(structure[0])):
-                if structure[i][j] == 1 or structure[i][j] == 'g':
-                    cx = j * size_scaling - self._init_torso_x
-                    cy = i * size_scaling - self._init_torso_y
-                    x1 = cx - 0.5 * size_scaling
-                    x2 = cx + 0.5 * size_scaling
-                    y1 = cy - 0.5 * size_scaling
-                    y2 = cy + 0.5 * size_scaling
-                    struct_segments = [
-                        ((x1, y1), (x2, y1)),
-                        ((x2, y1), (x2, y2)),
-                        ((x2, y2), (x1, y2)),
-                        ((x1, y2), (x1, y1)),
-                    ]
-                    for seg in struct_segments:
-                        segments.append(dict(
-                            segment=seg,
-                            type=structure[i][j],
-                        ))
-
         wall_readings = np.zeros(self._n_bins)
         goal_readings = np.zeros(self._n_bins)
 
-        for ray_idx in range(self._n_bins):
-            ray_ori = ori - self._sensor_span * 0.5 + 1.0 * (2 * ray_idx + 1) / (2 * self._n_bins) * self._sensor_span
-            ray_segments = []
-            for seg in segments:
-                p = ray_segment_intersect(ray=((robot_x, robot_y), ray_ori), segment=seg["segment"])
-                if p is not None:
-                    ray_segments.append(dict(
-                        segment=seg["segment"],
-                        type=seg["type"],
-                        ray_ori=ray_ori,
-                        distance=point_distance(p, (robot_x, robot_y)),
-                    ))
-            if len(ray_segments) > 0:
-                first_seg = sorted(ray_segments, key=lambda x: x["distance"])[0]
-                # print first_seg
-                if first_seg["type"] == 1:
-                    # Wall -> add to wall readings
-                    if first_seg["distance"] <= self._sensor_range:
-                        wall_readings[ray_idx] = (self._sensor_range - first_seg["distance"]) / self._sensor_range
-                elif first_seg["type"] == 'g':
-                    # Goal -> add to goal readings
-                    if first_seg["distance"] <= self._sensor_range:
-                        goal_readings[ray_idx] = (self._sensor_range - first_seg["distance"]) / self._sensor_range
-                else:
-                    assert False
+        segments, is_goal, grid = self._get_segments()
+        if grid is not None:
+            # only the segments within sensor range can give a non-zero reading
+            candidates = grid.query((robot_x, robot_y), self._sensor_range)
+            segments, is_goal = segments[candidates], is_goal[candidates]
+        if len(segments) == 0:
+            return np.concatenate([wall_readings, goal_readings])
+
+        ray_oris = ori - self._sensor_span * 0.5 + \
+            1.0 * (2 * np.arange(self._n_bins) + 1) / (2 * self._n_bins) * self._sensor_span
+        distances = ray_segments_intersect_n((robot_x, robot_y), ray_oris, segments)
+        # the first segment hit by each ray (ties go to the first segment in the list)
+        first_seg = np.argmin(distances, axis=1)
+        first_distance = distances[np.arange(self._n_bins), first_seg]
+        readings = np.where(first_distance <= self._sensor_range,
+                            (self._sensor_range - first_distance) / self._sensor_range, 0.)
+        goal_hit = is_goal[first_seg]
+        wall_readings[~goal_hit] = readings[~goal_hit]
+        goal_readings[goal_hit] = readings[goal_hit]
 
         obs = np.concatenate([
             wall_readings,
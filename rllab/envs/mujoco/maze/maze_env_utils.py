@@ -90,6 +90,64 @@ def ray_segment_intersect(ray, segment):
     return None
 
 
+def ray_segments_intersect_n(origin, thetas, segments):
+    """
+    Vectorized version of ray_segment_intersect, for all the rays from origin against all the segments at once.
+    :param origin: (x, y) origin of the rays
+    :param thetas: array of ray directions
+    :param segments: array of shape (n_segments, 2, 2) holding the end points of the segments
+    :return: array of shape (len(thetas), n_segments) with the distance from origin to the intersection point, or
+    np.inf where the ray does not intersect the segment
+    """
+    # same computation as line_intersect, with pt2 - pt1 the unit direction of the ray: the distance is then r
+    dx1 = np.cos(thetas)[:, None]
+    dy1 = np.sin(thetas)[:, None]
+    x = segments[:, 0, 0] - origin[0]
+    y = segments[:, 0, 1] - origin[1]
+    dx = segments[:, 1, 0] - segments[:, 0, 0]
+    dy = segments[:, 1, 1] - segments[:, 0, 1]
+    det = -dx1 * dy + dy1 * dx
+    valid = np.abs(det) >= 0.00000001
+    det = np.where(valid, det, 1.)
+    r = (-dy * x + dx * y) / det
+    s = (-dy1 * x + dx1 * y) / det
+    return np.where(valid & (r >= 0) & (s >= 0) & (s <= 1), r, np.inf)
+
+
+class SegmentGrid(object):
+    """
+    Uniform grid over the plane, each cell listing the segments that overlap it, used to only intersect the rays of a
+    sensor with the segments within its range.
+    """
+
+    def __init__(self, segments, cell_size):
+        """
+        :param segments: array of shape (n_segments, 2, 2)
+        :param cell_size: side of the (square) cells
+        """
+        self.cell_size = cell_size
+        self.origin = np.min(segments.reshape((-1, 2)), axis=0)
+        self.cells = dict()
+        for idx, segment in enumerate(segments):
+            (min_i, min_j), (max_i, max_j) = self._cell(np.min(segment, axis=0)), self._cell(np.max(segment, axis=0))
+            for i in range(min_i, max_i + 1):
+                for j in range(min_j, max_j + 1):
+                    self.cells.setdefault((i, j), []).append(idx)
+
+    def _cell(self, point):
+        return tuple(np.floor((np.asarray(point) - self.origin) / self.cell_size).astype(int))
+
+    def query(self, center, radius):
+        """
+        :return: sorted indices of the segments overlapping the cells that intersect the square of half side radius
+        around center
+        """
+        (min_i, min_j), (max_i, max_j) = self._cell(np.asarray(center) - radius), self._cell(np.asarray(center) + radius)
+        indices = [idx for i in range(min_i, max_i + 1) for j in range(min_j, max_j + 1)
+                   for idx in self.cells.get((i, j), [])]
+        return np.unique(np.array(indices, dtype=int))
+
+
 def point_distance(p1, p2):
     x1, y1 = p1
     x2, y2 = p2
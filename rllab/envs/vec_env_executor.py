@@ -0,0 +1,59 @@
+import numpy as np
+
+
+class VecEnvExecutor(object):
+    """
+    Steps a list of environment copies in lockstep. Each copy keeps its own time step counter, so that finished
+    copies can be restarted independently of the others.
+    """
+
+    def __init__(self, envs, max_path_length=np.inf):
+        """
+        :param envs: list of environments sharing the same observation and action spaces
+        :param max_path_length: a copy is reported as done once it has been stepped this many times since its last
+        reset
+        """
+        self.envs = envs
+        self.max_path_length = max_path_length
+        self.ts = np.zeros(len(envs), dtype='int')
+
+    @property
+    def num_envs(self):
+        return len(self.envs)
+
+    @property
+    def observation_space(self):
+        return self.envs[0].observation_space
+
+    @property
+    def action_space(self):
+        return self.envs[0].action_space
+
+    def reset(self, dones=None):
+        """
+        Reset the environment copies flagged in dones (all of them if dones is None).
+        :return: a list with the new initial observation for each reset copy, and None for the others
+        """
+        if dones is None:
+            dones = np.ones(self.num_envs, dtype=bool)
+        obses = [None] * self.num_envs
+        for i in np.where(dones)[0]:
+            obses[i] = self.envs[i].reset()
+            self.ts[i] = 0
+        return obses
+
+    def step(self, action_n):
+        """
+        Step every copy with its own action. Copies whose episode ended or that reached max_path_length are flagged
+        as done; it is up to the caller to reset them.
+        :return: (observations, rewards, dones, env_infos), the first and last being lists of length num_envs
+        """
+        results = [env.step(a) for a, env in zip(action_n, self.envs)]
+        obses, rewards, dones, env_infos = list(map(list, zip(*results)))
+        self.ts += 1
+        dones = np.logical_or(np.asarray(dones, dtype=bool), self.ts >= self.max_path_length)
+        return obses, np.asarray(rewards), dones, env_infos
+
+    def terminate(self):
+        for env in self.envs:
+            env.terminate()
@@ -9,6 +9,7 @@ import numpy as np
 import operator
 from functools import reduce
 import random
+import time
 
 sys.setrecursionlimit(50000)
 
@@ -128,11 +129,64 @@ def delete(dict, key):
     return new_d
 
 
-def compile_function(inputs=None, outputs=None, updates=None, givens=None, log_name=None, **kwargs):
+_function_cache = dict()
+_function_cache_stats = dict(hits=0, misses=0, compile_time=0.)
+
+
+def _graph_key(inputs, outputs):
+    """
+    Structural key of the graph from inputs to outputs: two graphs built separately (e.g. by two instances of the
+    same algorithm) get the same key if they apply the same ops in the same order, to inputs of the same types at the
+    same positions, to the same shared variables (i.e. the same policy instance) and to equal constants.
+    """
+    from theano.gof import graph
+    from theano.compile import SharedVariable
+    var_keys = dict()
+    for idx, x in enumerate(inputs):
+        var_keys[x] = ("input", idx, x.type)
+
+    def var_key(v):
+        if v not in var_keys:
+            if isinstance(v, SharedVariable):
+                # the compiled function keeps the shared variable alive, so its id cannot be reused
+                var_keys[v] = ("shared", id(v))
+            elif isinstance(v, graph.Constant):
+                var_keys[v] = ("constant", v.type, v.signature())
+            else:
+                var_keys[v] = ("free", id(v), v.type)
+        return var_keys[v]
+
+    node_keys = []
+    for node in graph.io_toposort(inputs, outputs):
+        node_keys.append((node.op, tuple(var_key(v) for v in node.inputs)))
+        for out_idx, v in enumerate(node.outputs):
+            var_keys[v] = ("node", len(node_keys) - 1, out_idx)
+    return tuple(node_keys), tuple(var_key(v) for v in outputs)
+
+
+def compile_function(inputs=None, outputs=None, updates=None, givens=None, log_name=None, cache=True, **kwargs):
+    """
+    Compile a theano function. Functions without updates, givens or extra compilation arguments are cached for the
+    whole process, keyed on the structure of their graph (see _graph_key): rebuilding the same graph, e.g. when a new
+    algorithm instance is created for the same policy, returns the previously compiled function.
+    :param cache: set to False to always compile a new function
+    """
     import theano
+    key = None
+    if cache and updates is None and givens is None and not kwargs and outputs is not None:
+        try:
+            outputs_list = list(outputs) if isinstance(outputs, (list, tuple)) else [outputs]
+            key = (isinstance(outputs, (list, tuple)), _graph_key(list(inputs or []), outputs_list))
+            hash(key)
+        except (TypeError, AttributeError):
+            key = None
+        if key is not None and key in _function_cache:
+            _function_cache_stats["hits"] += 1
+            return _function_cache[key]
     if log_name:
         msg = Message("Compiling function %s" % log_name)
         msg.__enter__()
+    start_time = time.time()
     ret = theano.function(
         inputs=inputs,
         outputs=outputs,
@@ -142,11 +196,30 @@ def compile_function(inputs=None, outputs=None, updates=None, givens=None, log_n
         allow_input_downcast=True,
         **kwargs
     )
+    _function_cache_stats["misses"] += 1
+    _function_cache_stats["compile_time"] += time.time() - start_time
+    if key is not None:
+        _function_cache[key] = ret
     if log_name:
         msg.__exit__(None, None, None)
     return ret
 
 
+def clear_function_cache():
+    _function_cache.clear()
+
+
+def record_function_cache_stats():
+    """
+    Record the number of compile_function cache hits and misses, and the total compilation time, since the start of
+    the process.
+    """
+    from rllab.misc import logger
+    logger.record_tabular('FunctionCacheHits', _function_cache_stats["hits"])
+    logger.record_tabular('FunctionCacheMisses', _function_cache_stats["misses"])
+    logger.record_tabular('CompileTime', _function_cache_stats["compile_time"])
+
+
 def new_tensor(name, ndim, dtype):
     import theano.tensor as TT
     return TT.TensorType(dtype, (False,) * ndim)(name)
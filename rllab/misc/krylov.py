@@ -4,13 +4,19 @@ from rllab.misc.ext import sliced_fun
 EPS = np.finfo('float64').tiny
 
 
-def cg(f_Ax, b, cg_iters=10, callback=None, verbose=False, residual_tol=1e-10):
+def cg(f_Ax, b, cg_iters=10, callback=None, verbose=False, residual_tol=1e-10, x0=None):
     """
     Demmel p 312
+    :param x0: initial guess of the solution, e.g. the solution of a similar system, which costs one more
+    evaluation of f_Ax. If None, start from zero.
     """
-    p = b.copy()
-    r = b.copy()
-    x = np.zeros_like(b)
+    if x0 is None:
+        x = np.zeros_like(b)
+        r = b.copy()
+    else:
+        x = np.array(x0, dtype=b.dtype)
+        r = b - f_Ax(x)
+    p = r.copy()
     rdotr = r.dot(r)
 
     fmtstr = "%10i %10.3g %10.3g"
@@ -3,6 +3,8 @@ from enum import Enum
 from rllab.misc.tabulate import tabulate
 from rllab.misc.console import mkdir_p, colorize
 from rllab.misc.autoargs import get_all_parameters
+from rllab.misc import snapshot
+from rllab.misc.tabular_store import TabularStore, is_tabular_store
 from contextlib import contextmanager
 import numpy as np
 import os
@@ -35,6 +37,10 @@ _tabular_header_written = set()
 _snapshot_dir = None
 _snapshot_mode = 'all'
 _snapshot_gap = 1
+_snapshot_format = 'pickle'
+_snapshot_async = False
+_snapshot_max_pending = 2
+_snapshot_written = {}  # key: data directory of compact snapshots, value: data files known to exist
 
 _log_tabular_only = False
 _header_printed = False
@@ -96,9 +102,16 @@ def remove_text_output(file_name):
 
 
 def add_tabular_output(file_name):
+    """
+    :param file_name: csv file, or columnar store (see rllab.misc.tabular_store) if it ends with ".store"
+    """
     if file_name in _tabular_fds_hold.keys():
         _tabular_outputs.append(file_name)
         _tabular_fds[file_name] = _tabular_fds_hold[file_name]
+    elif is_tabular_store(file_name):
+        if file_name not in _tabular_outputs:
+            _tabular_outputs.append(file_name)
+            _tabular_fds[file_name] = TabularStore(file_name)
     else:
         _add_output(file_name, _tabular_outputs, _tabular_fds, mode='w')
 
@@ -162,6 +175,45 @@ def set_snapshot_gap(gap):
     _snapshot_gap = gap
 
 
+def get_snapshot_format():
+    return _snapshot_format
+
+
+def set_snapshot_format(snapshot_format):
+    """
+    :param snapshot_format: either "pickle" (the params are pickled into a single file), or "compact" (see
+    rllab.misc.snapshot; the snapshots are then loaded with rllab.misc.snapshot.load_snapshot)
+    """
+    assert snapshot_format in ['pickle', 'compact']
+    global _snapshot_format
+    _snapshot_format = snapshot_format
+
+
+def get_snapshot_async():
+    return _snapshot_async
+
+
+def set_snapshot_async(snapshot_async, max_pending=2):
+    """
+    :param snapshot_async: whether to write the snapshots in a background thread. The params are still serialized
+    (pickle format) or captured (compact format) by save_itr_params, so that training can go on modifying them.
+    :param max_pending: number of snapshots which can wait to be written before save_itr_params blocks
+    """
+    global _snapshot_async, _snapshot_max_pending
+    if not snapshot_async or max_pending != _snapshot_max_pending:
+        snapshot.close_writer()
+    _snapshot_async = snapshot_async
+    _snapshot_max_pending = max_pending
+
+
+def flush_snapshots():
+    """
+    Wait for the snapshots being written in the background.
+    """
+    if _snapshot_async:
+        snapshot.get_writer(_snapshot_max_pending).flush()
+
+
 def set_log_tabular_only(log_tabular_only):
     global _log_tabular_only
     _log_tabular_only = log_tabular_only
@@ -272,6 +324,11 @@ def dump_tabular(*args, **kwargs):
                 # Also write to the csv files
                 # This assumes that the keys in each iteration won't change!
                 for tabular_file_name, tabular_fd in list(_tabular_fds.items()):
+                    if isinstance(tabular_fd, TabularStore):
+                        # new keys only add columns to the store
+                        tabular_fd.append(tabular_dict)
+                        tabular_fd.flush()
+                        continue
                     keys = tabular_dict.keys()
                     if tabular_file_name in _tabular_headers:
                         # check against existing keys: if new keys re-write Header and pad with NaNs
@@ -332,12 +389,29 @@ def save_itr_params(itr, params, use_cloudpickle=True, pkl_prefix=''):
             return
         else:
             raise NotImplementedError
-        if use_cloudpickle:
+        if _snapshot_format == 'compact':
+            data_dir = snapshot.get_data_dir(file_name, pkl_prefix)
+            captured = snapshot.capture_compact(params)
+            written = _snapshot_written.setdefault(data_dir, set())
+            write_fn = lambda: snapshot.write_compact(
+                file_name, captured, data_dir, written, collect_garbage=_snapshot_mode == 'last')
+        elif use_cloudpickle and _snapshot_async:
+            import cloudpickle
+            data = cloudpickle.dumps(params, protocol=3)
+            write_fn = lambda: snapshot.atomic_write(file_name, lambda f: f.write(data))
+        elif use_cloudpickle:
             import cloudpickle
             with open(file_name, 'wb') as f:
                 cloudpickle.dump(params, f, protocol=3)
+            return
         else:
+            # joblib compresses while pickling, so it is not done in the background
             joblib.dump(params, file_name, compress=3)
+            return
+        if _snapshot_async:
+            snapshot.get_writer(_snapshot_max_pending).put(write_fn)
+        else:
+            write_fn()
 
 
 def log_parameters(log_file, args, classes):
@@ -0,0 +1,278 @@
+"""
+Compact iteration snapshots and a background writer for logger.save_itr_params.
+
+A compact snapshot is stored as a small manifest at the usual snapshot file name, plus content addressed files in a
+data directory next to it:
+ - each Serializable object (algo, env, policy, baseline, ...) is pickled separately into a skeleton, in which the
+   other Serializable objects and the numpy arrays it references are replaced by persistent ids,
+ - the arrays (e.g. the flat parameter values of Parameterized objects, or the arrays of the stored paths) are saved
+   as .npy files,
+ - the manifest lists, for each object, the hash of its skeleton and what its persistent ids point to.
+Since files are named after the sha1 of their contents, the components which did not change since the previous
+snapshot (usually the env, often the baseline) are not written again.
+"""
+import atexit
+import hashlib
+import io
+import os
+import os.path as osp
+import pickle
+import queue
+import threading
+
+import cloudpickle
+import joblib
+import numpy as np
+
+from rllab.core.serializable import Serializable
+
+COMPACT_SNAPSHOT_VERSION = 1
+# the manifests start with this header, followed by the pickled manifest
+COMPACT_SNAPSHOT_HEADER = b"rllab compact snapshot\n"
+# smaller arrays are kept in the skeletons
+COMPACT_MIN_ARRAY_BYTES = 4096
+
+
+class _CompactPickler(cloudpickle.CloudPickler):
+    def __init__(self, file, capture, root):
+        super(_CompactPickler, self).__init__(file, protocol=3)
+        self._capture = capture
+        self._root = root
+        self.refs = []
+
+    def persistent_id(self, obj):
+        if obj is self._root:
+            return None
+        if isinstance(obj, np.ndarray):
+            if obj.dtype.hasobject or obj.nbytes < COMPACT_MIN_ARRAY_BYTES:
+                return None
+            self.refs.append(("array", self._capture.add_array(obj)))
+        elif isinstance(obj, Serializable) and id(obj) not in self._capture.pending:
+            self.refs.append(("object", self._capture.add_object(obj)))
+        else:
+            return None
+        return len(self.refs) - 1
+
+
+class _SnapshotCapture(object):
+    """
+    Pickles the skeletons and copies the arrays of a snapshot, on the training thread, so that the objects can keep
+    changing while the snapshot is written.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.arrays = []
+        self.pending = set()
+        self._object_ids = dict()
+        self._array_ids = dict()
+
+    def add_array(self, arr):
+        if id(arr) not in self._array_ids:
+            self._array_ids[id(arr)] = len(self.arrays)
+            self.arrays.append((arr, np.array(arr, copy=True)))
+        return self._array_ids[id(arr)]
+
+    def add_object(self, obj):
+        if id(obj) not in self._object_ids:
+            self.pending.add(id(obj))
+            f = io.BytesIO()
+            pickler = _CompactPickler(f, self, obj)
+            pickler.dump(obj)
+            self.pending.remove(id(obj))
+            # the objects referenced by this one are recorded first
+            self._object_ids[id(obj)] = len(self.records)
+            self.records.append((obj, f.getvalue(), pickler.refs))
+        return self._object_ids[id(obj)]
+
+
+def _array_hash(arr):
+    h = hashlib.sha1()
+    h.update(("%s%s" % (arr.dtype.str, arr.shape)).encode())
+    h.update(np.ascontiguousarray(arr).data)
+    return h.hexdigest()
+
+
+def atomic_write(file_name, write_fn):
+    tmp_file_name = "%s.tmp.%d" % (file_name, os.getpid())
+    with open(tmp_file_name, 'wb') as f:
+        write_fn(f)
+    os.replace(tmp_file_name, file_name)
+
+
+def get_data_dir(file_name, pkl_prefix=''):
+    return osp.join(osp.dirname(file_name), pkl_prefix + 'snapshot_data')
+
+
+def capture_compact(params):
+    """
+    :return: the skeletons and array copies of the snapshot, to be passed to write_compact
+    """
+    capture = _SnapshotCapture()
+    capture.add_object(params)
+    # drop the references to the live objects
+    records = [(skeleton, refs) for _, skeleton, refs in capture.records]
+    arrays = [copy for _, copy in capture.arrays]
+    return records, arrays
+
+
+def _manifest_files(manifest):
+    files = set()
+    for skeleton_hash, refs in manifest["records"]:
+        files.add(skeleton_hash + '.pkl')
+        files.update(ref + '.npy' for kind, ref in refs if kind == "array")
+    return files
+
+
+def write_compact(file_name, captured, data_dir, written=None, collect_garbage=False):
+    """
+    Write a captured snapshot: the data files which do not exist yet, then the manifest, each of them atomically.
+    :param written: set of the data files known to exist, updated in place
+    :param collect_garbage: remove the data files only referenced by the manifest being overwritten
+    """
+    records, arrays = captured
+    if written is None:
+        written = set()
+    os.makedirs(data_dir, exist_ok=True)
+
+    def write_data(data_file_name, write_fn):
+        if data_file_name not in written:
+            path = osp.join(data_dir, data_file_name)
+            if not osp.exists(path):
+                atomic_write(path, write_fn)
+            written.add(data_file_name)
+
+    array_hashes = []
+    for arr in arrays:
+        array_hash = _array_hash(arr)
+        write_data(array_hash + '.npy', lambda f: np.save(f, arr, allow_pickle=False))
+        array_hashes.append(array_hash)
+    manifest_records = []
+    for skeleton, refs in records:
+        skeleton_hash = hashlib.sha1(skeleton).hexdigest()
+        write_data(skeleton_hash + '.pkl', lambda f: f.write(skeleton))
+        manifest_records.append((skeleton_hash, [
+            (kind, array_hashes[idx] if kind == "array" else idx) for kind, idx in refs
+        ]))
+    manifest = dict(version=COMPACT_SNAPSHOT_VERSION, data_dir=osp.basename(data_dir), records=manifest_records)
+
+    previous_files = set()
+    if collect_garbage and osp.exists(file_name):
+        previous = _load_manifest(file_name)
+        if previous is not None:
+            previous_files = _manifest_files(previous)
+    atomic_write(file_name, lambda f: f.write(COMPACT_SNAPSHOT_HEADER + pickle.dumps(manifest, protocol=3)))
+    for data_file_name in previous_files - _manifest_files(manifest):
+        os.remove(osp.join(data_dir, data_file_name))
+        written.discard(data_file_name)
+
+
+class _CompactUnpickler(pickle.Unpickler):
+    def __init__(self, file, resolve_ref):
+        super(_CompactUnpickler, self).__init__(file)
+        self._resolve_ref = resolve_ref
+
+    def persistent_load(self, pid):
+        return self._resolve_ref(pid)
+
+
+def _load_manifest(file_name):
+    """
+    :return: the manifest, or None if the file is not a compact snapshot
+    """
+    with open(file_name, 'rb') as f:
+        if f.read(len(COMPACT_SNAPSHOT_HEADER)) != COMPACT_SNAPSHOT_HEADER:
+            return None
+        return pickle.load(f)
+
+
+def load_compact(file_name, manifest):
+    data_dir = osp.join(osp.dirname(file_name), manifest["data_dir"])
+    objects = []
+    for skeleton_hash, refs in manifest["records"]:
+        def resolve_ref(idx, refs=refs):
+            kind, ref = refs[idx]
+            if kind == "array":
+                return np.load(osp.join(data_dir, ref + '.npy'), allow_pickle=False)
+            # the objects shared between several others were recorded, and are restored, only once
+            return objects[ref]
+
+        with open(osp.join(data_dir, skeleton_hash + '.pkl'), 'rb') as f:
+            objects.append(_CompactUnpickler(f, resolve_ref).load())
+    return objects[-1]
+
+
+def load_snapshot(file_name):
+    """
+    Load an iteration snapshot written by logger.save_itr_params, in either the pickle or the compact format.
+    """
+    manifest = _load_manifest(file_name)
+    if manifest is not None:
+        return load_compact(file_name, manifest)
+    return joblib.load(file_name)
+
+
+class SnapshotWriter(object):
+    """
+    Writes the snapshots in a background thread. The queue of snapshots waiting to be written is bounded, so that
+    training waits for the writer instead of piling up snapshots in memory when it gets ahead of the disk. An error
+    of the writer is raised by the next call to put or flush.
+    """
+
+    def __init__(self, max_pending=2):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            write_fn = self._queue.get()
+            try:
+                if write_fn is None:
+                    return
+                if self._error is None:
+                    write_fn()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def put(self, write_fn):
+        self._raise_error()
+        self._queue.put(write_fn)
+
+    def flush(self):
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+
+_writer = None
+
+
+def get_writer(max_pending=2):
+    global _writer
+    if _writer is None:
+        _writer = SnapshotWriter(max_pending)
+    return _writer
+
+
+def close_writer():
+    global _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        writer.close()
+
+
+atexit.register(close_writer)
@@ -111,6 +111,28 @@ def discount_cumsum(x, discount):
     return scipy.signal.lfilter([1], [1, float(-discount)], x[::-1], axis=0)[::-1]
 
 
+def gae_advantages_n(rewards, baselines, discount, gae_lambda):
+    """
+    Generalized advantage estimates and discounted returns of a batch of paths packed into zero padded arrays, both
+    computed in a single backward scan over the time axis, vectorized over the paths.
+    :param rewards: (N, T) array of rewards, zero past the end of each path
+    :param baselines: (N, T) array of baseline predictions, zero past the end of each path (this also provides the
+    zero bootstrap value after the last step of each path)
+    :return: advantages and returns, as (N, T) arrays that are zero past the end of each path
+    """
+    # work time-major so that each step of the scan reads and writes contiguous memory
+    rewards = np.array(rewards.T, dtype=np.float64, order="C")
+    deltas = rewards - baselines.T
+    deltas[:-1] += discount * baselines.T[1:]
+    advantages = deltas
+    returns = rewards
+    gae_discount = discount * gae_lambda
+    for t in range(rewards.shape[0] - 2, -1, -1):
+        advantages[t] += gae_discount * advantages[t + 1]
+        returns[t] += discount * returns[t + 1]
+    return advantages.T, returns.T
+
+
 def discount_return(x, discount):
     return np.sum(x * (discount ** np.arange(len(x))))
 
@@ -0,0 +1,131 @@
+"""
+Append-only columnar store for the tabular logs, used by the logger for the tabular outputs whose name ends with
+TABULAR_STORE_EXT (e.g. progress.store instead of progress.csv).
+
+A store is a directory with one file per column, and a manifest of the columns, keys.jsonl, with one json line
+{"key", "column", "type", "start"} per column: the name of the column file, its type, and the row the key first
+appeared at. Numeric columns ("f8") are raw little endian float64 arrays, the other ones ("str") have one json
+encoded string per line. Every row appends one value to each known column (NaN or "" for the missing keys), and a
+new key only appends a line to the manifest, so appending a row does not depend on the length of the log.
+"""
+import csv
+import json
+import os
+import os.path as osp
+import shutil
+import struct
+
+import numpy as np
+
+TABULAR_STORE_EXT = '.store'
+_MANIFEST = 'keys.jsonl'
+_FLOAT_DTYPE = np.dtype('<f8')
+
+
+def is_tabular_store(file_name):
+    return file_name.endswith(TABULAR_STORE_EXT)
+
+
+def _to_float(value):
+    """
+    :return: the value as a float (the logger records the values as strings), or None if it is not a number
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TabularStore(object):
+    """
+    Writer of a store, used like the open file of a csv tabular output.
+    """
+
+    def __init__(self, dir_name):
+        # a new store replaces the old one, as opening a csv output in "w" mode would
+        if osp.exists(dir_name):
+            shutil.rmtree(dir_name)
+        os.makedirs(dir_name)
+        self.dir_name = dir_name
+        self.n_rows = 0
+        self._columns = dict()  # key: tabular key, value: (type, open column file)
+        self._manifest_fd = open(osp.join(dir_name, _MANIFEST), 'w')
+
+    def _add_column(self, key, value):
+        column = "%d" % len(self._columns)
+        column_type = "f8" if _to_float(value) is not None else "str"
+        fd = open(osp.join(self.dir_name, column), 'wb' if column_type == "f8" else 'w')
+        self._columns[key] = (column_type, fd)
+        self._manifest_fd.write(json.dumps(dict(key=key, column=column, type=column_type, start=self.n_rows)) + '\n')
+        self._manifest_fd.flush()
+
+    def append(self, row):
+        """
+        :param row: dictionary of the values of the row, which may have keys not seen before
+        """
+        for key, value in row.items():
+            if key not in self._columns:
+                self._add_column(key, value)
+        for key, (column_type, fd) in self._columns.items():
+            value = row.get(key)
+            if column_type == "f8":
+                float_value = _to_float(value)
+                fd.write(struct.pack('<d', np.nan if float_value is None else float_value))
+            else:
+                fd.write(json.dumps("" if value is None else str(value)) + '\n')
+        self.n_rows += 1
+
+    def flush(self):
+        for _, fd in self._columns.values():
+            fd.flush()
+
+    def close(self):
+        for _, fd in self._columns.values():
+            fd.close()
+        self._manifest_fd.close()
+
+
+def load_tabular_store(dir_name):
+    """
+    Read the columns of a store. A row which was being appended when the store was read is left out.
+    :return: dictionary of the columns, as float arrays for the numeric columns and lists of strings otherwise
+    """
+    columns = []
+    with open(osp.join(dir_name, _MANIFEST), 'r') as f:
+        for line in f:
+            if line.endswith('\n'):
+                columns.append(json.loads(line))
+    values = dict()
+    for column in columns:
+        path = osp.join(dir_name, column["column"])
+        if column["type"] == "f8":
+            with open(path, 'rb') as f:
+                data = f.read()
+            # leave out a value being written
+            values[column["key"]] = np.frombuffer(data[:len(data) - len(data) % _FLOAT_DTYPE.itemsize], _FLOAT_DTYPE)
+        else:
+            with open(path, 'r') as f:
+                values[column["key"]] = [json.loads(line) for line in f if line.endswith('\n')]
+    n_rows = min([column["start"] + len(values[column["key"]]) for column in columns] or [0])
+    entries = dict()
+    for column in columns:
+        key, start = column["key"], column["start"]
+        if column["type"] == "f8":
+            entries[key] = np.concatenate([np.full(start, np.nan), values[key][:n_rows - start]])
+        else:
+            entries[key] = [""] * start + values[key][:n_rows - start]
+    return entries
+
+
+def export_csv(dir_name, csv_file_name):
+    """
+    Write the rows of a store to a csv file, with NaN for the keys missing from a row.
+    """
+    entries = load_tabular_store(dir_name)
+    keys = list(entries.keys())
+    n_rows = len(entries[keys[0]]) if keys else 0
+    with open(csv_file_name, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(keys)
+        for i in range(n_rows):
+            writer.writerow([entries[key][i] for key in keys])
@@ -44,6 +44,21 @@ def pad_tensor_dict(tensor_dict, max_len, mode='zero'):
     return ret
 
 
+def pad_tensor_dict_n(tensor_dicts, max_len):
+    """
+    Zero pad a list of dictionaries of {tensors or dictionary of tensors} to max_len and stack them, writing directly
+    into the preallocated result instead of padding each dictionary first.
+    """
+    keys = list(tensor_dicts[0].keys())
+    ret = dict()
+    for k in keys:
+        if isinstance(tensor_dicts[0][k], dict):
+            ret[k] = pad_tensor_dict_n([x[k] for x in tensor_dicts], max_len)
+        else:
+            ret[k] = pad_tensor_n([x[k] for x in tensor_dicts], max_len)
+    return ret
+
+
 def flatten_first_axis_tensor_dict(tensor_dict):
     keys = list(tensor_dict.keys())
     ret = dict()
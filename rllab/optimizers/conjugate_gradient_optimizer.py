@@ -5,8 +5,10 @@ from rllab.core.serializable import Serializable
 import theano.tensor as TT
 import theano
 import itertools
+import time
 import numpy as np
 from rllab.misc.ext import sliced_fun
+from rllab.optimizers.data_parallel import DataParallelFunctions, is_data_parallel
 from _ast import Num
 
 
@@ -38,9 +40,10 @@ class PerlmutterHvp(Serializable):
             return TT.concatenate([TT.flatten(s) for s in Hx_plain_splits])
 
         self.opt_fun = ext.lazydict(
+            Hx_plain_sym=lambda: (inputs + xs, Hx_plain()),
             f_Hx_plain=lambda: ext.compile_function(
-                inputs=inputs + xs,
-                outputs=Hx_plain(),
+                inputs=self.opt_fun["Hx_plain_sym"][0],
+                outputs=self.opt_fun["Hx_plain_sym"][1],
                 log_name="f_Hx_plain",
             ),
         )
@@ -54,6 +57,62 @@ class PerlmutterHvp(Serializable):
 
         return eval
 
+    def build_data_parallel_eval(self, data_parallel_functions, sliced_inputs, non_sliced_inputs):
+        """
+        Same as build_eval, with the products evaluated by the workers on their shards of sliced_inputs.
+        """
+        def eval(x):
+            xs = tuple(self.target.flat_to_params(x, trainable=True))
+            ret = data_parallel_functions.eval(
+                "f_Hx_plain", sliced_inputs, tuple(non_sliced_inputs) + xs, self._num_slices) + self.reg_coeff * x
+            return ret
+
+        return eval
+
+
+class FisherHvp(PerlmutterHvp):
+    """
+    Computes J^T M J x, where J is the Jacobian of the distribution parameters with respect to the policy parameters,
+    and M the Hessian of the constraint with respect to the distribution parameters. For a KL constraint evaluated at
+    the old policy, this is the Fisher-vector product, equal to the Hessian-vector product of the constraint. J x is
+    computed in forward mode and J^T (M J x) in a single backward pass, instead of differentiating the gradient of the
+    constraint through the policy. The optimizer must be given the symbolic distribution parameters, as dist_info_vars.
+    """
+
+    def update_opt(self, f, target, inputs, reg_coeff, dist_info_vars=None):
+        assert dist_info_vars is not None, "FisherHvp requires the symbolic distribution parameters"
+        self.target = target
+        self.reg_coeff = reg_coeff
+        params = target.get_params(trainable=True)
+        dist_info_vars = list(dist_info_vars)
+
+        xs = tuple([ext.new_tensor_like("%s x" % p.name, p) for p in params])
+
+        def Hx_plain():
+            Jxs = TT.Rop(dist_info_vars, params, xs)
+            dist_grads = theano.grad(f, wrt=dist_info_vars, disconnected_inputs='warn')
+            # products of the Hessian of the constraint with respect to the distribution parameters
+            MJxs = theano.grad(
+                TT.sum([TT.sum(g * theano.gradient.disconnected_grad(Jx)) for g, Jx in zip(dist_grads, Jxs)]),
+                wrt=dist_info_vars,
+                disconnected_inputs='warn'
+            )
+            Hx_plain_splits = theano.grad(
+                TT.sum([TT.sum(d * theano.gradient.disconnected_grad(MJx)) for d, MJx in zip(dist_info_vars, MJxs)]),
+                wrt=params,
+                disconnected_inputs='warn'
+            )
+            return TT.concatenate([TT.flatten(s) for s in Hx_plain_splits])
+
+        self.opt_fun = ext.lazydict(
+            Hx_plain_sym=lambda: (inputs + xs, Hx_plain()),
+            f_Hx_plain=lambda: ext.compile_function(
+                inputs=self.opt_fun["Hx_plain_sym"][0],
+                outputs=self.opt_fun["Hx_plain_sym"][1],
+                log_name="f_Hx_plain",
+            ),
+        )
+
 
 class FiniteDifferenceHvp(Serializable):
 
@@ -130,7 +189,9 @@ class ConjugateGradientOptimizer(Serializable):
             max_backtracks=15,
             accept_violation=False,
             hvp_approach=None,
-            num_slices=1):
+            num_slices=1,
+            warm_start=False,
+            data_parallel=False):
         """
 
         :param cg_iters: The number of CG iterations used to calculate A^-1 g
@@ -139,6 +200,12 @@ class ConjugateGradientOptimizer(Serializable):
         computation time for the descent direction dominates, this can greatly reduce the overall computation time.
         :param accept_violation: whether to accept the descent step if it violates the line search condition after
         exhausting all backtracking budgets
+        :param hvp_approach: PerlmutterHvp (default), FisherHvp or FiniteDifferenceHvp
+        :param warm_start: start the conjugate gradient from the descent direction of the previous call to optimize
+        instead of zero, which costs one more Hessian-vector product but usually needs fewer iterations
+        :param data_parallel: evaluate the loss, gradient, constraint and Hessian-vector products on the workers of
+        the parallel sampler, each of them on a shard of the inputs. Requires a symbolic hvp_approach. Not compatible
+        with the pipelined_sampling of BatchPolopt.
         :return:
         """
         Serializable.quick_init(self, locals())
@@ -154,6 +221,10 @@ class ConjugateGradientOptimizer(Serializable):
         self._max_constraint_val = None
         self._constraint_name = None
         self._accept_violation = accept_violation
+        self._warm_start = warm_start
+        self._prev_descent_direction = None
+        self._data_parallel = data_parallel
+        self._data_parallel_functions = None
         if hvp_approach is None:
             hvp_approach = PerlmutterHvp(num_slices)
         self._hvp_approach = hvp_approach
@@ -168,6 +239,10 @@ class ConjugateGradientOptimizer(Serializable):
         :param inputs: A list of symbolic variables as inputs, which could be subsampled if needed. It is assumed
         that the first dimension of these inputs should correspond to the number of data points
         :param extra_inputs: A list of symbolic variables as extra inputs which should not be subsampled
+        :param dist_info_vars: (keyword argument) A list of the symbolic distribution parameters the constraint depends
+        on, required by FisherHvp
+        :param policy_scope: (keyword argument) If given, the target is the policy populated in this scope of the
+        parallel sampler, whose replicas are used by the data parallel evaluation
         :return: No return value.
         """
 
@@ -183,8 +258,11 @@ class ConjugateGradientOptimizer(Serializable):
         grads = theano.grad(loss, wrt=params, disconnected_inputs='warn')
         flat_grad = ext.flatten_tensor_variables(grads)
 
+        hvp_kwargs = dict()
+        if isinstance(self._hvp_approach, FisherHvp):
+            hvp_kwargs["dist_info_vars"] = kwargs.get("dist_info_vars")
         self._hvp_approach.update_opt(f=constraint_term, target=target, inputs=inputs + extra_inputs,
-                                      reg_coeff=self._reg_coeff)
+                                      reg_coeff=self._reg_coeff, **hvp_kwargs)
 
         self._target = target
         self._max_constraint_val = constraint_value
@@ -213,17 +291,49 @@ class ConjugateGradientOptimizer(Serializable):
             ),
         )
 
+        if is_data_parallel(self._data_parallel):
+            if not hasattr(self._hvp_approach, "build_data_parallel_eval"):
+                raise NotImplementedError("data_parallel requires a symbolic hvp_approach")
+            if self._data_parallel_functions is not None:
+                self._data_parallel_functions.terminate()
+            all_inputs = list(inputs + extra_inputs)
+            self._data_parallel_functions = DataParallelFunctions(
+                target,
+                dict(
+                    f_loss=(all_inputs, loss),
+                    f_grad=(all_inputs, flat_grad),
+                    f_constraint=(all_inputs, constraint_term),
+                    f_loss_constraint=(all_inputs, [loss, constraint_term]),
+                    f_Hx_plain=self._hvp_approach.opt_fun["Hx_plain_sym"],
+                ),
+                policy_scope=kwargs.get("policy_scope"),
+                target_is_policy="policy_scope" in kwargs,
+            )
+
+    def terminate(self):
+        """
+        Free the functions of the data parallel evaluation on the workers. They are sent again if needed.
+        """
+        if self._data_parallel_functions is not None:
+            self._data_parallel_functions.terminate()
+
+    def _sliced_fun(self, name):
+        if self._data_parallel_functions is not None:
+            return lambda inputs, extra_inputs: self._data_parallel_functions.eval(
+                name, inputs, extra_inputs, self._num_slices)
+        return sliced_fun(self._opt_fun[name], self._num_slices)
+
     def loss(self, inputs, extra_inputs=None):
         inputs = tuple(inputs)
         if extra_inputs is None:
             extra_inputs = tuple()
-        return sliced_fun(self._opt_fun["f_loss"], self._num_slices)(inputs, extra_inputs)
+        return self._sliced_fun("f_loss")(inputs, extra_inputs)
 
     def constraint_val(self, inputs, extra_inputs=None):
         inputs = tuple(inputs)
         if extra_inputs is None:
             extra_inputs = tuple()
-        return sliced_fun(self._opt_fun["f_constraint"], self._num_slices)(inputs, extra_inputs)
+        return self._sliced_fun("f_constraint")(inputs, extra_inputs)
 
     def optimize(self, inputs, extra_inputs=None, subsample_grouped_inputs=None):
 
@@ -244,17 +354,33 @@ class ConjugateGradientOptimizer(Serializable):
             subsample_inputs = inputs
 
         logger.log("computing loss before")
-        loss_before = sliced_fun(self._opt_fun["f_loss"], self._num_slices)(
-            inputs, extra_inputs)
+        loss_before = self._sliced_fun("f_loss")(inputs, extra_inputs)
         logger.log("performing update")
         logger.log("computing descent direction")
 
-        flat_g = sliced_fun(self._opt_fun["f_grad"], self._num_slices)(
-            inputs, extra_inputs)
+        flat_g = self._sliced_fun("f_grad")(inputs, extra_inputs)
 
-        Hx = self._hvp_approach.build_eval(subsample_inputs + extra_inputs)
+        if self._data_parallel_functions is not None:
+            f_Hx = self._hvp_approach.build_data_parallel_eval(
+                self._data_parallel_functions, subsample_inputs, extra_inputs)
+        else:
+            f_Hx = self._hvp_approach.build_eval(subsample_inputs + extra_inputs)
+        hvp_count = [0]
+        hvp_time = [0.]
+
+        def Hx(x):
+            start_time = time.time()
+            ret = f_Hx(x)
+            hvp_count[0] += 1
+            hvp_time[0] += time.time() - start_time
+            return ret
 
-        descent_direction = krylov.cg(Hx, flat_g, cg_iters=self._cg_iters)
+        x0 = None
+        if self._warm_start and self._prev_descent_direction is not None and \
+                self._prev_descent_direction.shape == flat_g.shape:
+            x0 = self._prev_descent_direction
+        descent_direction = krylov.cg(Hx, flat_g, cg_iters=self._cg_iters, x0=x0)
+        self._prev_descent_direction = np.copy(descent_direction)
 
         initial_step_size = np.sqrt(
             2.0 * self._max_constraint_val *
@@ -265,6 +391,8 @@ class ConjugateGradientOptimizer(Serializable):
         flat_descent_step = initial_step_size * descent_direction
 
         logger.log("descent direction computed")
+        logger.record_tabular('HvpCount', hvp_count[0])
+        logger.record_tabular('HvpTime', hvp_time[0])
 
         prev_param = np.copy(self._target.get_param_values(trainable=True))
         n_iter = 0
@@ -272,8 +400,7 @@ class ConjugateGradientOptimizer(Serializable):
             cur_step = ratio * flat_descent_step
             cur_param = prev_param - cur_step
             self._target.set_param_values(cur_param, trainable=True)
-            loss, constraint_val = sliced_fun(
-                self._opt_fun["f_loss_constraint"], self._num_slices)(inputs, extra_inputs)
+            loss, constraint_val = self._sliced_fun("f_loss_constraint")(inputs, extra_inputs)
             if loss < loss_before and constraint_val <= self._max_constraint_val:
                 break
         if (np.isnan(loss) or np.isnan(constraint_val) or loss >= loss_before or constraint_val >=
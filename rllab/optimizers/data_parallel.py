@@ -0,0 +1,223 @@
+"""
+Data parallel evaluation of the functions of the optimizers (loss, gradient, Hessian-vector product, ...) on the
+workers of the singleton_pool.
+
+The symbolic functions are sent to the workers once, together with the parameters of the target they depend on. Each
+worker clones them onto its replica of the target, i.e. the policy populated by parallel_sampler.populate_task when
+the target is the policy, or else a copy of the target sent along with the functions, and compiles them. The inputs
+are split into one shard per worker, which are only sent again when the optimizer is given other inputs. An
+evaluation broadcasts the parameters of the target if they changed, has each worker evaluate the function on its
+shard, and averages the results weighted by the sizes of the shards, as sliced_fun does for the slices.
+
+Every evaluation is a barrier across all the workers (StatefulPool.run_each), so this cannot be used along with the
+pipelined_sampling of BatchPolopt: while the next batch is being collected, the evaluations would wait for the
+workers to be done sampling. BatchPolopt rejects the combination for its optimizer.
+"""
+import os
+import uuid
+import weakref
+
+import cloudpickle as pickle
+import numpy as np
+import theano
+
+from rllab.misc import ext
+from rllab.sampler import parallel_sampler
+from rllab.sampler.stateful_pool import singleton_pool, SharedGlobal
+
+# number of sets of inputs, e.g. the full batch and its subsample for the Hessian-vector products, kept on the workers
+MAX_SHARD_SETS = 2
+
+# (key, scope) of the functions whose DataParallelFunctions was garbage collected without being terminated, released
+# on the workers by the next populate, as the collection can happen while the workers are busy
+_released_functions = []
+
+
+def is_data_parallel(data_parallel):
+    """
+    :return: whether the data parallel evaluation can be used: there are several workers, and this is not one of them
+    (e.g. unpickling a copy of a target whose optimizer was created with data_parallel)
+    """
+    return data_parallel and singleton_pool.n_parallel > 1 and os.getpid() == singleton_pool.master_pid
+
+
+def _get_state(G, key, scope):
+    return parallel_sampler._get_scoped_G(G, scope).data_parallel[key]
+
+
+def _worker_populate_functions(G, key, data, scope=None):
+    G = parallel_sampler._get_scoped_G(G, scope)
+    graph_params, target, functions = pickle.loads(data)
+    if target is None:
+        target = G.policy
+    replace = dict(zip(graph_params, target.get_params()))
+
+    def compile_function(inputs, outputs, name):
+        return ext.compile_function(inputs, theano.clone(outputs, replace=replace), log_name=name)
+
+    state = SharedGlobal()
+    state.target = target
+    state.functions = ext.lazydict(**{
+        name: (lambda inputs=inputs, outputs=outputs, name=name: compile_function(inputs, outputs, name))
+        for name, (inputs, outputs) in functions.items()
+    })
+    state.shards = dict()
+    if not hasattr(G, "data_parallel"):
+        G.data_parallel = dict()
+    G.data_parallel[key] = state
+
+
+def _worker_terminate_functions(G, keys_and_scopes):
+    for key, scope in keys_and_scopes:
+        getattr(parallel_sampler._get_scoped_G(G, scope), "data_parallel", dict()).pop(key, None)
+
+
+def _terminate_functions(keys_and_scopes):
+    singleton_pool.run_each(
+        _worker_terminate_functions,
+        [(keys_and_scopes,)] * singleton_pool.n_parallel
+    )
+
+
+def _release_functions(key, scope):
+    _released_functions.append((key, scope))
+
+
+def _worker_set_target_params(G, key, params, scope=None):
+    _get_state(G, key, scope).target.set_param_values(params)
+
+
+def _worker_set_shard(G, key, shard_id, shard, kept_shard_ids, scope=None):
+    state = _get_state(G, key, scope)
+    state.shards = {k: v for k, v in state.shards.items() if k in kept_shard_ids}
+    state.shards[shard_id] = shard
+
+
+def _worker_eval(G, key, name, shard_id, non_sliced_inputs, n_slices, scope=None):
+    state = _get_state(G, key, scope)
+    shard = state.shards[shard_id]
+    n_samples = len(shard[0])
+    if n_samples == 0:
+        return None, 0
+    return ext.sliced_fun(state.functions[name], n_slices)(shard, non_sliced_inputs), n_samples
+
+
+class DataParallelFunctions(object):
+    """
+    Evaluates symbolic functions of the inputs and of the parameters of a target on the workers, each of them on a
+    shard of the inputs. The functions are sent to the workers on the first evaluation, and again after terminate,
+    which frees them on the workers.
+    """
+
+    def __init__(self, target, functions, policy_scope=None, target_is_policy=False):
+        """
+        :param target: Parameterized object whose parameters the functions depend on
+        :param functions: dictionary of the functions, as name: (symbolic inputs, symbolic outputs). The inputs must
+        be the sliced inputs followed by the non sliced ones.
+        :param policy_scope: scope in which the policy replicas were populated, if target is the policy
+        :param target_is_policy: whether the target is the policy populated in policy_scope, whose replicas the
+        workers then use. Otherwise, a copy of the target is sent to the workers.
+        """
+        self._key = str(uuid.uuid4())
+        self._target = target
+        self._functions = functions
+        self._scope = policy_scope if target_is_policy else None
+        self._target_is_policy = target_is_policy
+        self._populated = False
+        self._param_values = None
+        # (id, inputs) of the sets of inputs sharded on the workers, the most recent last
+        self._shard_sets = []
+        self._finalizer = None
+
+    def _populate(self):
+        if self._populated:
+            return
+        if _released_functions:
+            released = list(_released_functions)
+            del _released_functions[:]
+            _terminate_functions(released)
+        data = pickle.dumps((self._target.get_params(), None if self._target_is_policy else self._target,
+                             self._functions))
+        singleton_pool.run_each(
+            _worker_populate_functions,
+            [(self._key, data, self._scope)] * singleton_pool.n_parallel
+        )
+        self._populated = True
+        # free the functions on the workers if this is collected while they are populated
+        self._finalizer = weakref.finalize(self, _release_functions, self._key, self._scope)
+        # the copies of the target hold its current parameters
+        self._param_values = None if self._target_is_policy else self._target.get_param_values()
+
+    def _broadcast_params(self):
+        param_values = self._target.get_param_values()
+        if self._param_values is not None and np.array_equal(param_values, self._param_values):
+            return
+        if self._target_is_policy:
+            parallel_sampler.set_policy_params(param_values, scope=self._scope)
+        else:
+            singleton_pool.run_each(
+                _worker_set_target_params,
+                [(self._key, param_values, self._scope)] * singleton_pool.n_parallel
+            )
+        self._param_values = param_values
+
+    def _get_shard_id(self, sliced_inputs):
+        """
+        Shard the inputs on the workers, unless they already were.
+        :return: the id of the shards of the inputs
+        """
+        sliced_inputs = list(sliced_inputs)
+        for shard_id, inputs in self._shard_sets:
+            if len(inputs) == len(sliced_inputs) and all(x is y for x, y in zip(inputs, sliced_inputs)):
+                return shard_id
+        shard_id = str(uuid.uuid4())
+        self._shard_sets = self._shard_sets[-(MAX_SHARD_SETS - 1):] + [(shard_id, sliced_inputs)]
+        kept_shard_ids = [kept_id for kept_id, _ in self._shard_sets]
+        n_samples = len(sliced_inputs[0])
+        bounds = np.linspace(0, n_samples, singleton_pool.n_parallel + 1).astype(int)
+        singleton_pool.run_each(
+            _worker_set_shard,
+            [(self._key, shard_id, [x[start:end] for x in sliced_inputs], kept_shard_ids, self._scope)
+             for start, end in zip(bounds[:-1], bounds[1:])]
+        )
+        return shard_id
+
+    def eval(self, name, sliced_inputs, non_sliced_inputs=None, n_slices=1):
+        """
+        Same as sliced_fun(f, n_slices)(sliced_inputs, non_sliced_inputs) for the function registered as name, each
+        worker slicing its shard into n_slices.
+        """
+        if non_sliced_inputs is None:
+            non_sliced_inputs = []
+        self._populate()
+        shard_id = self._get_shard_id(sliced_inputs)
+        self._broadcast_params()
+        results = singleton_pool.run_each(
+            _worker_eval,
+            [(self._key, name, shard_id, list(non_sliced_inputs), n_slices, self._scope)] *
+            singleton_pool.n_parallel
+        )
+        results = [(ret_vals, n_samples) for ret_vals, n_samples in results if n_samples > 0]
+        n_total = sum(n_samples for _, n_samples in results)
+        first_ret_vals = results[0][0]
+        if not isinstance(first_ret_vals, (tuple, list)):
+            return sum(np.asarray(ret_vals) * n_samples for ret_vals, n_samples in results) / n_total
+        ret_vals = [
+            sum(np.asarray(ret_vals[i]) * n_samples for ret_vals, n_samples in results) / n_total
+            for i in range(len(first_ret_vals))
+        ]
+        if isinstance(first_ret_vals, tuple):
+            ret_vals = tuple(ret_vals)
+        return ret_vals
+
+    def terminate(self):
+        """
+        Free the functions, the shards and the target copies on the workers. They are sent again if needed.
+        """
+        if not self._populated:
+            return
+        self._finalizer.detach()
+        _terminate_functions([(self._key, self._scope)])
+        self._populated = False
+        self._param_values = None
+        self._shard_sets = []
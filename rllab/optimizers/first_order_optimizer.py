@@ -10,6 +10,7 @@ import theano
 import pyprind
 from functools import partial
 from rllab.misc.ext import sliced_fun
+import numpy as np
 
 
 class FirstOrderOptimizer(Serializable):
@@ -27,6 +28,8 @@ class FirstOrderOptimizer(Serializable):
             callback=None,
             verbose=False,
             n_slices=1,
+            tolerance_check="full",
+            tolerance_n_samples=1000,
             **kwargs):
         """
 
@@ -35,6 +38,10 @@ class FirstOrderOptimizer(Serializable):
         :param update_method:
         :param batch_size: None or an integer. If None the whole dataset will be used.
         :param n_slices: Slice evaluation functions where possible into n_slices.
+        :param tolerance_check: loss compared to the tolerance after each epoch: "full" for the loss on all the inputs,
+        "subsample" for the loss on tolerance_n_samples samples drawn once per optimization, or "running" for the
+        mean of the minibatch losses of the epoch, which costs no additional evaluation.
+        :param tolerance_n_samples: number of samples of the "subsample" tolerance check.
         :param callback:
         :param kwargs:
         :return:
@@ -50,6 +57,9 @@ class FirstOrderOptimizer(Serializable):
         self._batch_size = batch_size
         self._verbose = verbose
         self._n_slices = n_slices
+        assert tolerance_check in ["full", "subsample", "running"]
+        self._tolerance_check = tolerance_check
+        self._tolerance_n_samples = tolerance_n_samples
 
     def update_opt(self, loss, target, inputs, extra_inputs=None, gradients=None, **kwargs):
         """
@@ -95,8 +105,16 @@ class FirstOrderOptimizer(Serializable):
         if extra_inputs is None:
             extra_inputs = tuple()
 
-        last_loss = self.loss(inputs, extra_inputs)
-        logger.log('Initial loss {}'.format(last_loss))
+        check_inputs = inputs
+        if self._tolerance_check == "subsample" and len(inputs[0]) > self._tolerance_n_samples:
+            check_ids = np.random.choice(len(inputs[0]), self._tolerance_n_samples, replace=False)
+            check_inputs = [x[check_ids] for x in inputs]
+
+        if self._tolerance_check == "running":
+            last_loss = None
+        else:
+            last_loss = self.loss(check_inputs, extra_inputs)
+            logger.log('Initial loss {}'.format(last_loss))
 
         start_time = time.time()
 
@@ -108,13 +126,20 @@ class FirstOrderOptimizer(Serializable):
 
         itr = 0
         for epoch in pyprind.prog_bar(list(range(self._max_epochs))):
+            batch_losses = []
+            batch_sizes = []
             for batch in dataset.iterate(update=True):
-                f_opt(*batch)
+                batch_losses.append(f_opt(*batch))
+                batch_sizes.append(len(batch[0]))
                 if yield_itr is not None and (itr % (yield_itr + 1)) == 0:
                     yield
                 itr += 1
 
-            new_loss = self.loss(inputs, extra_inputs)
+            if self._tolerance_check == "running":
+                # losses before each update, weighted by the sizes of the batches
+                new_loss = np.average(batch_losses, weights=batch_sizes)
+            else:
+                new_loss = self.loss(check_inputs, extra_inputs)
             if self._verbose:
                 logger.log("Epoch %d, loss %s" % (epoch, new_loss))
 
@@ -131,7 +156,7 @@ class FirstOrderOptimizer(Serializable):
                 if callback:
                     callback(**callback_args)
 
-            if abs(last_loss - new_loss) < self._tolerance:
+            if last_loss is not None and abs(last_loss - new_loss) < self._tolerance:
                 break
             last_loss = new_loss
 
@@ -4,6 +4,7 @@ import theano
 import scipy.optimize
 import time
 from rllab.misc.ext import sliced_fun
+from rllab.optimizers.data_parallel import DataParallelFunctions, is_data_parallel
 
 
 class LbfgsOptimizer(Serializable):
@@ -11,13 +12,19 @@ class LbfgsOptimizer(Serializable):
     Performs unconstrained optimization via L-BFGS.
     """
 
-    def __init__(self, max_opt_itr=20, callback=None, n_slices=1):
+    def __init__(self, max_opt_itr=20, callback=None, n_slices=1, data_parallel=False):
+        """
+        :param data_parallel: evaluate the loss and gradient on the workers of the parallel sampler, each of them on a
+        shard of the inputs. Not compatible with the pipelined_sampling of BatchPolopt.
+        """
         Serializable.quick_init(self, locals())
         self._max_opt_itr = max_opt_itr
         self._opt_fun = None
         self._target = None
         self._callback = callback
         self._n_slices = n_slices
+        self._data_parallel = data_parallel
+        self._data_parallel_functions = None
 
     def update_opt(self, loss, target, inputs, extra_inputs=None, gradients=None, *args, **kwargs):
         """
@@ -28,6 +35,9 @@ class LbfgsOptimizer(Serializable):
         :param inputs: A list of symbolic variables as inputs
         :param gradients: symbolic expressions for the gradients of trainable parameters of the target. By default
         this will be computed by calling theano.grad
+        :param policy_scope: (keyword argument) If given, the target is the policy populated in this scope of the
+        parallel sampler, whose replicas are used by the data parallel evaluation. Otherwise, a copy of the target is
+        sent to the workers.
         :return: No return value.
         """
 
@@ -50,21 +60,47 @@ class LbfgsOptimizer(Serializable):
             )
         )
 
+        if is_data_parallel(self._data_parallel):
+            if self._data_parallel_functions is not None:
+                self._data_parallel_functions.terminate()
+            self._data_parallel_functions = DataParallelFunctions(
+                target,
+                dict(
+                    f_loss=(inputs + extra_inputs, loss),
+                    f_opt=(inputs + extra_inputs, get_opt_output(gradients)),
+                ),
+                policy_scope=kwargs.get("policy_scope"),
+                target_is_policy="policy_scope" in kwargs,
+            )
+
+    def terminate(self):
+        """
+        Free the functions of the data parallel evaluation on the workers. They are sent again if needed.
+        """
+        if self._data_parallel_functions is not None:
+            self._data_parallel_functions.terminate()
+
+    def _sliced_fun(self, name):
+        if self._data_parallel_functions is not None:
+            return lambda inputs, extra_inputs=None: self._data_parallel_functions.eval(
+                name, inputs, extra_inputs, self._n_slices)
+        return sliced_fun(self._opt_fun[name], self._n_slices)
+
     def loss(self, inputs, extra_inputs=None):
         if extra_inputs is None:
             extra_inputs = list()
         # return self._opt_fun["f_loss"](*(list(inputs) + list(extra_inputs)))
-        return sliced_fun(self._opt_fun["f_loss"], self._n_slices)(inputs, extra_inputs)
+        return self._sliced_fun("f_loss")(inputs, extra_inputs)
 
     def optimize(self, inputs, extra_inputs=None):
-        f_opt = self._opt_fun["f_opt"]
+        f_opt = self._sliced_fun("f_opt")
 
         if extra_inputs is None:
             extra_inputs = list()
 
         def f_opt_wrapper(flat_params):
             self._target.set_param_values(flat_params, trainable=True)
-            return sliced_fun(f_opt, self._n_slices)(inputs)
+            return f_opt(inputs)
 
         itr = [0]
         start_time = time.time()
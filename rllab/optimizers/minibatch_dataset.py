@@ -2,6 +2,11 @@ import numpy as np
 
 
 class BatchDataset(object):
+    """
+    Iterates over the inputs in shuffled minibatches. The inputs are permuted once per epoch into buffers reused
+    across epochs, and the minibatches are contiguous slices of these buffers: they are only valid until the next
+    epoch starts.
+    """
 
     def __init__(self, inputs, batch_size, extra_inputs=None):
         self._inputs = [
@@ -13,6 +18,7 @@ class BatchDataset(object):
         self._batch_size = batch_size
         if batch_size is not None:
             self._ids = np.arange(self._inputs[0].shape[0])
+            self._buffers = None
             self.update()
 
     @property
@@ -21,18 +27,29 @@ class BatchDataset(object):
             return 1
         return int(np.ceil(self._inputs[0].shape[0] * 1.0 / self._batch_size))
 
+    def _permute(self):
+        # the permutation is only done when the epoch is iterated over, not on every update
+        if self._buffers is None:
+            self._buffers = [np.empty_like(d) for d in self._inputs]
+        for d, buffer in zip(self._inputs, self._buffers):
+            # ids are in range, and the "raise" mode would buffer the output
+            np.take(d, self._ids, axis=0, out=buffer, mode='clip')
+        self._permuted = True
+
     def iterate(self, update=True):
         if self._batch_size is None:
             yield list(self._inputs) + list(self._extra_inputs)
         else:
+            if not self._permuted:
+                self._permute()
             for itr in range(self.number_batches):
                 batch_start = itr * self._batch_size
                 batch_end = (itr + 1) * self._batch_size
-                batch_ids = self._ids[batch_start:batch_end]
-                batch = [d[batch_ids] for d in self._inputs]
+                batch = [buffer[batch_start:batch_end] for buffer in self._buffers]
                 yield list(batch) + list(self._extra_inputs)
             if update:
                 self.update()
 
     def update(self):
         np.random.shuffle(self._ids)
+        self._permuted = False
@@ -1,6 +1,7 @@
 from rllab.misc.ext import compile_function, lazydict, flatten_tensor_variables
 from rllab.misc import logger
 from rllab.core.serializable import Serializable
+from rllab.optimizers.data_parallel import DataParallelFunctions, is_data_parallel
 import theano.tensor as TT
 import theano
 import numpy as np
@@ -22,7 +23,12 @@ class PenaltyLbfgsOptimizer(Serializable):
             increase_penalty_factor=2,
             decrease_penalty_factor=0.5,
             max_penalty_itr=10,
-            adapt_penalty=True):
+            adapt_penalty=True,
+            data_parallel=False):
+        """
+        :param data_parallel: evaluate the loss, constraint and gradient on the workers of the parallel sampler, each
+        of them on a shard of the inputs. Not compatible with the pipelined_sampling of BatchPolopt.
+        """
         Serializable.quick_init(self, locals())
         self._max_opt_itr = max_opt_itr
         self._penalty = initial_penalty
@@ -33,6 +39,8 @@ class PenaltyLbfgsOptimizer(Serializable):
         self._decrease_penalty_factor = decrease_penalty_factor
         self._max_penalty_itr = max_penalty_itr
         self._adapt_penalty = adapt_penalty
+        self._data_parallel = data_parallel
+        self._data_parallel_functions = None
 
         self._opt_fun = None
         self._target = None
@@ -46,6 +54,8 @@ class PenaltyLbfgsOptimizer(Serializable):
         :class:`rllab.core.paramerized.Parameterized` class.
         :param leq_constraint: A constraint provided as a tuple (f, epsilon), of the form f(*inputs) <= epsilon.
         :param inputs: A list of symbolic variables as inputs
+        :param policy_scope: (keyword argument) If given, the target is the policy populated in this scope of the
+        parallel sampler, whose replicas are used by the data parallel evaluation
         :return: No return value.
         """
         constraint_term, constraint_value = leq_constraint
@@ -77,11 +87,41 @@ class PenaltyLbfgsOptimizer(Serializable):
             )
         )
 
+        if is_data_parallel(self._data_parallel):
+            if self._data_parallel_functions is not None:
+                self._data_parallel_functions.terminate()
+            self._data_parallel_functions = DataParallelFunctions(
+                target,
+                dict(
+                    f_loss=(inputs, loss),
+                    f_constraint=(inputs, constraint_term),
+                    f_penalized_loss=(inputs + [penalty_var], [penalized_loss, loss, constraint_term]),
+                    f_opt=(inputs + [penalty_var], get_opt_output()),
+                ),
+                policy_scope=kwargs.get("policy_scope"),
+                target_is_policy="policy_scope" in kwargs,
+            )
+
+    def terminate(self):
+        """
+        Free the functions of the data parallel evaluation on the workers. They are sent again if needed.
+        """
+        if self._data_parallel_functions is not None:
+            self._data_parallel_functions.terminate()
+
+    def _get_fun(self, name, inputs):
+        """
+        :return: the function of the extra inputs (the penalty) evaluated on inputs
+        """
+        if self._data_parallel_functions is not None:
+            return lambda *extra_inputs: self._data_parallel_functions.eval(name, inputs, extra_inputs)
+        return lambda *extra_inputs: self._opt_fun[name](*(tuple(inputs) + extra_inputs))
+
     def loss(self, inputs):
-        return self._opt_fun["f_loss"](*inputs)
+        return self._get_fun("f_loss", inputs)()
 
     def constraint_val(self, inputs):
-        return self._opt_fun["f_constraint"](*inputs)
+        return self._get_fun("f_constraint", inputs)()
 
     def optimize(self, inputs):
 
@@ -91,13 +131,13 @@ class PenaltyLbfgsOptimizer(Serializable):
             self._penalty, self._min_penalty, self._max_penalty)
 
         penalty_scale_factor = None
-        f_opt = self._opt_fun["f_opt"]
-        f_penalized_loss = self._opt_fun["f_penalized_loss"]
+        f_opt = self._get_fun("f_opt", inputs)
+        f_penalized_loss = self._get_fun("f_penalized_loss", inputs)
 
         def gen_f_opt(penalty):
             def f(flat_params):
                 self._target.set_param_values(flat_params, trainable=True)
-                return f_opt(*(inputs + (penalty,)))
+                return f_opt(penalty)
             return f
 
         cur_params = self._target.get_param_values(trainable=True).astype('float64')
@@ -111,7 +151,7 @@ class PenaltyLbfgsOptimizer(Serializable):
                 maxiter=self._max_opt_itr
             )
 
-            _, try_loss, try_constraint_val = f_penalized_loss(*(inputs + (try_penalty,)))
+            _, try_loss, try_constraint_val = f_penalized_loss(try_penalty)
 
             logger.log('penalty %f => loss %f, %s %f' %
                        (try_penalty, try_loss, self._constraint_name, try_constraint_val))
@@ -46,36 +46,43 @@ class BaseSampler(Sampler):
         self.algo = algo
 
     def process_samples(self, itr, paths):
-        baselines = []
-        returns = []
-
         if hasattr(self.algo.baseline, "predict_n"):
             all_path_baselines = self.algo.baseline.predict_n(paths)
         else:
             all_path_baselines = [self.algo.baseline.predict(path) for path in paths]
 
+        # pack the whole batch into zero padded (n_paths, max_path_length) arrays, so that advantages and returns
+        # are computed for all paths at once
+        path_lengths = np.array([len(path["rewards"]) for path in paths])
+        max_path_length = np.max(path_lengths)
+        valids = np.arange(max_path_length) < path_lengths.reshape((-1, 1))
+        padded_rewards = np.zeros(valids.shape)
+        padded_rewards[valids] = np.concatenate([path["rewards"] for path in paths])
+        padded_baselines = np.zeros(valids.shape)
+        padded_baselines[valids] = np.concatenate(all_path_baselines)
+
+        padded_advantages, padded_returns = special.gae_advantages_n(
+            padded_rewards, padded_baselines, self.algo.discount, self.algo.gae_lambda)
         for idx, path in enumerate(paths):
-            path_baselines = np.append(all_path_baselines[idx], 0)
-            deltas = path["rewards"] + \
-                     self.algo.discount * path_baselines[1:] - \
-                     path_baselines[:-1]
-            path["advantages"] = special.discount_cumsum(
-                deltas, self.algo.discount * self.algo.gae_lambda)
-            path["returns"] = special.discount_cumsum(path["rewards"], self.algo.discount)
-            baselines.append(path_baselines[:-1])
-            returns.append(path["returns"])
+            path["advantages"] = padded_advantages[idx, :path_lengths[idx]]
+            path["returns"] = padded_returns[idx, :path_lengths[idx]]
 
         ev = special.explained_variance_1d(
-            np.concatenate(baselines),
-            np.concatenate(returns)
+            padded_baselines[valids],
+            padded_returns[valids]
         )
 
+        average_discounted_return = np.mean(padded_returns[:, 0])
+
+        undiscounted_returns = np.sum(padded_rewards, axis=1)
+
         if not self.algo.policy.recurrent:
             observations = tensor_utils.concat_tensor_list([path["observations"] for path in paths])
             actions = tensor_utils.concat_tensor_list([path["actions"] for path in paths])
-            rewards = tensor_utils.concat_tensor_list([path["rewards"] for path in paths])
-            returns = tensor_utils.concat_tensor_list([path["returns"] for path in paths])
-            advantages = tensor_utils.concat_tensor_list([path["advantages"] for path in paths])
+            # boolean indexing of the padded arrays yields the paths concatenated in order
+            rewards = padded_rewards[valids]
+            returns = padded_returns[valids]
+            advantages = padded_advantages[valids]
             env_infos = tensor_utils.concat_tensor_dict_list([path["env_infos"] for path in paths])
             agent_infos = tensor_utils.concat_tensor_dict_list([path["agent_infos"] for path in paths])
 
@@ -85,11 +92,6 @@ class BaseSampler(Sampler):
             if self.algo.positive_adv:
                 advantages = util.shift_advantages_to_positive(advantages)
 
-            average_discounted_return = \
-                np.mean([path["returns"][0] for path in paths])
-
-            undiscounted_returns = [sum(path["rewards"]) for path in paths]
-
             ent = np.mean(self.algo.policy.distribution.entropy(agent_infos))
 
             samples_data = dict(
@@ -103,48 +105,26 @@ class BaseSampler(Sampler):
                 paths=paths,
             )
         else:
-            max_path_length = max([len(path["advantages"]) for path in paths])
-
             # make all paths the same length (pad extra advantages with 0)
             obs = [path["observations"] for path in paths]
             obs = tensor_utils.pad_tensor_n(obs, max_path_length)
 
             if self.algo.center_adv:
-                raw_adv = np.concatenate([path["advantages"] for path in paths])
+                raw_adv = padded_advantages[valids]
                 adv_mean = np.mean(raw_adv)
                 adv_std = np.std(raw_adv) + 1e-8
-                adv = [(path["advantages"] - adv_mean) / adv_std for path in paths]
+                adv = np.where(valids, (padded_advantages - adv_mean) / adv_std, 0.)
             else:
-                adv = [path["advantages"] for path in paths]
-
-            adv = np.asarray([tensor_utils.pad_tensor(a, max_path_length) for a in adv])
+                adv = padded_advantages
 
             actions = [path["actions"] for path in paths]
             actions = tensor_utils.pad_tensor_n(actions, max_path_length)
 
-            rewards = [path["rewards"] for path in paths]
-            rewards = tensor_utils.pad_tensor_n(rewards, max_path_length)
+            agent_infos = tensor_utils.pad_tensor_dict_n([path["agent_infos"] for path in paths], max_path_length)
 
-            returns = [path["returns"] for path in paths]
-            returns = tensor_utils.pad_tensor_n(returns, max_path_length)
+            env_infos = tensor_utils.pad_tensor_dict_n([path["env_infos"] for path in paths], max_path_length)
 
-            agent_infos = [path["agent_infos"] for path in paths]
-            agent_infos = tensor_utils.stack_tensor_dict_list(
-                [tensor_utils.pad_tensor_dict(p, max_path_length) for p in agent_infos]
-            )
-
-            env_infos = [path["env_infos"] for path in paths]
-            env_infos = tensor_utils.stack_tensor_dict_list(
-                [tensor_utils.pad_tensor_dict(p, max_path_length) for p in env_infos]
-            )
-
-            valids = [np.ones_like(path["returns"]) for path in paths]
-            valids = tensor_utils.pad_tensor_n(valids, max_path_length)
-
-            average_discounted_return = \
-                np.mean([path["returns"][0] for path in paths])
-
-            undiscounted_returns = [sum(path["rewards"]) for path in paths]
+            valids = valids.astype(np.float64)
 
             ent = np.sum(self.algo.policy.distribution.entropy(agent_infos) * valids) / np.sum(valids)
 
@@ -152,8 +132,8 @@ class BaseSampler(Sampler):
                 observations=obs,
                 actions=actions,
                 advantages=adv,
-                rewards=rewards,
-                returns=returns,
+                rewards=padded_rewards,
+                returns=padded_returns,
                 valids=valids,
                 agent_infos=agent_infos,
                 env_infos=env_infos,
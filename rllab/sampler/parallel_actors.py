@@ -0,0 +1,184 @@
+import multiprocessing as mp
+import pickle
+import queue
+import time
+
+import cloudpickle
+import numpy as np
+
+from rllab.misc import ext
+
+
+class SharedTransitionQueue(object):
+    """
+    Single producer, single consumer ring buffer of fixed width float rows in shared memory. It must be created before
+    forking the producer; rows are then exchanged without pickling.
+    """
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.width = width
+        self._buffer = mp.RawArray('d', capacity * width)
+        # number of rows written by the producer and read by the consumer since the start
+        self._n_put = mp.RawValue('l', 0)
+        self._n_got = mp.RawValue('l', 0)
+        self._rows = None
+
+    def _get_rows(self):
+        # the numpy view is created lazily, in the process using it
+        if self._rows is None:
+            self._rows = np.frombuffer(self._buffer, dtype=np.float64).reshape((self.capacity, self.width))
+        return self._rows
+
+    def put(self, row, stop_event=None):
+        """
+        Append a row, waiting for the consumer while the buffer is full.
+        :return: False if stop_event was set while waiting
+        """
+        while self._n_put.value - self._n_got.value >= self.capacity:
+            if stop_event is not None and stop_event.is_set():
+                return False
+            time.sleep(0.001)
+        self._get_rows()[self._n_put.value % self.capacity] = row
+        # only publish the row once written
+        self._n_put.value += 1
+        return True
+
+    def get_all(self):
+        """
+        :return: array with all the rows appended since the last call
+        """
+        n_got, n_put = self._n_got.value, self._n_put.value
+        rows = self._get_rows()[np.arange(n_got, n_put) % self.capacity]
+        self._n_got.value = n_put
+        return rows
+
+
+def _run_actor(actor_id, data, transition_queue, params, params_version, returns_queue, stop_event, seed):
+    env, policy, es, max_path_length, include_horizon_terminal_transitions, scale_reward = pickle.loads(data)
+    if seed is not None:
+        ext.set_seed(seed + actor_id)
+    # do not wait for the learner to read the last returns when exiting
+    returns_queue.cancel_join_thread()
+    version = -1
+    itr = 0
+    path_length = 0
+    path_return = 0
+    terminal = False
+    observation = env.reset()
+    while not stop_event.is_set():
+        if params_version.value != version:
+            with params_version.get_lock():
+                version = params_version.value
+                policy.set_param_values(np.frombuffer(params, dtype=np.float64).copy())
+        if terminal:
+            observation = env.reset()
+            es.reset()
+            policy.reset()
+            returns_queue.put(path_return)
+            path_length = 0
+            path_return = 0
+        action = es.get_action(itr, observation, policy=policy)
+
+        next_observation, reward, terminal, _ = env.step(action)
+        path_length += 1
+        path_return += reward
+
+        store = True
+        if not terminal and path_length >= max_path_length:
+            terminal = True
+            # only include the terminal transition in this case if the flag was set
+            store = include_horizon_terminal_transitions
+        if store:
+            row = np.concatenate([
+                np.ravel(observation), np.ravel(action), [reward * scale_reward, terminal], np.ravel(next_observation)
+            ])
+            if not transition_queue.put(row, stop_event):
+                break
+
+        observation = next_observation
+        itr += 1
+    env.terminate()
+
+
+class ParallelActors(object):
+    """
+    Actor processes for off-policy algorithms. Each actor steps its own copy of the environment with the exploration
+    strategy and streams the (observation, action, scaled reward, terminal, next observation) transitions back
+    through a SharedTransitionQueue. The learner broadcasts the policy parameters with set_policy_params, which the
+    actors pick up before their next step.
+    """
+
+    def __init__(self, env, policy, es, n_actors, max_path_length, include_horizon_terminal_transitions=False,
+                 scale_reward=1., queue_size=1000):
+        """
+        :param n_actors: number of actor processes
+        :param queue_size: number of transitions an actor can be ahead of the learner before waiting for it
+        """
+        self.n_actors = n_actors
+        self.observation_dim = env.observation_space.flat_dim
+        self.action_dim = env.action_space.flat_dim
+        self._data = cloudpickle.dumps(
+            (env, policy, es, max_path_length, include_horizon_terminal_transitions, scale_reward))
+        width = 2 * self.observation_dim + self.action_dim + 2
+        self._queues = [SharedTransitionQueue(queue_size, width) for _ in range(n_actors)]
+        param_values = policy.get_param_values()
+        self._params = mp.RawArray('d', len(param_values))
+        self._params_version = mp.Value('l', 0)
+        self._returns_queue = mp.Queue()
+        self._stop_event = mp.Event()
+        self._processes = []
+        self.set_policy_params(param_values)
+
+    def start(self):
+        seed = ext.get_seed()
+        for actor_id, transition_queue in enumerate(self._queues):
+            process = mp.Process(
+                target=_run_actor,
+                args=(actor_id, self._data, transition_queue, self._params, self._params_version,
+                      self._returns_queue, self._stop_event, seed),
+            )
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+
+    def set_policy_params(self, param_values):
+        with self._params_version.get_lock():
+            np.frombuffer(self._params, dtype=np.float64)[:] = param_values
+            self._params_version.value += 1
+
+    def add_transitions(self, pool):
+        """
+        Move the transitions collected since the last call into the replay pool, which must store the next
+        observations explicitly.
+        :return: the number of transitions added
+        """
+        n_added = 0
+        obs_dim, action_dim = self.observation_dim, self.action_dim
+        for transition_queue in self._queues:
+            for row in transition_queue.get_all():
+                pool.add_sample(
+                    row[:obs_dim], row[obs_dim:obs_dim + action_dim], row[obs_dim + action_dim],
+                    row[obs_dim + action_dim + 1], next_observation=row[obs_dim + action_dim + 2:]
+                )
+                n_added += 1
+        return n_added
+
+    def get_path_returns(self):
+        """
+        :return: the undiscounted returns of the exploration paths finished since the last call
+        """
+        returns = []
+        while True:
+            try:
+                returns.append(self._returns_queue.get_nowait())
+            except queue.Empty:
+                return returns
+
+    def stop(self):
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
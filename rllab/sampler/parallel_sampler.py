@@ -1,12 +1,15 @@
-from rllab.sampler.utils import rollout
+from rllab.sampler.utils import rollout, vec_rollout_step
 from rllab.sampler.stateful_pool import singleton_pool, SharedGlobal
+from rllab.sampler import shared_paths
 from rllab.misc import ext
 from rllab.misc import logger
 from rllab.misc import tensor_utils
+from rllab.envs.vec_env_executor import VecEnvExecutor
 # import pickle
 import cloudpickle as pickle
 import numpy as np
 import tensorflow as tf
+import uuid
 
 
 def _worker_init(G, id):
@@ -49,18 +52,50 @@ def _worker_terminate_task(G, scope=None):
         G.policy = None
 
 
+def _get_env_generators(env):
+    """
+    Collect the start / goal generators of a curriculum env, if it has any. These are what the curriculum updates
+    between outer iterations, and are much cheaper to ship than the whole env.
+    """
+    generators = dict()
+    for name in ("start_generator", "goal_generator"):
+        generator = getattr(env, name, None)
+        if generator is not None:
+            generators[name] = generator
+    return generators
+
+
+def _update_env_generators(envs, generators):
+    for env in envs:
+        if "start_generator" in generators:
+            env.update_start_generator(generators["start_generator"])
+        if "goal_generator" in generators:
+            env.update_goal_generator(generators["goal_generator"])
+
+
+def _worker_update_env_generators(G, generators, scope=None):
+    G = _get_scoped_G(G, scope)
+    envs = [G.env]
+    if getattr(G, "vec_env", None):
+        envs = G.vec_env.envs
+    _update_env_generators(envs, pickle.loads(generators))
+
+
 _cached_populate_env = dict()
 _cached_populate_policy = dict()
+_cached_populate_generators = dict()
 
 
 def populate_task(env, policy, scope=None):
     if scope in _cached_populate_env and scope in _cached_populate_policy:
         if _cached_populate_env[scope] is env and _cached_populate_policy[scope] is policy:
-            # already populated; return
+            # already populated; only ship what changed on the env since
+            sync_env_generators(scope)
             return
     logger.log("Populating workers...")
     _cached_populate_env[scope] = env
     _cached_populate_policy[scope] = policy
+    _cached_populate_generators[scope] = _get_env_generators(env)
     if singleton_pool.n_parallel > 1:
         singleton_pool.run_each(
             _worker_populate_task,
@@ -74,6 +109,34 @@ def populate_task(env, policy, scope=None):
     logger.log("Populated")
 
 
+def sync_env_generators(scope=None, force=False):
+    """
+    Send to the workers the start / goal generators of the env populated under the given scope that were replaced
+    since it was populated or last synced. Generators are compared by identity, so a generator mutated in place on the
+    master is not shipped again.
+    :param force: send all the generators, e.g. when the worker replicas may have been modified by the tasks run on them
+    """
+    generators = _get_env_generators(_cached_populate_env[scope])
+    changed = dict(
+        (name, generator) for name, generator in generators.items()
+        if force or _cached_populate_generators[scope].get(name) is not generator
+    )
+    _cached_populate_generators[scope] = generators
+    if len(changed) == 0:
+        return
+    if singleton_pool.n_parallel > 1:
+        logger.log("Updating %s on workers..." % ", ".join(sorted(changed.keys())))
+        singleton_pool.run_each(
+            _worker_update_env_generators,
+            [(pickle.dumps(changed), scope)] * singleton_pool.n_parallel
+        )
+    else:
+        # the populated env is the master one; only its vectorized copies, if any, need the update
+        G = _get_scoped_G(singleton_pool.G, scope)
+        if getattr(G, "vec_env", None):
+            _update_env_generators(G.vec_env.envs[1:], changed)
+
+
 def terminate_task(scope=None):
     singleton_pool.run_each(
         _worker_terminate_task,
@@ -81,6 +144,7 @@ def terminate_task(scope=None):
     )
     del _cached_populate_env[scope]
     del _cached_populate_policy[scope]
+    del _cached_populate_generators[scope]
 
 
 def _worker_set_seed(_, seed):
@@ -111,25 +175,124 @@ def _worker_collect_one_path(G, max_path_length, scope=None):
     return path, len(path["rewards"])
 
 
+def _worker_collect_one_path_shared(G, max_path_length, batch_id, capacity, scope=None):
+    G = _get_scoped_G(G, scope)
+    path = rollout(G.env, G.policy, max_path_length)
+    writer = shared_paths.get_path_writer(G, batch_id, capacity)
+    return writer.write(path), len(path["rewards"])
+
+
+def _worker_populate_vec_env(G, n_envs, max_path_length, scope=None):
+    G = _get_scoped_G(G, scope)
+    if getattr(G, "vec_env", None) and G.vec_env.envs[0] is G.env and G.vec_env.num_envs == n_envs:
+        # kept alive from a previous run on the same env
+        G.vec_env.max_path_length = max_path_length
+        return
+    # the first copy is the already populated env; the others are independent replicas of it
+    envs = [G.env] + [pickle.loads(pickle.dumps(G.env)) for _ in range(n_envs - 1)]
+    G.vec_env = VecEnvExecutor(envs, max_path_length)
+
+
+def _worker_terminate_vec_env(G, scope=None):
+    G = _get_scoped_G(G, scope)
+    if getattr(G, "vec_env", None):
+        for env in G.vec_env.envs[1:]:
+            env.terminate()
+        G.vec_env = None
+
+
+def _worker_reset_vec_env(G, scope=None):
+    G = _get_scoped_G(G, scope)
+    G.vec_obses = G.vec_env.reset()
+    G.vec_running_paths = [None] * G.vec_env.num_envs
+
+
+def _worker_collect_vec_paths(G, scope=None, batch_id=None, capacity=None):
+    G = _get_scoped_G(G, scope)
+    finished_paths = []
+    while len(finished_paths) == 0:
+        G.vec_obses, finished_paths = vec_rollout_step(G.vec_env, G.policy, G.vec_obses, G.vec_running_paths)
+    n_samples = sum(len(path["rewards"]) for path in finished_paths)
+    if batch_id is not None:
+        writer = shared_paths.get_path_writer(G, batch_id, capacity)
+        finished_paths = [writer.write(path) for path in finished_paths]
+    return finished_paths, n_samples
+
+
+def _worker_run_task(G, runner, args, scope=None):
+    G = _get_scoped_G(G, scope)
+    return runner(G.env, G.policy, *args)
+
+
+def _worker_run_vec_task(G, runner, args, scope=None):
+    G = _get_scoped_G(G, scope)
+    return runner(G.vec_env, G.policy, *args)
+
+
 # def _worker_collect_one_path_snn(G, max_path_length, switch_lat_every=0, scope=None):
 #     G = _get_scoped_G(G, scope)
 #     path = rollout_snn(G.env, G.policy, max_path_length, switch_lat_every=switch_lat_every)
 #     return path, len(path["rewards"])
 
+def set_policy_params(policy_params, scope=None):
+    singleton_pool.run_each(
+        _worker_set_policy_params,
+        [(policy_params, scope)] * singleton_pool.n_parallel
+    )
+
+
 def sample_paths(
         policy_params,
         max_samples,
         max_path_length=np.inf,
         env_params=None,
-        scope=None):
+        scope=None,
+        shared_memory=False):
     """
     :param policy_params: parameters for the policy. This will be updated on each worker process
     :param max_samples: desired maximum number of samples to be collected. The actual number of collected samples
     might be greater since all trajectories will be rolled out either until termination or until max_path_length is
     reached
     :param max_path_length: horizon / maximum length of a single trajectory
+    :param shared_memory: have the workers write the path arrays to shared memory instead of pickling them back to
+    the master; the returned paths then hold views on that memory. Ignored when running a single process
     :return: a list of collected paths
     """
+    return sample_paths_async(
+        policy_params, max_samples, max_path_length=max_path_length, env_params=env_params, scope=scope,
+        shared_memory=shared_memory,
+    ).get()
+
+
+def sample_paths_async(
+        policy_params,
+        max_samples,
+        max_path_length=np.inf,
+        env_params=None,
+        scope=None,
+        shared_memory=False):
+    """
+    Same as sample_paths, but return as soon as the workers have started collecting.
+    :return: a CollectResult whose get method returns the list of collected paths
+    """
+    _set_task_params(policy_params, env_params, scope)
+    if shared_memory and singleton_pool.n_parallel > 1:
+        return singleton_pool.run_collect_async(
+            _worker_collect_one_path_shared,
+            threshold=max_samples,
+            args=(max_path_length, uuid.uuid4().hex, _shared_capacity(max_samples, max_path_length), scope),
+            postprocess=shared_paths.read_paths,
+        )
+    return singleton_pool.run_collect_async(
+        _worker_collect_one_path,
+        threshold=max_samples,
+        args=(max_path_length, scope),
+    )
+
+
+def _set_task_params(policy_params, env_params, scope):
+    if scope in _cached_populate_env:
+        sync_env_generators(scope)
     singleton_pool.run_each(
         _worker_set_policy_params,
         [(policy_params, scope)] * singleton_pool.n_parallel
@@ -139,14 +302,113 @@ def sample_paths(
             _worker_set_env_params,
             [(env_params, scope)] * singleton_pool.n_parallel
         )
-    return singleton_pool.run_collect(
-        _worker_collect_one_path,
+
+
+def _shared_capacity(max_samples, max_path_length):
+    # a single worker may collect the whole batch, overshooting it by at most one path
+    if np.isfinite(max_path_length):
+        return int(max_samples + max_path_length)
+    return int(max_samples)
+
+
+_cached_vec_env_config = dict()
+
+
+def populate_vec_env(n_envs, max_path_length=np.inf, scope=None):
+    """
+    Replicate the env populated under the given scope n_envs times on each worker, so that the copies can be stepped
+    in lockstep by sample_vec_paths. Must be called after populate_task.
+    """
+    _cached_vec_env_config[scope] = (n_envs, max_path_length)
+    singleton_pool.run_each(
+        _worker_populate_vec_env,
+        [(n_envs, max_path_length, scope)] * singleton_pool.n_parallel
+    )
+
+
+def terminate_vec_env(scope=None):
+    singleton_pool.run_each(
+        _worker_terminate_vec_env,
+        [(scope,)] * singleton_pool.n_parallel
+    )
+    del _cached_vec_env_config[scope]
+
+
+def sample_vec_paths(
+        policy_params,
+        max_samples,
+        env_params=None,
+        scope=None,
+        shared_memory=False):
+    """
+    Same as sample_paths, but each worker steps its vectorized env copies together and queries the policy once per
+    time step for all of them. The horizon is the one given to populate_vec_env.
+    :param shared_memory: see sample_paths
+    :return: a list of collected paths
+    """
+    return sample_vec_paths_async(
+        policy_params, max_samples, env_params=env_params, scope=scope, shared_memory=shared_memory,
+    ).get()
+
+
+def sample_vec_paths_async(
+        policy_params,
+        max_samples,
+        env_params=None,
+        scope=None,
+        shared_memory=False):
+    """
+    Same as sample_vec_paths, but return as soon as the workers have started collecting.
+    :return: a CollectResult whose get method returns the list of collected paths
+    """
+    _set_task_params(policy_params, env_params, scope)
+    # paths still running from the previous call were generated with stale parameters: start all copies afresh
+    singleton_pool.run_each(
+        _worker_reset_vec_env,
+        [(scope,)] * singleton_pool.n_parallel
+    )
+    if shared_memory and singleton_pool.n_parallel > 1:
+        # the last step of a worker can complete one path per env copy
+        n_envs, max_path_length = _cached_vec_env_config[scope]
+        capacity = _shared_capacity(max_samples, n_envs * min(max_path_length, max_samples))
+        return singleton_pool.run_collect_async(
+            _worker_collect_vec_paths,
+            threshold=max_samples,
+            args=(scope, uuid.uuid4().hex, capacity),
+            postprocess=lambda results: shared_paths.read_paths([path for paths in results for path in paths]),
+        )
+    return singleton_pool.run_collect_async(
+        _worker_collect_vec_paths,
         threshold=max_samples,
-        args=(max_path_length, scope),
-        show_prog_bar=True
+        args=(scope,),
+        postprocess=lambda results: [path for paths in results for path in paths],
     )
 
 
+def map_task(runner, args_list, scope=None):
+    """
+    Map runner(env, policy, *args) over args_list on the worker pool, using the env and policy replicas populated
+    under the given scope instead of shipping them with every task.
+    :return: the list of results, in the order of args_list
+    """
+    return singleton_pool.run_map(_worker_run_task, [(runner, args, scope) for args in args_list])
+
+
+def map_task_async(runner, args_list, scope=None):
+    """
+    Same as map_task, but return right after dispatching the tasks.
+    :return: a MapResult, whose get method waits for and returns the list of results
+    """
+    return singleton_pool.run_map_async(_worker_run_task, [(runner, args, scope) for args in args_list])
+
+
+def map_vec_task(runner, args_list, scope=None):
+    """
+    Same as map_task, but runner receives the VecEnvExecutor set up by populate_vec_env instead of the env.
+    """
+    return singleton_pool.run_map(_worker_run_vec_task, [(runner, args, scope) for args in args_list])
+
+
 def truncate_paths(paths, max_samples):
     """
     Truncate the list of paths so that the total number of samples is exactly equal to max_samples. This is done by
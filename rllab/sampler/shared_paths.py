@@ -0,0 +1,145 @@
+import os
+import tempfile
+
+import numpy as np
+
+# per time step arrays of a path; everything else (e.g. last_obs) travels with the descriptor
+_TIME_KEYS = ["observations", "actions", "rewards", "dones"]
+_TIME_DICT_KEYS = ["agent_infos", "env_infos"]
+
+
+def _shared_dir():
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def _flatten_time_arrays(path):
+    """
+    :return: dict from leaf name (e.g. "agent_infos/mean") to the per time step arrays of the path
+    """
+    leaves = dict()
+    for k in _TIME_KEYS:
+        if k in path:
+            leaves[k] = path[k]
+
+    def _flatten_dict(prefix, d):
+        for k, v in d.items():
+            if isinstance(v, dict):
+                _flatten_dict(prefix + k + "/", v)
+            else:
+                leaves[prefix + k] = v
+
+    for k in _TIME_DICT_KEYS:
+        if k in path:
+            _flatten_dict(k + "/", path[k])
+    return leaves
+
+
+def _set_leaf(path, leaf, value):
+    keys = leaf.split("/")
+    d = path
+    for k in keys[:-1]:
+        d = d.setdefault(k, dict())
+    d[keys[-1]] = value
+
+
+class SharedPathWriter(object):
+    """
+    Worker side of the shared memory path transport. The per time step arrays of each written path are copied into
+    memory-mapped files (under /dev/shm when available), one file per array key, preallocated for `capacity` time
+    steps. Only a small descriptor has to be sent back to the master, which maps the same files with read_paths.
+    Arrays that do not fit (non numeric dtype, inconsistent shape, capacity exceeded) are kept inline in the
+    descriptor.
+    """
+
+    def __init__(self, batch_id, capacity):
+        """
+        :param batch_id: unique identifier of the batch being collected; used to name the files
+        :param capacity: number of time steps preallocated per array
+        """
+        self.batch_id = batch_id
+        self.capacity = capacity
+        self.offset = 0
+        self._buffers = dict()
+
+    def _get_buffer(self, leaf, value):
+        if leaf not in self._buffers:
+            filename = os.path.join(
+                _shared_dir(), "rllab_paths_%s_%d_%d" % (self.batch_id, os.getpid(), len(self._buffers)))
+            buffer = np.memmap(filename, dtype=value.dtype, mode="w+", shape=(self.capacity,) + value.shape[1:])
+            self._buffers[leaf] = (filename, buffer)
+        return self._buffers[leaf]
+
+    def write(self, path):
+        """
+        Copy the per time step arrays of the path to shared memory.
+        :return: a picklable descriptor of the path, to be turned back into a path with read_paths
+        """
+        length = len(path["rewards"])
+        fits = self.offset + length <= self.capacity
+        descriptor = dict(
+            length=length,
+            shared=dict(),
+            inline=dict(),
+            extra=dict((k, v) for k, v in path.items() if k not in _TIME_KEYS + _TIME_DICT_KEYS),
+        )
+        for leaf, value in _flatten_time_arrays(path).items():
+            value = np.asarray(value)
+            if fits and value.ndim >= 1 and len(value) == length and value.size > 0 and value.dtype.kind in "biufc":
+                filename, buffer = self._get_buffer(leaf, value)
+                if buffer.dtype == value.dtype and buffer.shape[1:] == value.shape[1:]:
+                    buffer[self.offset:self.offset + length] = value
+                    descriptor["shared"][leaf] = (filename, buffer.dtype.str, buffer.shape, self.offset)
+                    continue
+            descriptor["inline"][leaf] = value
+        if fits:
+            self.offset += length
+        return descriptor
+
+    def close(self):
+        # the master unlinks the files once mapped; dropping the worker's mappings is enough here
+        self._buffers = dict()
+
+
+def get_path_writer(G, batch_id, capacity):
+    """
+    Return the SharedPathWriter of the given batch stored on the (scoped) worker globals, replacing the one of the
+    previous batch.
+    """
+    writer = getattr(G, "path_writer", None)
+    if writer is None or writer.batch_id != batch_id:
+        if writer is not None:
+            writer.close()
+        writer = G.path_writer = SharedPathWriter(batch_id, capacity)
+    return writer
+
+
+def read_paths(descriptors):
+    """
+    Master side of the shared memory path transport. Map the files referenced by the descriptors and rebuild the
+    paths, whose arrays are views on the mapped memory (copy-on-write, so modifying them does not affect the files).
+    The files are unlinked right away; the memory is released once all the views are garbage collected.
+    """
+    mapped = dict()
+    paths = []
+    try:
+        for descriptor in descriptors:
+            length = descriptor["length"]
+            path = dict()
+            for k in _TIME_DICT_KEYS:
+                path[k] = dict()
+            for leaf, value in descriptor["inline"].items():
+                _set_leaf(path, leaf, value)
+            for leaf, (filename, dtype, shape, offset) in descriptor["shared"].items():
+                if filename not in mapped:
+                    mapped[filename] = np.memmap(filename, dtype=np.dtype(dtype), mode="c", shape=shape)
+                _set_leaf(path, leaf, np.asarray(mapped[filename][offset:offset + length]))
+            path.update(descriptor["extra"])
+            paths.append(path)
+    finally:
+        for filename in set(
+                filename for descriptor in descriptors for filename, _, _, _ in descriptor["shared"].values()):
+            if os.path.exists(filename):
+                os.unlink(filename)
+    return paths
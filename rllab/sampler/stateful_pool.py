@@ -1,5 +1,6 @@
 from joblib.pool import MemmapingPool
 import multiprocessing as mp
+import os
 from rllab.misc import logger
 import pyprind
 import time
@@ -41,10 +42,16 @@ class StatefulPool(object):
         self.pool = None
         self.queue = None
         self.worker_queue = None
+        self.collect_counter = None
+        self.collect_done = None
+        self.collect_stats = []
         self.G = SharedGlobal()
+        # process which dispatches the tasks to the workers
+        self.master_pid = os.getpid()
 
     def initialize(self, n_parallel):
         self.n_parallel = n_parallel
+        self.master_pid = os.getpid()
         if self.pool is not None:
             print("Warning: terminating existing pool")
             self.pool.terminate()
@@ -54,6 +61,9 @@ class StatefulPool(object):
         if n_parallel > 1:
             self.queue = mp.Queue()
             self.worker_queue = mp.Queue()
+            # shared with the workers by inheritance, hence created before the pool
+            self.collect_counter = mp.Value('l', 0)
+            self.collect_done = mp.Event()
             # FIXME: memmap is slow.
             # self.pool = MemmapingPool(
             #     self.n_parallel,
@@ -93,6 +103,17 @@ class StatefulPool(object):
                 ret.append(runner(self.G, *args))
             return ret
 
+    def run_map_async(self, runner, args_list):
+        """
+        Same as run_map, but return right after dispatching the tasks to the workers. Several maps can be in flight
+        at a time.
+        :return: a MapResult, whose get method waits for and returns the list of results. Without worker processes,
+        the tasks only run when get is called.
+        """
+        if self.n_parallel > 1:
+            return MapResult(self, results=self.pool.map_async(_worker_run_map, [(runner, args) for args in args_list]))
+        return MapResult(self, runner=runner, args_list=args_list)
+
     def run_imap_unordered(self, runner, args_list):
         if self.n_parallel > 1:
             for x in self.pool.imap_unordered(_worker_run_map, [(runner, args) for args in args_list]):
@@ -115,53 +136,151 @@ class StatefulPool(object):
 
         stateful_pool.run_collect(collect_once, threshold=3) # => ['a', 'a', 'a']
 
+        Per worker statistics of the last call (number of items, total increment and time spent) are kept in
+        collect_stats.
+
         :param collector:
         :param threshold:
         :return:
         """
+        return self.run_collect_async(collect_once, threshold, args=args).get(show_prog_bar=show_prog_bar)
+
+    def run_collect_async(self, collect_once, threshold, args=None, postprocess=None):
+        """
+        Same as run_collect, but return right after dispatching the collection to the workers, so that the master can
+        do other work in the meantime. Only one collection can be in flight at a time.
+        :param postprocess: optional function applied by the master to the list of collected objects
+        :return: a CollectResult, whose get method waits for and returns the collected objects. Without worker
+        processes, the collection itself only runs when get is called.
+        """
         if args is None:
             args = tuple()
         if self.pool:
-            manager = mp.Manager()
-            counter = manager.Value('i', 0)
-            lock = manager.RLock()
+            self.collect_counter.value = 0
+            self.collect_done.clear()
             results = self.pool.map_async(
                 _worker_run_collect,
-                [(collect_once, counter, lock, threshold, args)] * self.n_parallel
+                [(collect_once, threshold, args)] * self.n_parallel
             )
-            if show_prog_bar:
-                pbar = ProgBarCounter(threshold)
-            last_value = 0
-            while True:
-                time.sleep(0.1)
-                with lock:
-                    if counter.value >= threshold:
-                        if show_prog_bar:
-                            pbar.stop()
-                        break
-                    if show_prog_bar:
-                        pbar.inc(counter.value - last_value)
-                    last_value = counter.value
-            print('Done sampling.')
-            start = time.time()
-            out = sum(results.get(), [])
-            stop = time.time()
-            print('Returning results ({} sec).'.format(stop - start))
-            return out
+            return CollectResult(self, threshold, results=results, postprocess=postprocess)
+        return CollectResult(self, threshold, collect_once=collect_once, args=args, postprocess=postprocess)
+
+    def _log_collect_stats(self, elapsed):
+        throughputs = [
+            stats["increment"] / stats["time"] if stats["time"] > 0 else 0.
+            for stats in self.collect_stats
+        ]
+        logger.log("Collected %d in %.2f sec; per worker throughput (/sec): min %.1f, mean %.1f, max %.1f" % (
+            sum(stats["increment"] for stats in self.collect_stats), elapsed,
+            min(throughputs), sum(throughputs) / len(throughputs), max(throughputs)
+        ))
+
+
+class CollectResult(object):
+    """
+    Handle on a collection started by StatefulPool.run_collect_async.
+    """
+
+    def __init__(self, stateful_pool, threshold, results=None, collect_once=None, args=None, postprocess=None):
+        self.stateful_pool = stateful_pool
+        self.threshold = threshold
+        self.results = results
+        self.collect_once = collect_once
+        self.args = args
+        self.postprocess = postprocess
+        self.start_time = time.time()
+        # time spent blocked in get
+        self.wait_time = None
+
+    def then(self, postprocess):
+        """
+        Chain another function to be applied by get on the collected objects.
+        :return: self
+        """
+        if self.postprocess is None:
+            self.postprocess = postprocess
         else:
-            count = 0
-            results = []
+            previous = self.postprocess
+            self.postprocess = lambda out: postprocess(previous(out))
+        return self
+
+    def ready(self):
+        if self.results is None:
+            return False
+        return self.results.ready()
+
+    def get(self, show_prog_bar=True):
+        wait_start = time.time()
+        if self.results is not None:
+            out = self._get_from_workers(show_prog_bar)
+        else:
+            out = self._collect_in_process(show_prog_bar)
+        if self.postprocess is not None:
+            out = self.postprocess(out)
+        self.wait_time = time.time() - wait_start
+        return out
+
+    def _get_from_workers(self, show_prog_bar):
+        pool = self.stateful_pool
+        if show_prog_bar:
+            pbar = ProgBarCounter(self.threshold)
+        last_value = 0
+        # wake up as soon as a worker signals completion; the timeout only paces the progress bar and lets
+        # worker failures surface through results.get()
+        while not pool.collect_done.wait(0.1) and not self.results.ready():
             if show_prog_bar:
-                pbar = ProgBarCounter(threshold)
-            while count < threshold:
-                result, inc = collect_once(self.G, *args)
-                results.append(result)
-                count += inc
-                if show_prog_bar:
-                    pbar.inc(inc)
+                value = pool.collect_counter.value
+                pbar.inc(value - last_value)
+                last_value = value
+        if show_prog_bar:
+            pbar.stop()
+        print('Done sampling.')
+        stop = time.time()
+        results = self.results.get()
+        print('Returning results ({} sec).'.format(time.time() - stop))
+        pool.collect_stats = [stats for _, stats in results]
+        pool._log_collect_stats(stop - self.start_time)
+        return sum([collected for collected, _ in results], [])
+
+    def _collect_in_process(self, show_prog_bar):
+        pool = self.stateful_pool
+        count = 0
+        results = []
+        if show_prog_bar:
+            pbar = ProgBarCounter(self.threshold)
+        start = time.time()
+        while count < self.threshold:
+            result, inc = self.collect_once(pool.G, *self.args)
+            results.append(result)
+            count += inc
             if show_prog_bar:
-                pbar.stop()
-            return results
+                pbar.inc(inc)
+        if show_prog_bar:
+            pbar.stop()
+        pool.collect_stats = [dict(n_items=len(results), increment=count, time=time.time() - start)]
+        return results
+
+
+class MapResult(object):
+    """
+    Handle on a map started by StatefulPool.run_map_async.
+    """
+
+    def __init__(self, stateful_pool, results=None, runner=None, args_list=None):
+        self.stateful_pool = stateful_pool
+        self.results = results
+        self.runner = runner
+        self.args_list = args_list
+
+    def ready(self):
+        if self.results is None:
+            return False
+        return self.results.ready()
+
+    def get(self):
+        if self.results is not None:
+            return self.results.get()
+        return [self.runner(self.stateful_pool.G, *args) for args in self.args_list]
 
 
 singleton_pool = StatefulPool()
@@ -181,18 +300,23 @@ def _worker_run_each(all_args):
 
 def _worker_run_collect(all_args):
     try:
-        collect_once, counter, lock, threshold, args = all_args
+        collect_once, threshold, args = all_args
+        counter = singleton_pool.collect_counter
         collected = []
-        while True:
-            with lock:
-                if counter.value >= threshold:
-                    return collected
+        increment = 0
+        start = time.time()
+        # reading the counter without its lock is fine: at worst one more item gets collected
+        while counter.value < threshold:
             result, inc = collect_once(singleton_pool.G, *args)
             collected.append(result)
-            with lock:
+            increment += inc
+            with counter.get_lock():
                 counter.value += inc
-                if counter.value >= threshold:
-                    return collected
+                total = counter.value
+            if total >= threshold:
+                singleton_pool.collect_done.set()
+                break
+        return collected, dict(n_items=len(collected), increment=increment, time=time.time() - start)
     except Exception:
         raise Exception("".join(traceback.format_exception(*sys.exc_info())))
 
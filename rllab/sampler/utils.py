@@ -50,3 +50,57 @@ def rollout(env, agent, max_path_length=np.inf, animated=False, speedup=1, init_
         dones=np.asarray(dones),
         last_obs=o,
     )
+
+
+def vec_rollout_step(vec_env, agent, obses, running_paths, on_done=None):
+    """
+    Advance every env copy of a VecEnvExecutor by one step, querying the agent once for the whole batch of
+    observations. Copies that finish are reset in place.
+    :param vec_env: a VecEnvExecutor
+    :param agent: a policy; get_actions is used if available
+    :param obses: current observation of each copy
+    :param running_paths: per-copy buffers of the paths in progress (None for a copy that just started); updated in
+    place
+    :param on_done: optional function called with the index of each finished copy and its path, before the copy is
+    reset
+    :return: the next observations and a list of the paths finished during this step, in the format of rollout
+    """
+    if hasattr(agent, "get_actions"):
+        actions, agent_infos = agent.get_actions(obses)
+        agent_infos = tensor_utils.split_tensor_dict_list(agent_infos)
+    else:
+        actions, agent_infos = list(map(list, zip(*[agent.get_action(o) for o in obses])))
+    if agent_infos is None:
+        agent_infos = [dict() for _ in range(vec_env.num_envs)]
+    next_obses, rewards, dones, env_infos = vec_env.step(actions)
+
+    finished_paths = []
+    for idx in range(vec_env.num_envs):
+        if running_paths[idx] is None:
+            running_paths[idx] = dict(
+                observations=[], actions=[], rewards=[], agent_infos=[], env_infos=[], dones=[]
+            )
+        running_path = running_paths[idx]
+        running_path["observations"].append(vec_env.observation_space.flatten(obses[idx]))
+        running_path["actions"].append(vec_env.action_space.flatten(actions[idx]))
+        running_path["rewards"].append(rewards[idx])
+        running_path["agent_infos"].append(agent_infos[idx])
+        running_path["env_infos"].append(env_infos[idx])
+        running_path["dones"].append(dones[idx])
+        if dones[idx]:
+            finished_paths.append(dict(
+                observations=tensor_utils.stack_tensor_list(running_path["observations"]),
+                actions=tensor_utils.stack_tensor_list(running_path["actions"]),
+                rewards=tensor_utils.stack_tensor_list(running_path["rewards"]),
+                agent_infos=tensor_utils.stack_tensor_dict_list(running_path["agent_infos"]),
+                env_infos=tensor_utils.stack_tensor_dict_list(running_path["env_infos"]),
+                dones=np.asarray(running_path["dones"]),
+                last_obs=next_obses[idx],
+            ))
+            running_paths[idx] = None
+            if on_done is not None:
+                on_done(idx, finished_paths[-1])
+
+    reset_obses = vec_env.reset(dones)
+    next_obses = [reset_obses[idx] if dones[idx] else next_obses[idx] for idx in range(vec_env.num_envs)]
+    return next_obses, finished_paths
@@ -0,0 +1,52 @@
+from rllab.sampler import parallel_sampler
+from rllab.sampler.base import BaseSampler
+
+
+class VectorizedSampler(BaseSampler):
+    """
+    Sampler holding n_envs copies of the environment on each worker. The copies are stepped in lockstep and the
+    policy is queried once per time step for all of them through its batched get_actions, which amortizes the per-call
+    overhead of the compiled policy function. Finished copies are restarted independently.
+
+    Use it by passing sampler_cls=VectorizedSampler, sampler_args=dict(n_envs=...) to a BatchPolopt algorithm.
+    """
+
+    def __init__(self, algo, n_envs=8, persistent_workers=False, shared_memory=False):
+        """
+        :type algo: BatchPolopt
+        :param n_envs: number of env copies stepped together on each worker
+        :param persistent_workers: keep the env copies and policy replicas alive on the workers at shutdown, see
+        BatchSampler
+        :param shared_memory: transport the collected paths through shared memory, see BatchSampler
+        """
+        super(VectorizedSampler, self).__init__(algo)
+        self.n_envs = n_envs
+        self.persistent_workers = persistent_workers
+        self.shared_memory = shared_memory
+
+    def start_worker(self):
+        assert not self.algo.policy.recurrent, "VectorizedSampler does not support recurrent policies"
+        parallel_sampler.populate_task(self.algo.env, self.algo.policy, scope=self.algo.scope)
+        parallel_sampler.populate_vec_env(self.n_envs, self.algo.max_path_length, scope=self.algo.scope)
+
+    def shutdown_worker(self):
+        if self.persistent_workers:
+            return
+        parallel_sampler.terminate_vec_env(scope=self.algo.scope)
+        parallel_sampler.terminate_task(scope=self.algo.scope)
+
+    def obtain_samples(self, itr):
+        return self.obtain_samples_async(itr).get()
+
+    def obtain_samples_async(self, itr):
+        cur_params = self.algo.policy.get_param_values()
+        result = parallel_sampler.sample_vec_paths_async(
+            policy_params=cur_params,
+            max_samples=self.algo.batch_size,
+            scope=self.algo.scope,
+            shared_memory=self.shared_memory,
+        )
+        if self.algo.whole_paths:
+            return result
+        else:
+            return result.then(lambda paths: parallel_sampler.truncate_paths(paths, self.algo.batch_size))
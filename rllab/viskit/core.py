@@ -1,11 +1,13 @@
 import csv
 from rllab.misc import ext
+from rllab.misc.tabular_store import is_tabular_store, load_tabular_store
 import os
 import numpy as np
 import base64
 import pickle
 import json
 import itertools
+import multiprocessing
 # import ipywidgets
 # import IPython.display
 # import plotly.offline as po
@@ -21,20 +23,46 @@ def flatten(l):
     return [item for sublist in l for item in sublist]
 
 
+def _to_float_column(column):
+    try:
+        return np.array(column, dtype=float)
+    except ValueError:
+        values = []
+        for v in column:
+            try:
+                values.append(float(v))
+            except ValueError:
+                values.append(0.)
+        return np.array(values)
+
+
 def load_progress(progress_csv_path):
     print("Reading %s" % progress_csv_path)
-    entries = dict()
+    if is_tabular_store(progress_csv_path):
+        return load_progress_store(progress_csv_path)
     with open(progress_csv_path, 'r') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            for k, v in row.items():
-                if k not in entries:
-                    entries[k] = []
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        rows = list(reader)
+    entries = dict()
+    for i, k in enumerate(header):
+        # the values which are not numbers (or missing) are read as 0
+        entries[k] = _to_float_column([row[i] if i < len(row) else '' for row in rows])
+    return entries
+
+
+def load_progress_store(progress_store_path):
+    entries = load_tabular_store(progress_store_path)
+    for k, v in entries.items():
+        if not isinstance(v, np.ndarray):
+            # as for csv files, the values which are not numbers are read as 0
+            column = []
+            for x in v:
                 try:
-                    entries[k].append(float(v))
-                except:
-                    entries[k].append(0.)
-    entries = dict([(k, np.array(v)) for k, v in entries.items()])
+                    column.append(float(x))
+                except ValueError:
+                    column.append(0.)
+            entries[k] = np.array(column)
     return entries
 
 
@@ -93,30 +121,114 @@ def lookup(d, keys):
     return d
 
 
-def load_exps_data(exp_folder_paths, disable_variant=False, ignore_missing_keys=False):
-    exps = []
-    for exp_folder_path in exp_folder_paths:
-        exps += [x[0] for x in os.walk(exp_folder_path, followlinks=True)]
-    print("finished walking exp folders")
-    exps_data = []
-    for exp in exps:
-        try:
-            exp_path = exp
-            params_json_path = os.path.join(exp_path, "params.json")
-            variant_json_path = os.path.join(exp_path, "variant.json")
-            progress_csv_path = os.path.join(exp_path, "progress.csv")
-            progress = load_progress(progress_csv_path)
-            if disable_variant:
+# key: experiment folder, value: (signature of its files, progress, params)
+_exps_index = dict()
+EXPS_INDEX_FILE = '.viskit_index.pkl'
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if os.path.isdir(path):
+        # the columns of a tabular store are in separate files
+        return tuple(sorted((f, _file_signature(os.path.join(path, f))) for f in os.listdir(path)))
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _exp_files(exp_path):
+    progress_path = os.path.join(exp_path, "progress.csv")
+    progress_store_path = os.path.join(exp_path, "progress.store")
+    if os.path.exists(progress_store_path):
+        progress_path = progress_store_path
+    return progress_path, os.path.join(exp_path, "params.json"), os.path.join(exp_path, "variant.json")
+
+
+def _exp_signature(exp_path, disable_variant):
+    return (disable_variant,) + tuple(_file_signature(path) for path in _exp_files(exp_path))
+
+
+def _load_exp(args):
+    exp_path, disable_variant = args
+    progress_csv_path, params_json_path, variant_json_path = _exp_files(exp_path)
+    try:
+        progress = load_progress(progress_csv_path)
+        if disable_variant:
+            params = load_params(params_json_path)
+        else:
+            try:
+                params = load_params(variant_json_path)
+            except IOError:
                 params = load_params(params_json_path)
-            else:
-                try:
-                    params = load_params(variant_json_path)
-                except IOError:
-                    params = load_params(params_json_path)
-            exps_data.append(ext.AttrDict(
-                progress=progress, params=params, flat_params=flatten_dict(params)))
-        except IOError as e:
-            print(e)
+    except IOError as e:
+        print(e)
+        return None
+    return progress, params
+
+
+def _read_exps_index(exp_folder_path):
+    try:
+        with open(os.path.join(exp_folder_path, EXPS_INDEX_FILE), 'rb') as f:
+            return pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return dict()
+
+
+def _write_exps_index(exp_folder_path, index):
+    file_name = os.path.join(exp_folder_path, EXPS_INDEX_FILE)
+    tmp_file_name = "%s.tmp.%d" % (file_name, os.getpid())
+    try:
+        with open(tmp_file_name, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file_name, file_name)
+    except IOError as e:
+        print("Could not write the index of %s: %s" % (exp_folder_path, e))
+
+
+def load_exps_data(exp_folder_paths, disable_variant=False, ignore_missing_keys=False, n_processes=1,
+                   use_index=True):
+    """
+    :param n_processes: number of processes loading the experiments
+    :param use_index: keep the loaded experiments, in memory and in an index file in each experiment folder, and
+    only load the experiments whose files were added or changed since (based on their modification time and size)
+    """
+    exps_data = []
+    for exp_folder_path in exp_folder_paths:
+        exps = [x[0] for x in os.walk(exp_folder_path, followlinks=True)]
+        signatures = [_exp_signature(exp, disable_variant) for exp in exps]
+        index = _exps_index
+        if use_index and not all(exp in index and index[exp][0] == signature
+                                 for exp, signature in zip(exps, signatures)):
+            index = dict(_exps_index, **_read_exps_index(exp_folder_path))
+        to_load = [(exp, signature) for exp, signature in zip(exps, signatures)
+                   if not use_index or exp not in index or index[exp][0] != signature]
+        # the folders without progress file can be skipped without reading them
+        to_load = [(exp, signature) for exp, signature in to_load if signature[1] is not None]
+        if len(to_load) > 0:
+            print("loading %d of %d experiment folders" % (len(to_load), len(exps)))
+        load_args = [(exp, disable_variant) for exp, _ in to_load]
+        if n_processes > 1 and len(to_load) > 1:
+            with multiprocessing.Pool(n_processes) as pool:
+                loaded = pool.map(_load_exp, load_args)
+        else:
+            loaded = list(map(_load_exp, load_args))
+        index = dict(index)
+        for (exp, signature), data in zip(to_load, loaded):
+            if data is not None:
+                index[exp] = (signature,) + data
+        folder_index = dict()
+        for exp, signature in zip(exps, signatures):
+            if exp in index and index[exp][0] == signature:
+                folder_index[exp] = index[exp]
+                _, progress, params = index[exp]
+                exps_data.append(ext.AttrDict(
+                    progress=progress, params=params, flat_params=flatten_dict(params)))
+        if use_index:
+            _exps_index.update(folder_index)
+            if len(to_load) > 0:
+                _write_exps_index(exp_folder_path, folder_index)
+    print("finished loading exp folders")
 
     # a dictionary of all keys and types of values
     all_keys = dict()
@@ -11,6 +11,7 @@ from rllab.viskit import core
 from rllab.misc import ext
 import sys
 import argparse
+import multiprocessing
 import json
 import numpy as np
 # import threading, webbrowser
@@ -721,11 +722,19 @@ def index():
     )
 
 
+@app.route("/reload")
+def reload():
+    # only the new or changed experiments are loaded again
+    reload_data()
+    return flask.redirect("/")
+
+
 def reload_data():
     global exps_data
     global plottable_keys
     global distinct_params
-    exps_data = core.load_exps_data(args.data_paths, args.disable_variant)
+    exps_data = core.load_exps_data(args.data_paths, args.disable_variant, n_processes=args.n_processes,
+                                    use_index=not args.no_index)
     plottable_keys = sorted(list(
         set(flatten(list(exp.progress.keys()) for exp in exps_data))))
     distinct_params = sorted(core.extract_distinct_params(exps_data))
@@ -738,6 +747,10 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true", default=False)
     parser.add_argument("--port", type=int, default=5000)
     parser.add_argument("--disable-variant", default=False, action='store_true')
+    parser.add_argument("--n_processes", type=int, default=multiprocessing.cpu_count(),
+                        help='Number of processes loading the experiments')
+    parser.add_argument("--no-index", default=False, action='store_true',
+                        help='Do not use the index of the experiments loaded before')
     parser.add_argument("-o", default=False, action='store_true',
         help='Open a brower tab automatically')
     args = parser.parse_args(sys.argv[1:])
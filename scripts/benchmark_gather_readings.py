@@ -0,0 +1,79 @@
+"""
+Microbenchmark of the object sensor readings of GatherEnv.get_readings: the former loop over the objects sorted by
+distance against the vectorized object_readings, for increasing numbers of objects.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from rllab.envs.mujoco.gather.gather_env_utils import objects_to_array, object_readings
+
+APPLE = 0
+BOMB = 1
+
+
+def sorted_loop(objects, robot_x, robot_y, ori, n_bins, sensor_range, sensor_span):
+    apple_readings = np.zeros(n_bins)
+    bomb_readings = np.zeros(n_bins)
+    sorted_objects = sorted(
+        objects, key=lambda o:
+        (o[0] - robot_x) ** 2 + (o[1] - robot_y) ** 2)[::-1]
+    bin_res = sensor_span / n_bins
+    for ox, oy, typ in sorted_objects:
+        dist = ((oy - robot_y) ** 2 + (ox - robot_x) ** 2) ** 0.5
+        if dist > sensor_range:
+            continue
+        angle = math.atan2(oy - robot_y, ox - robot_x) - ori
+        angle = angle % (2 * math.pi)
+        if angle > math.pi:
+            angle = angle - 2 * math.pi
+        if angle < -math.pi:
+            angle = angle + 2 * math.pi
+        half_span = sensor_span * 0.5
+        if abs(angle) > half_span:
+            continue
+        bin_number = int((angle + half_span) / bin_res)
+        intensity = 1.0 - dist / sensor_range
+        if typ == APPLE:
+            apple_readings[bin_number] = intensity
+        else:
+            bomb_readings[bin_number] = intensity
+    return apple_readings, bomb_readings
+
+
+def vectorized(objects, robot_x, robot_y, ori, n_bins, sensor_range, sensor_span):
+    readings = object_readings(objects, robot_x, robot_y, ori, n_bins, sensor_range, sensor_span)
+    return readings[APPLE], readings[BOMB]
+
+
+def timeit(fn, robots, objects, args):
+    start = time.time()
+    outs = [fn(objects, x, y, ori, *args) for x, y, ori in robots]
+    return outs, (time.time() - start) / len(robots)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_objects', type=int, nargs='+', default=[16, 50, 100, 200])
+    parser.add_argument('--n_steps', type=int, default=1000)
+    parser.add_argument('--activity_range', type=float, default=6.)
+    parser.add_argument('--n_bins', type=int, default=10)
+    parser.add_argument('--sensor_range', type=float, default=6.)
+    args = parser.parse_args()
+
+    sensor_args = (args.n_bins, args.sensor_range, math.pi)
+    for n_objects in args.n_objects:
+        objects = [(x, y, typ) for x, y, typ in zip(
+            np.random.uniform(-args.activity_range, args.activity_range, size=n_objects),
+            np.random.uniform(-args.activity_range, args.activity_range, size=n_objects),
+            np.random.randint(2, size=n_objects))]
+        robots = np.random.uniform(-args.activity_range, args.activity_range, size=(args.n_steps, 3))
+
+        loop_readings, loop_time = timeit(sorted_loop, robots, objects, sensor_args)
+        vec_readings, vec_time = timeit(vectorized, robots, objects_to_array(objects), sensor_args)
+        assert np.allclose(np.array(loop_readings), np.array(vec_readings))
+
+        print("%d objects: loop %.1f us/step, vectorized %.1f us/step (%.1fx)" % (
+            n_objects, loop_time * 1e6, vec_time * 1e6, loop_time / vec_time))
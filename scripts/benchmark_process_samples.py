@@ -0,0 +1,61 @@
+"""
+Microbenchmark of the advantage / return computation of BaseSampler.process_samples: the former per-path loop
+(two discount_cumsum calls per path, then concatenation) against the packed single-scan version.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from rllab.misc import special
+
+
+def per_path_loop(paths, discount, gae_lambda):
+    advantages = []
+    returns = []
+    for path in paths:
+        path_baselines = np.append(path["baselines"], 0)
+        deltas = path["rewards"] + discount * path_baselines[1:] - path_baselines[:-1]
+        advantages.append(special.discount_cumsum(deltas, discount * gae_lambda))
+        returns.append(special.discount_cumsum(path["rewards"], discount))
+    return np.concatenate(advantages), np.concatenate(returns)
+
+
+def packed_scan(paths, discount, gae_lambda):
+    path_lengths = np.array([len(path["rewards"]) for path in paths])
+    valids = np.arange(np.max(path_lengths)) < path_lengths.reshape((-1, 1))
+    rewards = np.zeros(valids.shape)
+    rewards[valids] = np.concatenate([path["rewards"] for path in paths])
+    baselines = np.zeros(valids.shape)
+    baselines[valids] = np.concatenate([path["baselines"] for path in paths])
+    advantages, returns = special.gae_advantages_n(rewards, baselines, discount, gae_lambda)
+    return advantages[valids], returns[valids]
+
+
+def timeit(fn, n_repeats, *args):
+    times = []
+    for _ in range(n_repeats):
+        start = time.time()
+        out = fn(*args)
+        times.append(time.time() - start)
+    return out, np.min(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_paths', type=int, default=10000)
+    parser.add_argument('--min_length', type=int, default=5)
+    parser.add_argument('--max_length', type=int, default=50)
+    parser.add_argument('--n_repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    lengths = np.random.randint(args.min_length, args.max_length + 1, size=args.n_paths)
+    paths = [dict(rewards=np.random.randn(l), baselines=np.random.randn(l)) for l in lengths]
+
+    (loop_adv, loop_ret), loop_time = timeit(per_path_loop, args.n_repeats, paths, 0.99, 0.97)
+    (scan_adv, scan_ret), scan_time = timeit(packed_scan, args.n_repeats, paths, 0.99, 0.97)
+    assert np.allclose(loop_adv, scan_adv) and np.allclose(loop_ret, scan_ret)
+
+    print("%d paths, %d samples" % (args.n_paths, np.sum(lengths)))
+    print("per path loop: %.4f sec" % loop_time)
+    print("packed scan:   %.4f sec (%.1fx)" % (scan_time, loop_time / scan_time))
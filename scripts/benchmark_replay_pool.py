@@ -0,0 +1,103 @@
+"""
+Microbenchmark of the replay pools' random_batch: the former one-index-at-a-time loop against the vectorized
+sampling of SimpleReplayPool and ReplayPool, and the sum-tree backed PrioritizedReplayPool.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from rllab.algos.ddpg import SimpleReplayPool, PrioritizedReplayPool
+from rllab.algos.util import ReplayPool
+
+
+def simple_pool_loop(pool, batch_size):
+    indices = np.zeros(batch_size, dtype='uint64')
+    transition_indices = np.zeros(batch_size, dtype='uint64')
+    count = 0
+    while count < batch_size:
+        index = np.random.randint(pool._bottom, pool._bottom + pool._size) % pool._max_pool_size
+        if index == pool._size - 1 and pool._size <= pool._max_pool_size:
+            continue
+        transition_index = (index + 1) % pool._max_pool_size
+        indices[count] = index
+        transition_indices[count] = transition_index
+        count += 1
+    return dict(
+        observations=pool._observations[indices],
+        actions=pool._actions[indices],
+        rewards=pool._rewards[indices],
+        terminals=pool._terminals[indices],
+        next_observations=pool._observations[transition_indices]
+    )
+
+
+def replay_pool_loop(pool, batch_size):
+    observations = np.zeros((batch_size, pool.concat_length) + pool.observation_shape, dtype=pool.observation_dtype)
+    actions = np.zeros((batch_size, pool.action_dim), dtype=pool.action_dtype)
+    rewards = np.zeros((batch_size,), dtype=pool.rewards.dtype)
+    terminals = np.zeros((batch_size,), dtype='bool')
+    next_observations = np.zeros(
+        (batch_size, pool.concat_length) + pool.observation_shape, dtype=pool.observation_dtype)
+    next_actions = np.zeros((batch_size, pool.action_dim), dtype=pool.action_dtype)
+    count = 0
+    while count < batch_size:
+        index = pool.rng.randint(pool.bottom, pool.bottom + pool.size - pool.concat_length)
+        initial_indices = np.arange(index, index + pool.concat_length)
+        transition_indices = initial_indices + 1
+        end_index = index + pool.concat_length - 1
+        if np.any(pool.terminals.take(initial_indices[0:-1], mode='wrap')):
+            continue
+        observations[count] = pool.observations.take(initial_indices, axis=0, mode='wrap')
+        actions[count] = pool.actions.take(end_index, axis=0, mode='wrap')
+        rewards[count] = pool.rewards.take(end_index, mode='wrap')
+        terminals[count] = pool.terminals.take(end_index, mode='wrap')
+        next_observations[count] = pool.observations.take(transition_indices, axis=0, mode='wrap')
+        next_actions[count] = pool.actions.take(end_index + 1, axis=0, mode='wrap')
+        count += 1
+    return dict(observations=observations, actions=actions, rewards=rewards, terminals=terminals,
+                next_observations=next_observations, next_actions=next_actions)
+
+
+def timeit(fn, n_batches):
+    start = time.time()
+    for _ in range(n_batches):
+        fn()
+    return (time.time() - start) / n_batches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pool_size', type=int, default=100000)
+    parser.add_argument('--observation_dim', type=int, default=20)
+    parser.add_argument('--action_dim', type=int, default=6)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--concat_length', type=int, default=4)
+    parser.add_argument('--n_batches', type=int, default=2000)
+    args = parser.parse_args()
+
+    simple_pool = SimpleReplayPool(args.pool_size, args.observation_dim, args.action_dim)
+    prioritized_pool = PrioritizedReplayPool(args.pool_size, args.observation_dim, args.action_dim)
+    replay_pool = ReplayPool(
+        (args.observation_dim,), args.action_dim, args.pool_size,
+        concat_observations=args.concat_length > 1, concat_length=args.concat_length)
+    for _ in range(args.pool_size + args.pool_size // 2):
+        sample = (np.random.randn(args.observation_dim), np.random.randn(args.action_dim), np.random.randn(),
+                  np.random.uniform() < 0.01)
+        simple_pool.add_sample(*sample)
+        prioritized_pool.add_sample(*sample)
+        replay_pool.add_sample(*sample)
+
+    def prioritized_step():
+        batch = prioritized_pool.random_batch(args.batch_size)
+        prioritized_pool.update_priorities(batch["indices"], np.random.randn(args.batch_size))
+
+    results = [
+        ("SimpleReplayPool loop", timeit(lambda: simple_pool_loop(simple_pool, args.batch_size), args.n_batches)),
+        ("SimpleReplayPool", timeit(lambda: simple_pool.random_batch(args.batch_size), args.n_batches)),
+        ("PrioritizedReplayPool (sample + update)", timeit(prioritized_step, args.n_batches)),
+        ("ReplayPool loop", timeit(lambda: replay_pool_loop(replay_pool, args.batch_size), args.n_batches)),
+        ("ReplayPool", timeit(lambda: replay_pool.random_batch(args.batch_size), args.n_batches)),
+    ]
+    for name, batch_time in results:
+        print("%-40s %.1f us/batch" % (name, batch_time * 1e6))
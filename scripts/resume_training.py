@@ -4,7 +4,6 @@
 from rllab.sampler.utils import rollout
 from rllab.algos.batch_polopt import BatchPolopt
 import argparse
-import joblib
 import uuid
 import os
 import random
@@ -12,6 +11,7 @@ import numpy as np
 import json
 import subprocess
 from rllab.misc import logger
+from rllab.misc.snapshot import load_snapshot
 from rllab.misc.instrument import to_local_command
 
 filename = str(uuid.uuid4())
@@ -52,7 +52,7 @@ if __name__ == "__main__":
                 raise
     except IOError as e:
         logger.log("Failed to find json file. Continuing in non-stub mode...")
-        data = joblib.load(args.file)
+        data = load_snapshot(args.file)
         assert 'algo' in data
         algo = data['algo']
         assert isinstance(algo, BatchPolopt)
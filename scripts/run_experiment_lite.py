@@ -5,6 +5,7 @@ from rllab.misc.ext import is_iterable, set_seed
 from rllab.misc.instrument import concretize
 from rllab import config
 import rllab.misc.logger as logger
+from rllab.misc.snapshot import load_snapshot
 import argparse
 import os.path as osp
 import datetime
@@ -13,7 +14,6 @@ import ast
 import uuid
 import pickle as pickle
 import base64
-import joblib
 
 import logging
 
@@ -41,6 +41,11 @@ def run_experiment(argv):
                              '(do not save snapshots)')
     parser.add_argument('--snapshot_gap', type=int, default=1,
                         help='Gap between snapshot iterations.')
+    parser.add_argument('--snapshot_format', type=str, default='pickle',
+                        help='Format of the snapshots. Can be either "pickle" or "compact" (the components which did not '
+                             'change since the previous snapshot are not written again)')
+    parser.add_argument('--snapshot_async', type=ast.literal_eval, default=False,
+                        help='Whether to write the snapshots in a background thread')
     parser.add_argument('--tabular_log_file', type=str, default='progress.csv',
                         help='Name of the tabular log file (in csv).')
     parser.add_argument('--text_log_file', type=str, default='debug.log',
@@ -104,11 +109,13 @@ def run_experiment(argv):
     logger.set_tf_summary_dir(osp.join(log_dir, "tf_summary"))
     logger.set_snapshot_mode(args.snapshot_mode)
     logger.set_snapshot_gap(args.snapshot_gap)
+    logger.set_snapshot_format(args.snapshot_format)
+    logger.set_snapshot_async(args.snapshot_async)
     logger.set_log_tabular_only(args.log_tabular_only)
     logger.push_prefix("[%s] " % args.exp_name)
 
     if args.resume_from is not None:
-        data = joblib.load(args.resume_from)
+        data = load_snapshot(args.resume_from)
         assert 'algo' in data
         algo = data['algo']
         maybe_iter = algo.train()
@@ -128,6 +135,7 @@ def run_experiment(argv):
                 for _ in maybe_iter:
                     pass
 
+    logger.flush_snapshots()
     logger.set_snapshot_mode(prev_mode)
     logger.set_snapshot_dir(prev_snapshot_dir)
     logger.remove_tabular_output(tabular_log_file)
@@ -1,11 +1,11 @@
 import os.path as osp
 import argparse
 import pickle
-import joblib
 import tensorflow as tf
 
 from rllab.sampler.utils import rollout
 from rllab.misc.ext import set_seed
+from rllab.misc.snapshot import load_snapshot
 
 if __name__ == "__main__":
 
@@ -40,7 +40,7 @@ if __name__ == "__main__":
         all_feasible_starts = pickle.load(open(args.collection_file, 'rb'))
 
     with tf.Session() as sess:
-        data = joblib.load(args.file)
+        data = load_snapshot(args.file)
         if "algo" in data:
             policy = data["algo"].policy
             env = data["algo"].env
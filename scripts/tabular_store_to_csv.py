@@ -0,0 +1,21 @@
+"""
+Export the columnar tabular logs (e.g. progress.store) of experiments to csv files, for the tools reading csv only.
+"""
+import argparse
+import os.path as osp
+
+from rllab.misc.tabular_store import export_csv
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stores', type=str, nargs='+', help='paths to the stores')
+    parser.add_argument('--csv_file', type=str, default=None,
+                        help='path of the csv file, if there is a single store. Defaults to the path of the store '
+                             'with the .csv extension')
+    args = parser.parse_args()
+
+    assert args.csv_file is None or len(args.stores) == 1
+    for store in args.stores:
+        csv_file = args.csv_file or osp.splitext(store.rstrip('/'))[0] + '.csv'
+        export_csv(store, csv_file)
+        print("Exported %s to %s" % (store, csv_file))